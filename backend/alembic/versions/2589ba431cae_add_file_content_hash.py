@@ -0,0 +1,28 @@
+"""add file content hash
+
+Revision ID: 2589ba431cae
+Revises: 977d0268b3db
+Create Date: 2026-10-18 13:20:05.316742
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2589ba431cae'
+down_revision: Union[str, None] = '977d0268b3db'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('files', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_files_content_hash'), 'files', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_files_content_hash'), table_name='files')
+    op.drop_column('files', 'content_hash')
@@ -0,0 +1,29 @@
+"""add message history index
+
+Revision ID: 2699470c22ac
+Revises: 69d31a014668
+Create Date: 2026-10-18 16:42:13.905118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2699470c22ac'
+down_revision: Union[str, None] = '69d31a014668'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_conversation_created_id', 'messages', ['conversation_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    # 新索引以外键列开头，MySQL会自动删除原来为外键生成的索引；
+    # 先恢复该外键索引，否则删除新索引时会报“外键需要该索引”
+    op.create_index('conversation_id', 'messages', ['conversation_id'], unique=False)
+    op.drop_index('ix_messages_conversation_created_id', table_name='messages')
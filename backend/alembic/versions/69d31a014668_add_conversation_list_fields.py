@@ -0,0 +1,55 @@
+"""add conversation list fields
+
+Revision ID: 69d31a014668
+Revises: 7689d8a0d038
+Create Date: 2026-10-18 16:10:27.361902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '69d31a014668'
+down_revision: Union[str, None] = '7689d8a0d038'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('conversations', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('conversations', sa.Column('last_message_preview', sa.String(length=200), nullable=True))
+    op.add_column('conversations', sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_conversations_updated_at_id', 'conversations', ['updated_at', 'id'], unique=False)
+
+    # 根据已有消息回填统计字段
+    op.execute("""
+        UPDATE conversations c
+        JOIN (
+            SELECT conversation_id, COUNT(*) AS message_count, MAX(created_at) AS last_message_at
+            FROM messages
+            WHERE conversation_id IS NOT NULL
+            GROUP BY conversation_id
+        ) s ON s.conversation_id = c.id
+        SET c.message_count = s.message_count,
+            c.last_message_at = s.last_message_at
+    """)
+    op.execute("""
+        UPDATE conversations c
+        JOIN messages m ON m.id = (
+            SELECT m2.id FROM messages m2
+            WHERE m2.conversation_id = c.id
+            ORDER BY m2.created_at DESC, m2.id DESC
+            LIMIT 1
+        )
+        SET c.last_message_preview = LEFT(m.content, 100)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_updated_at_id', table_name='conversations')
+    op.drop_column('conversations', 'last_message_at')
+    op.drop_column('conversations', 'last_message_preview')
+    op.drop_column('conversations', 'message_count')
@@ -0,0 +1,48 @@
+"""add file blobs
+
+Revision ID: 7689d8a0d038
+Revises: 2589ba431cae
+Create Date: 2026-10-18 15:02:41.508163
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7689d8a0d038'
+down_revision: Union[str, None] = '2589ba431cae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('file_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('storage_path', sa.String(length=512), nullable=False),
+    sa.Column('file_size', sa.BigInteger(), nullable=False),
+    sa.Column('mime_type', sa.String(length=100), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_file_blobs_content_hash'), 'file_blobs', ['content_hash'], unique=True)
+    op.add_column('files', sa.Column('blob_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_files_blob_id'), 'files', ['blob_id'], unique=False)
+    op.create_foreign_key('fk_files_blob_id_file_blobs', 'files', 'file_blobs', ['blob_id'], ['id'])
+    op.add_column('analysis_records', sa.Column('request_hash', sa.String(length=40), nullable=True))
+    op.create_index(op.f('ix_analysis_records_request_hash'), 'analysis_records', ['request_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_analysis_records_request_hash'), table_name='analysis_records')
+    op.drop_column('analysis_records', 'request_hash')
+    op.drop_constraint('fk_files_blob_id_file_blobs', 'files', type_='foreignkey')
+    op.drop_index(op.f('ix_files_blob_id'), table_name='files')
+    op.drop_column('files', 'blob_id')
+    op.drop_index(op.f('ix_file_blobs_content_hash'), table_name='file_blobs')
+    op.drop_table('file_blobs')
@@ -0,0 +1,38 @@
+"""add conversation summaries
+
+Revision ID: 977d0268b3db
+Revises: 9fa3f0219eaf
+Create Date: 2026-10-18 11:03:47.581920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '977d0268b3db'
+down_revision: Union[str, None] = '9fa3f0219eaf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('conversation_summaries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('summarized_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_conversation_summaries_conversation_id'), 'conversation_summaries', ['conversation_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_conversation_summaries_conversation_id'), table_name='conversation_summaries')
+    op.drop_table('conversation_summaries')
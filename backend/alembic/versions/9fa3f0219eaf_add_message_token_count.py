@@ -0,0 +1,26 @@
+"""add message token count
+
+Revision ID: 9fa3f0219eaf
+Revises: fbb430ec324f
+Create Date: 2026-10-18 10:12:31.204118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9fa3f0219eaf'
+down_revision: Union[str, None] = 'fbb430ec324f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('token_count', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'token_count')
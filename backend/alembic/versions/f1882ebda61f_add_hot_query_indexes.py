@@ -0,0 +1,38 @@
+"""add hot query indexes
+
+Revision ID: f1882ebda61f
+Revises: 2699470c22ac
+Create Date: 2026-10-18 17:05:41.228317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1882ebda61f'
+down_revision: Union[str, None] = '2699470c22ac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_conversation_role_created', 'messages', ['conversation_id', 'role', 'created_at'], unique=False)
+    op.create_index('ix_revision_tasks_plan_status_scheduled', 'revision_tasks', ['plan_id', 'status', 'scheduled_date'], unique=False)
+    op.create_index('ix_revision_tasks_scheduled_date', 'revision_tasks', ['scheduled_date'], unique=False)
+    op.create_index('ix_revision_histories_task_id', 'revision_histories', ['task_id'], unique=False)
+    op.create_index('ix_revision_histories_revision_date', 'revision_histories', ['revision_date'], unique=False)
+
+
+def downgrade() -> None:
+    # 新索引以外键列开头时，MySQL会自动删除原来为外键生成的索引；
+    # 先恢复这些外键索引，否则删除新索引时会报“外键需要该索引”
+    op.create_index('task_id', 'revision_histories', ['task_id'], unique=False)
+    op.create_index('plan_id', 'revision_tasks', ['plan_id'], unique=False)
+    op.drop_index('ix_revision_histories_revision_date', table_name='revision_histories')
+    op.drop_index('ix_revision_histories_task_id', table_name='revision_histories')
+    op.drop_index('ix_revision_tasks_scheduled_date', table_name='revision_tasks')
+    op.drop_index('ix_revision_tasks_plan_status_scheduled', table_name='revision_tasks')
+    op.drop_index('ix_messages_conversation_role_created', table_name='messages')
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Form, File as FileParam
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.db.database import get_db
+from app.db.database import get_db, AsyncSessionLocal
 from app.models.schemas import (
     ChatRequest, 
     ChatResponse, 
@@ -10,18 +10,18 @@ from app.models.schemas import (
     ImageChatRequest, 
     ImageChatResponse, 
     FileChatRequest, 
-    FileChatResponse, 
-    MessageCreate
+    FileChatResponse
 )
 from app.db.models import File
 from app.services import chat as chat_service
 from app.core.logging import app_logger
 from app.services.exceptions import NotFoundError, APIError
 from app.services.ai_client import ai_client
-from app.services.context import get_conversation, get_context_messages, add_message, get_last_user_message
+from app.services.context import get_conversation_id, get_context_messages, get_last_user_message, HistoryPage
 from app.services.file_service import file_service, UploadFile
 from app.services.image_service import image_service
 from app.services.document_service import document_service
+from app.services.message_writer import MessageWriter, save_assistant_reply
 from app.core.config import settings
 import json
 import asyncio
@@ -38,6 +38,20 @@ from pydantic import BaseModel
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+def stream_protocol(
+    protocol: str = Query(
+        chat_service.STREAM_PROTOCOL_FULL,
+        description="流式协议：full 每个数据块携带累计全文，delta 仅发送增量和序号"
+    )
+) -> str:
+    """校验流式协议参数"""
+    if protocol not in chat_service.STREAM_PROTOCOLS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"不支持的流式协议: {protocol}，可选值: {', '.join(chat_service.STREAM_PROTOCOLS)}"
+        )
+    return protocol
+
 @router.post("/{session_id}", response_model=ChatResponse, 
     summary="发送聊天消息",
     description="发送一条消息并获取AI回复")
@@ -138,29 +152,32 @@ async def init_stream_chat(
     description="获流式聊天的SSE响应")
 async def stream_chat(
     session_id: str,
+    protocol: str = Depends(stream_protocol),
     db: AsyncSession = Depends(get_db)
 ):
     """
     处理SSE流式响应
     
     - **session_id**: 会话ID
+    - **protocol**: 流式协议（full/delta）
     """
     try:
-        # 验证会话是否已初始化
-        if not ai_client.is_session_initialized(session_id):
+        # 验证流是否已初始化（流经由Redis中转，可由任意worker处理）
+        if not await ai_client.is_stream_initialized(session_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="会话未初始化，请先调用初始化接口"
             )
 
         return StreamingResponse(
-            chat_service.process_stream_chat(db, session_id),
+            chat_service.process_stream_chat(db, session_id, protocol),
             media_type="text/event-stream",
             headers={
                 'Cache-Control': 'no-cache',
                 'Connection': 'keep-alive',
                 'X-Accel-Buffering': 'no',
                 'Content-Type': 'text/event-stream',
+                'X-Stream-Protocol': protocol,
                 # 添加CORS相关头
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
@@ -181,8 +198,8 @@ async def get_chat_history(
 ):
     """获取完整的对话历史"""
     try:
-        conversation = await get_conversation(db, session_id)
-        if not conversation:
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在"
@@ -190,7 +207,7 @@ async def get_chat_history(
             
         messages = await get_context_messages(
             db,
-            conversation.id,
+            conversation_id,
             limit=100  # 可以根据需求调整限制
         )
         
@@ -202,6 +219,42 @@ async def get_chat_history(
             detail="获取对话历史失败"
         )
 
+@router.get("/{session_id}/history/page",
+    summary="分页获取对话历史",
+    description="按从新到旧的顺序返回一页历史消息，使用返回的next_cursor作为before参数继续向前翻页")
+async def get_chat_history_page(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=500, description="每页消息数"),
+    before: Optional[str] = Query(None, description="上一页返回的next_cursor"),
+    db: AsyncSession = Depends(get_db)
+):
+    """分页获取对话历史，响应体边查询边输出"""
+    conversation_id = await get_conversation_id(db, session_id)
+    if conversation_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在"
+        )
+    try:
+        page = HistoryPage(conversation_id, limit, before)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    async def generate_page():
+        # 使用独立的数据库会话，请求依赖的会话在响应开始前已经关闭
+        async with AsyncSessionLocal() as stream_db:
+            yield '{"items":['
+            separator = ""
+            async for message in page.iterate(stream_db):
+                yield separator + message.model_dump_json()
+                separator = ","
+            yield f'],"next_cursor":{json.dumps(page.next_cursor)}}}'
+
+    return StreamingResponse(generate_page(), media_type="application/json")
+
 @router.post("/{session_id}/image", response_model=ImageChatResponse)
 async def image_chat(
     session_id: str,
@@ -304,24 +357,9 @@ async def file_chat(
             session_id=session_id
         )
 
-        # 根据文件类型选择处理方法
-        if request.file_type == "image":
-            result = await analyze_image(
-                db=db,
-                file_id=saved_file.file_id,
-                query=request.message,
-                system_prompt=request.system_prompt
-            )
-            response = result["analysis"]
-        else:
-            # 处理文档类型文件
-            result = await document_service.analyze_document(
-                db=db,
-                file_id=saved_file.file_id,
-                query=request.message,
-                system_prompt=request.system_prompt
-            )
-            response = result["analysis"]
+        response = await _analyze_saved_file(
+            db, saved_file, request.file_type, request.message, request.system_prompt
+        )
 
         return FileChatResponse(
             session_id=session_id,
@@ -336,6 +374,84 @@ async def file_chat(
             detail=str(e)
         ) 
 
+async def _analyze_saved_file(
+    db: AsyncSession,
+    saved_file: File,
+    file_type: str,
+    message: str,
+    system_prompt: Optional[str]
+) -> str:
+    """根据文件类型选择处理方法，返回分析结果"""
+    if file_type == "image":
+        result = await image_service.analyze_image(
+            db=db,
+            file_id=saved_file.file_id,
+            query=message,
+            system_prompt=system_prompt
+        )
+    else:
+        # 处理文档类型文件
+        result = await document_service.analyze_document(
+            db=db,
+            file_id=saved_file.file_id,
+            query=message,
+            system_prompt=system_prompt
+        )
+    return result["analysis"]
+
+@router.post("/{session_id}/file/upload", response_model=FileChatResponse,
+    summary="上传文件并聊天",
+    description="以multipart/form-data方式上传文件并获取AI回复，文件分块写入磁盘，不经过base64编码")
+async def upload_file_chat(
+    session_id: str,
+    file: UploadFile = FileParam(...),
+    message: str = Form(...),
+    file_type: str = Form("document", pattern="^(image|document)$"),
+    system_prompt: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    处理multipart上传的带文件聊天请求
+
+    - **file**: 上传的文件
+    - **message**: 用户消息
+    - **file_type**: 文件类型 (image/document)
+    - **system_prompt**: 可选的系统提示
+    """
+    try:
+        try:
+            uuid.UUID(session_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的会话ID格式"
+            )
+
+        # 分块写入磁盘，同时计算内容哈希并检测MIME类型
+        saved_file = await file_service.save_file(
+            file=file,
+            file_type=file_type,
+            db=db,
+            session_id=session_id
+        )
+
+        response = await _analyze_saved_file(db, saved_file, file_type, message, system_prompt)
+
+        return FileChatResponse(
+            session_id=session_id,
+            response=response,
+            file_id=saved_file.file_id
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"处理上传文件聊天请求失败: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @router.post("/{session_id}/image/stream")
 async def init_image_stream_chat(
     session_id: str,
@@ -355,16 +471,15 @@ async def init_image_stream_chat(
             file_size=0,
             user_session_id=session_id
         )
-        db.add(file_record)
-        await db.commit()
 
-        # 初始化流式聊天
+        # 初始化流式聊天，文件记录与用户消息在同一事务中保存
         await chat_service.init_image_stream_chat(
             db=db,
             session_id=session_id,
             message=request.message,
             image_url=request.image,
-            file_id=file_id
+            file_id=file_id,
+            file_record=file_record
         )
 
         return {
@@ -384,16 +499,17 @@ async def init_image_stream_chat(
     description="获取图片分析的SSE流式响应")
 async def stream_image_chat(
     session_id: str,
+    protocol: str = Depends(stream_protocol),
     db: AsyncSession = Depends(get_db)
 ):
     async def generate_stream():
         try:
-            conversation = await get_conversation(db, session_id)
-            if not conversation:
+            conversation_id = await get_conversation_id(db, session_id)
+            if conversation_id is None:
                 raise NotFoundError("会话不存在")
 
             # 获取最后一条用户消息
-            last_message = await get_last_user_message(db, conversation.id)
+            last_message = await get_last_user_message(db, conversation_id)
             if not last_message:
                 raise NotFoundError("未找到用户消息")
             
@@ -407,32 +523,18 @@ async def stream_image_chat(
 
             # 生成AI响应流
             full_response = ""
+            seq = 0
             async for chunk in ai_client.get_stream_response(session_id):
                 full_response += chunk
-                chunk_data = {
-                    'type': 'chunk',
-                    'data': {
-                        'content': chunk,
-                        'full_text': full_response
-                    }
-                }
+                seq += 1
+                chunk_data = chat_service.build_chunk_data(protocol, seq, chunk, full_response)
                 yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
 
-            # 保存AI响应
-            ai_msg = MessageCreate(
-                role="assistant",
-                content=full_response,
-                parent_message_id=last_message.id
-            )
-            await add_message(db, conversation.id, ai_msg)
+            # 保存AI响应（开启后台写入时放入写入队列），并更新会话摘要
+            await save_assistant_reply(db, conversation_id, full_response, last_message.id)
 
             # 发送结束事件
-            end_data = {
-                'type': 'end',
-                'data': {
-                    'full_text': full_response
-                }
-            }
+            end_data = chat_service.build_end_data(protocol, seq, full_response)
             yield f"data: {json.dumps(end_data, ensure_ascii=False)}\n\n"
 
         except Exception as e:
@@ -447,7 +549,8 @@ async def stream_image_chat(
 
     return StreamingResponse(
         generate_stream(),
-        media_type="text/event-stream"
+        media_type="text/event-stream",
+        headers={'X-Stream-Protocol': protocol}
     )
 
 @router.post("/{session_id}/file/stream")
@@ -471,8 +574,8 @@ async def handle_file_stream_chat(
             )
 
         # 获取会话
-        conversation = await get_conversation(db, session_id)
-        if not conversation:
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在"
@@ -501,17 +604,16 @@ async def handle_file_stream_chat(
             file_size=0,
             user_session_id=session_id
         )
-        db.add(file_record)
-        await db.commit()
 
-        # 初始化流式聊天
+        # 初始化流式聊天，文件记录与用户消息在同一事务中保存
         await chat_service.init_file_stream_chat(
             db=db,
             session_id=session_id,
             message=request.message,
             file_id=file_id,
             file_type=simplified_file_type,
-            file_text=file_text
+            file_text=file_text,
+            file_record=file_record
         )
 
         return {
@@ -526,29 +628,94 @@ async def handle_file_stream_chat(
             detail=str(e)
         )
 
+@router.post("/{session_id}/file/stream/upload",
+    summary="上传文件并初始化流式聊天",
+    description="以multipart/form-data方式上传文件并初始化文件流式聊天，之后通过GET /{session_id}/file/stream获取响应")
+async def upload_file_stream_chat(
+    session_id: str,
+    file: UploadFile = FileParam(...),
+    message: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        try:
+            uuid.UUID(session_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的会话ID格式"
+            )
+
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="会话不存在"
+            )
+
+        # 分块写入磁盘，同时计算内容哈希并检测MIME类型
+        saved_file = await file_service.save_file(
+            file=file,
+            file_type="document",
+            db=db,
+            session_id=session_id
+        )
+
+        # 提取进程直接读取已保存的文件，复用上传时计算的内容哈希
+        file_text = await chat_service.extract_text(
+            str(settings.UPLOAD_DIR / saved_file.file_path),
+            saved_file.content_hash,
+            file_service.document_suffix(saved_file)
+        )
+
+        await chat_service.init_file_stream_chat(
+            db=db,
+            session_id=session_id,
+            message=message,
+            file_id=saved_file.file_id,
+            file_type="document",
+            file_text=file_text
+        )
+
+        return {
+            "status": "initialized",
+            "file_id": saved_file.file_id
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        app_logger.error(f"上传文件并初始化流式聊天失败: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @router.get("/{session_id}/file/stream",
     summary="获取文件分析流式响应",
     description="获取文件分析的SSE流式响应")
 async def stream_file_chat(
     session_id: str,
+    protocol: str = Depends(stream_protocol),
     db: AsyncSession = Depends(get_db)
 ):
     try:
-        # 验证会话是否已初始化
-        if not ai_client.is_session_initialized(session_id):
+        # 验证流是否已初始化（流经由Redis中转，可由任意worker处理）
+        if not await ai_client.is_stream_initialized(session_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="会话未初始化，请先调用初始化接口"
             )
 
         return StreamingResponse(
-            chat_service.process_stream_chat(db, session_id),
+            chat_service.process_stream_chat(db, session_id, protocol),
             media_type="text/event-stream",
             headers={
                 'Cache-Control': 'no-cache',
                 'Connection': 'keep-alive',
                 'X-Accel-Buffering': 'no',
                 'Content-Type': 'text/event-stream',
+                'X-Stream-Protocol': protocol,
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
@@ -580,8 +747,8 @@ async def handle_file_stream_chat(
             )
 
         # 获取会话
-        conversation = await get_conversation(db, session_id)
-        if not conversation:
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在"
@@ -685,20 +852,25 @@ async def init_message_analysis_stream(
     response_class=StreamingResponse,
     summary="获取消息分析流式响应"
 )
-async def get_message_analysis_stream(session_id: str):
+async def get_message_analysis_stream(
+    session_id: str,
+    protocol: str = Depends(stream_protocol),
+):
     """获取消息分析的流式响应
     
     Args:
         session_id: 分析会话ID
+        protocol: 流式协议（full/delta）
     """
     try:
         return StreamingResponse(
-            chat_service.get_message_analysis_stream(session_id),  # 传入session_id
+            chat_service.get_message_analysis_stream(session_id, protocol),
             media_type='text/event-stream',
             headers={
                 'Cache-Control': 'no-cache',
                 'Connection': 'keep-alive',
                 'Content-Type': 'text/event-stream',
+                'X-Stream-Protocol': protocol,
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
@@ -754,39 +926,34 @@ async def audio_chat(
             file_size=0,
             user_session_id=session_id
         )
-        db.add(file_record)
-        await db.commit()
         
         # Get conversation
-        conversation = await get_conversation(db, session_id)
-        if not conversation:
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
 
-        # Save user message
-        user_msg = MessageCreate(
-            role="user",
-            content=request.message,
-            file_id=file_id
-        )
-        saved_user_msg = await add_message(db, conversation.id, user_msg)
+        # File record, user message and AI response are written in one transaction
+        writer = MessageWriter(db, conversation_id)
+        writer.add_file(file_record)
+        saved_user_msg = writer.add_user(request.message, file_id=file_id)
 
-        # Analyze audio
-        response = await ai_client.analyze_audio(
-            audio_url=request.file,
-            query=request.message,
-            system_prompt=request.system_prompt
-        )
+        # Analyze audio; keep the user message and file record even if the call fails
+        try:
+            response = await ai_client.analyze_audio(
+                audio_url=request.file,
+                query=request.message,
+                system_prompt=request.system_prompt
+            )
+        except Exception:
+            await writer.commit_quietly()
+            raise
 
         # Save AI response
-        ai_msg = MessageCreate(
-            role="assistant",
-            content=response,
-            parent_message_id=saved_user_msg.id
-        )
-        await add_message(db, conversation.id, ai_msg)
+        writer.add_assistant(response, parent=saved_user_msg)
+        await writer.commit()
 
         return AudioChatResponse(
             session_id=session_id,
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
 from app.models.schemas import (
     ConversationCreate,
     ConversationResponse,
+    ConversationListResponse,
     MessageCreate,
     MessageResponse,
     ConversationUpdate
@@ -11,10 +12,9 @@ from app.models.schemas import (
 from app.services import context as context_service
 from app.core.logging import app_logger
 from app.services.exceptions import DatabaseError
-from typing import List
+from typing import List, Optional
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-from app.db.models import Conversation, File
+from app.db.models import Conversation
 from sqlalchemy import desc, asc
 import json
 
@@ -48,7 +48,7 @@ async def get_conversation(
     db: AsyncSession = Depends(get_db)
 ):
     """获取指定会话信息"""
-    conversation = await context_service.get_conversation(db, session_id)
+    conversation = await context_service.get_conversation(db, session_id, load_messages=True)
     if not conversation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,14 +63,15 @@ async def add_message(
     db: AsyncSession = Depends(get_db)
 ):
     """添加消息到会话"""
-    conversation = await context_service.get_conversation(db, session_id)
-    if not conversation:
+    conversation_id = await context_service.get_conversation_id(db, session_id)
+    if conversation_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="会话不存在"
         )
     try:
-        return await context_service.add_message(db, conversation.id, message)
+        db_message = await context_service.add_message(db, conversation_id, message)
+        return MessageResponse.from_db_model(db_message)
     except DatabaseError as e:
         app_logger.error(f"添加消息失败: {str(e)}")
         raise HTTPException(
@@ -99,20 +100,36 @@ async def clear_context(
             detail=str(e)
         )
 
+@router.get("/conversation-list", response_model=ConversationListResponse)
+async def list_conversations(
+    limit: int = Query(20, ge=1, le=100, description="每页会话数"),
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor"),
+    db: AsyncSession = Depends(get_db)
+):
+    """分页获取会话列表（按最后活动时间倒序，包含消息数和最后一条消息预览，不返回消息）"""
+    try:
+        conversations, next_cursor = await context_service.list_conversations(db, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return ConversationListResponse(items=conversations, next_cursor=next_cursor)
+
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def get_all_conversations(
     db: AsyncSession = Depends(get_db)
 ):
     """获取所有会话列表"""
     try:
-        # 获取所有会话及其关联的消息
+        # 获取所有会话及其关联的消息和文件
         stmt = (
             select(Conversation)
-            .options(joinedload(Conversation.messages))
+            .options(context_service.with_messages())
             .order_by(desc(Conversation.updated_at))
         )
         result = await db.execute(stmt)
-        conversations = result.unique().scalars().all()
+        conversations = result.scalars().all()
         
         # 转换响应格式
         response_conversations = []
@@ -122,12 +139,10 @@ async def get_all_conversations(
             
             messages = []
             for msg in sorted_messages:
-                # 如果消息有关联文件，获取文件信息
+                # 如果消息有关联文件，获取文件信息（已随消息一起加载）
                 file_info = None
                 if msg.file_id:
-                    file_stmt = select(File).where(File.file_id == msg.file_id)
-                    file_result = await db.execute(file_stmt)
-                    file = file_result.scalar_one_or_none()
+                    file = msg.file
                     if file:
                         file_info = {
                             "file_id": file.file_id,
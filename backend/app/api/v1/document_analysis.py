@@ -1,5 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
 from app.services.document_service import document_service
@@ -8,7 +10,10 @@ from app.models.schemas import (
     DocumentAnalysisResponse,
     MultiDocumentAnalysisResponse,
     DocumentAnalysisRequest,
+    DocumentAnalysisTaskRequest,
+    DocumentAnalysisTaskResponse,
 )
+from app.core.logging import app_logger
 from app.middleware.upload import require_file_type
 from app.core.config import settings
 
@@ -74,4 +79,49 @@ async def analyze_multiple_files(
         return MultiDocumentAnalysisResponse(**result)
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.post("/tasks", response_model=DocumentAnalysisTaskResponse)
+async def create_analysis_task(
+    request: DocumentAnalysisTaskRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """创建后台文档分析任务（分层map-reduce，支持检查点续跑）"""
+    try:
+        task_id = await document_service.start_analysis_task(
+            db=db,
+            file_id=request.file_id,
+            query=request.query,
+            system_prompt=request.system_prompt,
+            max_pages=request.max_pages,
+            max_tokens=request.max_tokens
+        )
+        return DocumentAnalysisTaskResponse(task_id=task_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/tasks/{task_id}/stream")
+async def stream_analysis_task(task_id: str):
+    """以SSE方式获取文档分析进度，最后一个事件为分析结果"""
+    if not await document_service.is_analysis_task_active(task_id):
+        raise HTTPException(status_code=404, detail="分析任务不存在或已过期")
+
+    async def event_generator():
+        try:
+            async for event in document_service.get_analysis_events(task_id):
+                yield f"data: {event}\n\n"
+        except Exception as e:
+            app_logger.error(f"获取文档分析进度失败: {str(e)}")
+            error_data = {"type": "error", "message": str(e)}
+            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
@@ -80,4 +80,23 @@ async def get_files_batch(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
-        ) 
\ No newline at end of file
+        ) 
+@router.delete("/{file_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="删除文件",
+    description="删除文件记录；同一内容的最后一条文件记录删除时同时删除磁盘文件",
+    response_description="成功删除返回204")
+async def delete_file(
+    file_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    删除指定文件
+
+    - **file_id**: 要删除的文件ID
+    """
+    if not await file_service.delete_file(db, file_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文件不存在"
+        )
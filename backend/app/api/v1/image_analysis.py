@@ -54,7 +54,7 @@ async def extract_text_from_image(
         file_path = Path(settings.UPLOAD_DIR) / saved_file.file_path
         
         # 提取文字
-        extracted_text = await image_service.extract_text(file_path)
+        extracted_text = await image_service.extract_text(file_path, saved_file.content_hash)
         
         return {"text": extracted_text}
         
@@ -3,9 +3,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
 from app.models.statistics_schemas import (
     StudyTimeStats, MasteryStats, RevisionStats,
-    TagStats, OverallStatistics
+    TagStats, OverallStatistics, AICacheStats
 )
 from app.services.statistics_service import statistics_service
+from app.services.ai_client import ai_client
 from app.core.logging import app_logger
 
 router = APIRouter(prefix="/statistics", tags=["statistics"])
@@ -217,3 +218,17 @@ async def get_overall_statistics(db: AsyncSession = Depends(get_db)):
     except Exception as e:
         app_logger.error(f"获取整体统计数据失败: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/ai-cache",
+    response_model=AICacheStats,
+    summary="获取AI响应缓存统计",
+    description="获取对话、文档分析、图片分析各命名空间的缓存命中次数、命中率和缓存时间"
+)
+async def get_ai_cache_stats():
+    """获取AI响应缓存统计"""
+    try:
+        return AICacheStats(namespaces=await ai_client.get_cache_stats())
+    except Exception as e:
+        app_logger.error(f"获取AI响应缓存统计失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.staticfiles import StaticFiles
-from app.core.config import settings
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import get_db
+from app.db.models import File as FileRecord
+from app.models.schemas import UploadSessionCreate, UploadSessionResponse
+from app.services.file_service import file_service
+from app.services.rendition_service import rendition_service
+from app.services.upload_service import upload_session_service
 from pathlib import Path
-import shutil
-import uuid
-import os
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
@@ -12,30 +14,32 @@ router = APIRouter(prefix="/upload", tags=["upload"])
 STATIC_DIR = Path("static")
 STATIC_DIR.mkdir(exist_ok=True)
 
+def _upload_response(file_record: FileRecord) -> dict:
+    """生成访问URL，相同内容的上传返回同一个URL；图片附带缩略图URL"""
+    response = {
+        "url": rendition_service.static_url(Path(file_record.file_path)),
+        "filename": file_record.original_name,
+        "saved_name": Path(file_record.file_path).name,
+        "file_id": file_record.file_id
+    }
+    if file_record.mime_type and file_record.mime_type.startswith("image/"):
+        response["thumbnails"] = rendition_service.thumbnail_urls(file_record)
+    return response
+
 @router.post("/file")
-async def upload_file(file: UploadFile = File(...)):
-    """上传文件到static目录"""
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """上传文件到static目录（内容寻址存储，相同内容只保存一份）"""
     try:
-        # 生成唯一文件名
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # 构建保存路径
-        file_path = STATIC_DIR / unique_filename
-        
-        # 保存文件
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 生成访问URL
-        file_url = f"/static/{unique_filename}"
-        
-        return {
-            "url": file_url,
-            "filename": file.filename,
-            "saved_name": unique_filename
-        }
-        
+        saved_file = await file_service.save_file(
+            file=file,
+            file_type="file",
+            db=db,
+            session_id=None
+        )
+        return _upload_response(saved_file)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -43,8 +47,8 @@ async def upload_file(file: UploadFile = File(...)):
         )
 
 @router.post("/image")
-async def upload_image(image: UploadFile = File(...)):
-    """上传图片到static目录"""
+async def upload_image(image: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """上传图片到static目录（内容寻址存储，相同内容只保存一份）"""
     try:
         # 验证文件类型
         if not image.content_type.startswith("image/"):
@@ -52,29 +56,55 @@ async def upload_image(image: UploadFile = File(...)):
                 status_code=400,
                 detail="只允许上传图片文件"
             )
-        
-        # 生成唯一文件名
-        file_extension = Path(image.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        
-        # 构建保存路径
-        file_path = STATIC_DIR / unique_filename
-        
-        # 保存文件
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        
-        # 生成访问URL
-        image_url = f"/static/{unique_filename}"
-        
-        return {
-            "url": image_url,
-            "filename": image.filename,
-            "saved_name": unique_filename
-        }
-        
+
+        saved_file = await file_service.save_file(
+            file=image,
+            file_type="image",
+            db=db,
+            session_id=None
+        )
+        return _upload_response(saved_file)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"图片上传失败: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+@router.post("/sessions", response_model=UploadSessionResponse)
+async def create_upload_session(request: UploadSessionCreate):
+    """创建分片上传会话，用于大文件的断点续传"""
+    return await upload_session_service.create(
+        filename=request.filename,
+        size=request.size,
+        file_type=request.file_type,
+        session_id=request.session_id
+    )
+
+@router.get("/sessions/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str):
+    """查询上传进度，中断后从received偏移量继续上传"""
+    return await upload_session_service.get(upload_id)
+
+@router.put("/sessions/{upload_id}/chunks", response_model=UploadSessionResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="分片在文件中的起始偏移量")
+):
+    """上传一个分片，请求体为分片的原始字节，边接收边写入磁盘"""
+    return await upload_session_service.append(upload_id, offset, request.stream())
+
+@router.post("/sessions/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, db: AsyncSession = Depends(get_db)):
+    """完成分片上传，存入内容寻址存储并返回访问URL"""
+    saved_file = await upload_session_service.complete(db, upload_id)
+    return _upload_response(saved_file)
+
+@router.delete("/sessions/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    """取消分片上传并删除已接收的内容"""
+    await upload_session_service.abort(upload_id)
+    return {"message": "上传已取消"}
@@ -9,6 +9,12 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     VERSION: str = "0.1.0"
 
+    # 服务运行配置
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    TIMEOUT: int = 65  # keep-alive超时（秒）
+    WORKERS: int = 1  # 流式响应经由Redis中转，可安全开启多worker
+
     # 安全配置
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
@@ -31,18 +37,96 @@ class Settings(BaseSettings):
     REDIS_PASSWORD: Optional[str] = None
     REDIS_PREFIX: str
 
+    # 流式响应中转配置
+    STREAM_BROKER_TTL: int = 600  # 流在Redis中的保留时间（秒）
+    STREAM_BROKER_MAXLEN: int = 10000  # 单个流的最大条目数
+
     # 通义千问API配置
     QWEN_API_KEY: str
     QWEN_API_URL: str
     QWEN_API_TIMEOUT: int
 
+    # AI响应缓存配置
+    AI_CACHE_KEY_VERSION: int = 3  # 修改影响输出的提示词模板或缓存键规则时递增，使旧缓存整体失效
+    AI_CACHE_TTL_CHAT: int = 3600  # 对话响应缓存时间（秒）
+    AI_CACHE_TTL_DOCUMENT: int = 7 * 24 * 3600  # 文档分析结果缓存时间（秒）
+    AI_CACHE_TTL_IMAGE: int = 7 * 24 * 3600  # 图片分析结果缓存时间（秒）
+    AI_CACHE_TTL_STREAM: int = 3600  # 流式响应数据块缓存时间（秒）
+    AI_STREAM_REPLAY_DELAY: float = 0.0  # 回放缓存流时每个数据块的间隔（秒），0表示全速回放
+    AI_SINGLE_FLIGHT_REDIS: bool = True  # 是否通过Redis锁在多个worker间合并相同的AI请求
+    AI_SINGLE_FLIGHT_LOCK_TTL: int = 120  # 合并请求锁的过期时间（秒），也是等待方的最长等待时间
+    AI_SINGLE_FLIGHT_POLL_INTERVAL: float = 0.2  # 等待方轮询缓存结果的间隔（秒）
+
+    # 上游调用调度配置（单个worker内生效）
+    UPSTREAM_MAX_CONCURRENCY: int = 8  # 并发调用上限
+    UPSTREAM_MIN_CONCURRENCY: int = 1  # 限流退避后的最低并发数
+    UPSTREAM_RPM_LIMIT: int = 60  # 每分钟请求数，0表示不限制
+    UPSTREAM_TPM_LIMIT: int = 100000  # 每分钟token数，0表示不限制
+    UPSTREAM_RATE_LIMIT_COOLDOWN: float = 2.0  # 429响应未给出Retry-After时的暂停时间（秒）
+    UPSTREAM_DEFAULT_COMPLETION_TOKENS: int = 1024  # 未指定max_tokens时预估的输出token数
+
+    # 文档分析配置
+    DOC_SEGMENT_MAX_TOKENS: int = 2000  # 文档分段的token预算
+    DOC_SEGMENT_OVERLAP_TOKENS: int = 100  # 相邻分段之间重叠的token数
+    DOC_REDUCE_FAN_IN: int = 8  # 分层合并时每个节点最多合并的结果数
+    DOC_REDUCE_MAX_INPUT_TOKENS: int = 6000  # 每个合并节点输入的token预算
+    DOC_CHECKPOINT_TTL: int = 24 * 3600  # 分段结果检查点的保留时间（秒）
+    DOC_MAX_PAGES: int = 0  # 文档分析默认最多提取的PDF页数，0表示不限制
+    DOC_MAX_EXTRACT_TOKENS: int = 0  # 文档分析默认最多提取的token数，0表示不限制
+
     # 上下文配置
     MAX_CONTEXT_TURNS: int = 10
-    MAX_TOKEN_LENGTH: int
+    CONVERSATION_ID_CACHE_TTL: int = 24 * 3600  # session_id到会话主键映射的缓存时间（秒）
+    CONVERSATION_PREVIEW_LENGTH: int = 100  # 会话列表中最后一条消息预览的字符数
+    MAX_TOKEN_LENGTH: int  # 单次请求上下文的token预算
+    CONTEXT_TRUNCATE_MIN_TOKENS: int = 64  # 剩余预算不低于该值时截断较早的消息，否则直接丢弃
+    CHAT_DEFER_ASSISTANT_WRITES: bool = False  # 流式回复发送完成后由后台批量写入缓冲写入数据库
+
+    # 会话滚动摘要配置
+    SUMMARY_ENABLED: bool = True
+    SUMMARY_KEEP_MESSAGES: int = 6  # 始终以原文保留的最近消息数
+    SUMMARY_MIN_BATCH: int = 4  # 待摘要消息达到该数量时才更新摘要
+    SUMMARY_MAX_BATCH: int = 40  # 单次更新最多纳入的消息数
+    SUMMARY_MAX_TOKENS: int = 512  # 摘要的最大token数
+
+    # 后台批量写入配置（分析记录、复习历史等）
+    WRITE_BEHIND_BATCH_SIZE: int = 100  # 缓冲记录达到该数量时立即写入
+    WRITE_BEHIND_FLUSH_INTERVAL: float = 1.0  # 缓冲记录的最长等待时间（秒）
+    WRITE_BEHIND_MAX_PENDING: int = 10000  # 写入失败时缓冲保留的记录上限
 
     # 文件存储配置
     UPLOAD_DIR: Path = Path("static/uploads")
+    EXTRACTION_CACHE_DIR: Path = Path("data/extracted")  # 文本提取结果缓存目录（不对外公开）
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_VERSION: int = 2  # 修改提取逻辑后递增，使旧的提取结果失效
+    EXTRACTION_WORKERS: int = 2  # 文本提取进程数
+    EXTRACTION_MAX_QUEUE: int = 16  # 排队等待的提取任务上限
+    EXTRACTION_QUEUE_TIMEOUT: float = 30  # 排队等待的最长时间（秒）
+    EXTRACTION_TIMEOUT: int = 120  # 单个提取任务的超时时间（秒）
+    EXTRACTION_MEMORY_LIMIT_MB: int = 1024  # 提取进程的内存上限，0表示不限制（仅类Unix系统生效）
+    EXTRACTION_MAX_TASKS_PER_CHILD: int = 50  # 提取进程处理该数量任务后重启，释放内存碎片
+    PDF_FIRST_BATCH_PAGES: int = 2  # 逐页提取PDF时第一批解析的页数，之后逐批加倍
+    PDF_MAX_BATCH_PAGES: int = 16  # 逐页提取PDF时每批最多解析的页数
+    OCR_LANG: str = "chi_sim+eng"  # Tesseract识别语言
+    OCR_TARGET_DPI: int = 300  # 扫描件缩放到的目标DPI
+    OCR_MAX_SIDE: int = 4096  # 无DPI信息时图片长边的像素上限
+    OCR_TILE_HEIGHT: int = 2048  # OCR切片高度（像素），0表示不切片
+    OCR_DESKEW_MAX_ANGLE: float = 5  # 纠偏检测的最大角度，0表示不纠偏
+    OCR_PDF_FALLBACK: bool = True  # PDF页面没有文本层时识别页面中的图片
+    OCR_PDF_MIN_CHARS: int = 10  # PDF页面文本少于该字符数时视为纯图片页面
+    VISION_IMAGE_FORMAT: str = "JPEG"  # 视觉模型使用的图片格式（JPEG/WEBP）
+    VISION_IMAGE_QUALITY: int = 85  # 视觉模型图片和缩略图的压缩质量
+    VISION_IMAGE_MAX_WIDTH: int = 1920  # 视觉模型图片的最大宽度
+    VISION_IMAGE_MAX_HEIGHT: int = 1080  # 视觉模型图片的最大高度
+    VISION_IMAGE_BASE_URL: Optional[str] = None  # 模型服务可访问的本站地址，设置后发送图片URL而不是base64
+    IMAGE_THUMBNAIL_SIZES: List[int] = [512, 128]  # 上传图片时生成的缩略图边长
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_MAX_RESUMABLE_SIZE: int = 1024 * 1024 * 1024  # 分片上传的文件大小上限（1GB）
+    UPLOAD_MAX_CHUNK_SIZE: int = 8 * 1024 * 1024  # 分片上传单个分片的大小上限
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # 分片上传会话的保留时间（秒），过期后需重新上传
+    UPLOAD_SESSION_LOCK_TTL: int = 60  # 分片写入期间会话锁的有效期（秒），写入过程中自动续期
+    UPLOAD_SWEEP_INTERVAL: int = 3600  # 清理过期分片文件和上传临时文件的间隔（秒）
+    UPLOAD_STAGING_TTL: int = 3600  # 普通上传临时文件的保留时间（秒），请求中断后遗留的文件超时后清理
     ALLOWED_DOCUMENT_TYPES: set = {
         "text/plain", "application/pdf",
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
@@ -73,6 +157,7 @@ class Settings(BaseSettings):
         self.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         (self.UPLOAD_DIR / "documents").mkdir(exist_ok=True)
         (self.UPLOAD_DIR / "images").mkdir(exist_ok=True)
+        self.EXTRACTION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     class Config:
         env_file = ".env"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, BigInteger, JSON, Boolean, Time
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, BigInteger, JSON, Boolean, Time, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy.orm import relationship
@@ -19,9 +19,34 @@ class Conversation(Base):
     name = Column(String(100), nullable=True)  # 新增name字段
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)  # 创建时间
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)  # 更新时间
+    # 以下字段在写入消息时同步维护，会话列表不需要查询messages表
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # 消息数
+    last_message_preview = Column(String(200), nullable=True)  # 最后一条消息的预览
+    last_message_at = Column(DateTime(timezone=True), nullable=True)  # 最后一条消息的时间
 
-    # 添加与 Message 的关系
-    messages = relationship("Message", back_populates="conversation", lazy="selectin")
+    __table_args__ = (
+        Index("ix_conversations_updated_at_id", "updated_at", "id"),  # 会话列表的键集分页
+    )
+
+    # 添加与 Message 的关系（不随会话自动加载，需要时通过 selectinload 显式加载）
+    messages = relationship("Message", back_populates="conversation", lazy="raise", passive_deletes=True)
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(
+        Integer,
+        ForeignKey("conversations.id", ondelete="CASCADE"),
+        unique=True,
+        index=True,
+        nullable=False
+    )
+    content = Column(Text, nullable=False)  # 滚动摘要内容
+    last_message_id = Column(Integer, nullable=False)  # 摘要已覆盖的最后一条消息ID
+    summarized_count = Column(Integer, default=0)  # 已纳入摘要的消息数
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Message(BaseModel):
     __tablename__ = "messages"
@@ -32,13 +57,29 @@ class Message(BaseModel):
     conversation_id = Column(Integer, ForeignKey("conversations.id"))
     parent_message_id = Column(Integer, ForeignKey("messages.id"))
     file_id = Column(String(64), ForeignKey("files.file_id"))
+    token_count = Column(Integer, nullable=True)  # 缓存的内容token数，用于上下文预算
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),  # 历史消息的键集分页
+        Index("ix_messages_conversation_role_created", "conversation_id", "role", "created_at"),  # 会话中最后一条用户消息
+    )
+
     # 添加与 Conversation 的关系
     conversation = relationship("Conversation", back_populates="messages")
     parent_message = relationship("Message", remote_side=[id], backref="child_messages")
-    # 添加与 File 的关系
-    file = relationship("File", lazy="joined")
+    # 添加与 File 的关系（需要时通过 joinedload 显式加载）
+    file = relationship("File", lazy="raise")
+
+class FileBlob(BaseModel):
+    __tablename__ = "file_blobs"
+
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), unique=True, index=True, nullable=False)  # 文件内容的SHA-256
+    storage_path = Column(String(512), nullable=False)  # 相对于上传目录的存储路径
+    file_size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(100), nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)  # 引用该内容的文件记录数
 
 class File(BaseModel):
     __tablename__ = "files"
@@ -50,6 +91,8 @@ class File(BaseModel):
     file_type = Column(String(50), nullable=True)
     mime_type = Column(String(100), nullable=True)
     file_size = Column(BigInteger, nullable=True)
+    content_hash = Column(String(64), index=True, nullable=True)  # 文件内容的SHA-256
+    blob_id = Column(Integer, ForeignKey("file_blobs.id"), index=True, nullable=True)  # 内容寻址存储中的文件内容
     user_session_id = Column(String(64), index=True)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
@@ -60,6 +103,7 @@ class AnalysisRecord(BaseModel):
     file_id = Column(String(64), ForeignKey("files.file_id"))
     analysis_type = Column(String(50), nullable=True)
     result = Column(Text, nullable=True)
+    request_hash = Column(String(40), index=True, nullable=True)  # 文件内容和分析要求的摘要，用于复用分析结果
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
 class Category(Base):
@@ -180,6 +224,11 @@ class RevisionTask(Base):
     completed_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_revision_tasks_plan_status_scheduled", "plan_id", "status", "scheduled_date"),  # 计划中的待复习任务
+        Index("ix_revision_tasks_scheduled_date", "scheduled_date"),  # 每日任务
+    )
     
     # 关系
     plan = relationship("RevisionPlan", back_populates="tasks")
@@ -206,6 +255,11 @@ class RevisionHistory(Base):
     revision_date = Column(DateTime(timezone=True), default=datetime.utcnow)
     time_spent = Column(Integer, nullable=True)  # 花费时间(秒)
     comments = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_revision_histories_task_id", "task_id"),  # 任务的复习次数
+        Index("ix_revision_histories_revision_date", "revision_date"),  # 按日期统计复习记录
+    )
     
     # 关系
     note = relationship("Note")
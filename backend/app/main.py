@@ -11,8 +11,12 @@ from app.api.v1 import (
     upload, handbooks, notes, revisions, 
     revision_settings, statistics, files
 )
-from app.middleware.upload import validate_upload_size
+from app.middleware.upload import UploadSizeLimitMiddleware
 from app.utils.cache import cache_manager
+from app.services.stream_broker import stream_broker
+from app.services.extraction_pool import extraction_pool
+from app.services.write_behind import write_behind
+from app.services.upload_service import upload_session_service
 import uvicorn
 import sys
 import signal
@@ -26,10 +30,18 @@ async def lifespan(app: FastAPI):
     # 初始化数据库
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+    # 定期清理过期的分片上传文件
+    upload_session_service.start()
     
     yield
     
     # 清理资源
+    await upload_session_service.close()
+    # 写入后台缓冲中剩余的记录
+    await write_behind.close()
+    await stream_broker.close()
+    extraction_pool.close()
     await cache_manager.close()
     await engine.dispose()
 
@@ -44,7 +56,7 @@ app = FastAPI(
 setup_logging()
 
 # 添加中间件
-app.middleware("http")(validate_upload_size)
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # 添加静态文件服务
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -79,17 +91,14 @@ if __name__ == "__main__":
     # 注册信号处理器
     signal.signal(signal.SIGINT, handle_interrupt)
     
-    # 配置uvicorn
-    config = uvicorn.Config(
-        app=app,
+    # 启动uvicorn（流式响应经由Redis中转，可按需开启多个worker）
+    uvicorn.run(
+        "app.main:app",
         host=settings.HOST,
         port=settings.PORT,
         reload=settings.DEBUG,
-        workers=1,  # 减少worker数量
+        workers=settings.WORKERS,
         loop="asyncio",
         timeout_keep_alive=settings.TIMEOUT,
         access_log=True
     )
-    
-    server = uvicorn.Server(config)
-    server.run()
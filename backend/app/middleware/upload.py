@@ -1,19 +1,58 @@
-from fastapi import Request, HTTPException
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
 from app.core.config import settings
 import functools
+import magic
 
-async def validate_upload_size(request: Request, call_next):
-    """验证上传文件大小的中间件"""
-    if request.method == "POST" and "multipart/form-data" in request.headers.get("content-type", ""):
-        if request.headers.get("content-length"):
-            content_length = int(request.headers["content-length"])
-            if content_length > settings.MAX_UPLOAD_SIZE:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"文件大小超过限制: {settings.MAX_UPLOAD_SIZE} bytes"
-                )
-    
-    return await call_next(request)
+class UploadSizeLimitMiddleware:
+    """限制multipart上传请求体大小的中间件
+
+    声明的Content-Length超限时直接返回413；没有Content-Length（分块传输）或声明不实时，
+    在读取请求体的过程中累计字节数，超限即中止读取并返回413。
+    """
+
+    def __init__(self, app, max_size: int = None):
+        self.app = app
+        self.max_size = max_size or settings.MAX_UPLOAD_SIZE
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"文件大小超过限制: {self.max_size} bytes"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        if b"multipart/form-data" not in headers.get(b"content-type", b""):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_size
+            except ValueError:
+                response = JSONResponse({"detail": "无效的Content-Length"}, status_code=400)
+                return await response(scope, receive, send)
+            if too_large:
+                response = JSONResponse({"detail": self._too_large().detail}, status_code=413)
+                return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    # 在请求体解析过程中抛出HTTPException，由FastAPI转换为413响应
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
 
 def require_file_type(*allowed_types):
     """文件类型验证装饰器"""
@@ -26,16 +65,16 @@ def require_file_type(*allowed_types):
                     status_code=400,
                     detail="未找到上传文件"
                 )
-                
+
             content_type = magic.from_buffer(await file.read(1024), mime=True)
             await file.seek(0)
-            
+
             if content_type not in allowed_types:
                 raise HTTPException(
                     status_code=400,
                     detail=f"不支持的文件类型: {content_type}"
                 )
-                
+
             return await func(*args, **kwargs)
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
@@ -79,6 +79,23 @@ class ConversationResponse(ConversationBase):
     class Config:
         from_attributes = True
 
+class ConversationListItem(ConversationBase):
+    """会话列表项（不包含消息）"""
+    id: int
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class ConversationListResponse(BaseModel):
+    """分页会话列表响应模型"""
+    items: List[ConversationListItem]
+    next_cursor: Optional[str] = Field(None, description="下一页游标，没有更多时为空")
+
 class ConversationUpdate(BaseModel):
     name: str = Field(..., description="新的会话名称", max_length=100)
 
@@ -162,6 +179,16 @@ class DocumentAnalysisRequest(BaseModel):
     system_prompt: Optional[str] = None
     session_id: str
 
+class DocumentAnalysisTaskRequest(BaseModel):
+    file_id: str
+    query: Optional[str] = None
+    system_prompt: Optional[str] = None
+    max_pages: Optional[int] = Field(None, ge=0, description="最多提取的PDF页数，0表示不限制")
+    max_tokens: Optional[int] = Field(None, ge=0, description="最多提取的token数，0表示不限制")
+
+class DocumentAnalysisTaskResponse(BaseModel):
+    task_id: str
+
 class CategoryBase(BaseModel):
     name: str = Field(..., description="分类名称")
 
@@ -228,3 +255,20 @@ class FileDetailResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class UploadSessionCreate(BaseModel):
+    """创建分片上传会话请求模型"""
+    filename: str = Field(..., description="原始文件名", max_length=255)
+    size: int = Field(..., description="文件总大小（字节）", gt=0)
+    file_type: str = Field("file", description="文件类型", pattern="^(file|image|document)$")
+    session_id: Optional[str] = Field(None, description="关联的会话ID")
+
+class UploadSessionResponse(BaseModel):
+    """分片上传会话响应模型"""
+    upload_id: str
+    filename: str
+    size: int
+    file_type: str
+    session_id: Optional[str] = None
+    received: int = Field(..., description="已接收的字节数，即下一片的偏移量")
+    chunk_size: int = Field(..., description="单个分片的大小上限")
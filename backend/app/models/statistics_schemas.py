@@ -106,4 +106,26 @@ class OverallStatistics(BaseModel):
     mastery: MasteryStats
     revision: RevisionStats
     tags: TagStats
-    last_updated: datetime = Field(..., description="最后更新时间") 
\ No newline at end of file
+    last_updated: datetime = Field(..., description="最后更新时间") 
+
+class AICacheNamespaceStats(BaseModel):
+    """AI响应缓存单个命名空间的统计"""
+    hits: int = Field(..., description="命中次数")
+    misses: int = Field(..., description="未命中次数")
+    hit_rate: float = Field(..., description="命中率")
+    ttl: int = Field(..., description="缓存时间(秒)")
+
+class AICacheStats(BaseModel):
+    """AI响应缓存统计"""
+    namespaces: Dict[str, AICacheNamespaceStats] = Field(..., description="按命名空间的统计")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "namespaces": {
+                    "chat": {"hits": 120, "misses": 880, "hit_rate": 0.12, "ttl": 3600},
+                    "document": {"hits": 45, "misses": 15, "hit_rate": 0.75, "ttl": 604800},
+                    "image": {"hits": 30, "misses": 20, "hit_rate": 0.6, "ttl": 604800}
+                }
+            }
+        }
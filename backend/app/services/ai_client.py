@@ -1,13 +1,20 @@
-from openai import OpenAI, AsyncOpenAI
+from openai import OpenAI, AsyncOpenAI, RateLimitError
 from openai.types.chat import ChatCompletionChunk
-from typing import AsyncGenerator, List, Dict, Any, Generator, Optional
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, List, Dict, Any, Generator, Optional
 from app.core.config import settings
 from app.core.logging import app_logger
 from app.utils.exceptions import APIError
 from app.utils.cache import cache_manager
+from app.services.stream_broker import stream_broker
+from app.services.upstream_scheduler import upstream_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from app.utils.tokens import count_messages_tokens
+from app.utils.text_splitter import TextSplitter
 import json
+import re
+import hashlib
+import unicodedata
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 from tenacity import retry, stop_after_attempt, wait_exponential
 import redis.asyncio as redis
 import uuid
@@ -20,6 +27,48 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# AI响应缓存命名空间，分别对应不同的缓存时间策略
+CACHE_NAMESPACE_CHAT = "chat"
+CACHE_NAMESPACE_DOCUMENT = "document"
+CACHE_NAMESPACE_IMAGE = "image"
+CACHE_NAMESPACE_STREAM = "stream"
+
+_BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+
+class _LeaderCancelled(Exception):
+    """合并请求的发起方被取消，等待方需要自行重新发起请求"""
+
+class _SlotStream:
+    """占用上游执行槽位的流式响应
+
+    上游在响应头到达时就返回流对象，正文仍在传输；槽位保持到流读完或调用aclose为止，
+    流式调用才会真正受并发上限和优先级通道约束。
+    """
+
+    def __init__(self, stream, slot: AsyncExitStack):
+        self._stream = stream
+        self._slot: Optional[AsyncExitStack] = slot
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        """关闭上游连接并归还槽位，可重复调用"""
+        if self._slot is None:
+            return
+        slot, self._slot = self._slot, None
+        try:
+            await self._stream.close()
+        finally:
+            await slot.aclose()
+
 class AIClient:
     """通义千问API客户端增强版"""
     def __init__(self):
@@ -37,12 +86,17 @@ class AIClient:
         self.max_retries = 3
         self.retry_delay = 1  # 基础重试延迟（秒）
         
-        # 会话和缓存管理
-        self._active_streams = {}
-        self._analysis_sessions = {}  # 添加分析会话字典
+        # 会话和缓存管理（流式响应经由Redis中转，不保存在进程内）
         self._current_analysis_session_id = None  # 添加当前分析会话ID
         self._response_cache = cache_manager.get_cache('ai_responses')
+        self._cache_ttls = {
+            CACHE_NAMESPACE_CHAT: settings.AI_CACHE_TTL_CHAT,
+            CACHE_NAMESPACE_DOCUMENT: settings.AI_CACHE_TTL_DOCUMENT,
+            CACHE_NAMESPACE_IMAGE: settings.AI_CACHE_TTL_IMAGE,
+            CACHE_NAMESPACE_STREAM: settings.AI_CACHE_TTL_STREAM,
+        }
         self.initialized_sessions = set()
+        self._inflight: Dict[str, asyncio.Future] = {}  # 进行中的相同请求（single-flight）
         
         # API配置
         self.api_key = settings.QWEN_API_KEY
@@ -55,8 +109,6 @@ class AIClient:
         # 会话存储
         self.sessions = {}
         self.analysis_sessions = {}  # 分析会话存储
-        self._analysis_sessions = {}
-        self._current_analysis_session_id = None
 
     def is_session_initialized(self, session_id: str) -> bool:
         """检查会话是否已初始化"""
@@ -68,6 +120,175 @@ class AIClient:
             # 可以在这里添加任何必要的会话初始化逻辑
             self.initialized_sessions.add(session_id)
 
+    async def is_stream_initialized(self, session_id: str) -> bool:
+        """检查流式响应是否已初始化（跨worker）"""
+        return await stream_broker.exists(session_id)
+
+    async def _iter_stream_content(self, stream) -> AsyncGenerator[str, None]:
+        """从上游流中提取文本内容"""
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _single_flight(
+        self,
+        cache_key: str,
+        call: Callable[[], Awaitable[str]]
+    ) -> str:
+        """合并并发的相同请求，只调用一次上游，所有等待方共享结果
+
+        进程内通过Future合并；开启AI_SINGLE_FLIGHT_REDIS时，再通过Redis锁在worker间合并，
+        未抢到锁的一方轮询缓存等待持锁方写入结果。call需负责写入缓存。
+        """
+        while True:
+            future = self._inflight.get(cache_key)
+            if future is None:
+                break
+            app_logger.info(f"合并进行中的相同请求: {cache_key}")
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # 发起方断开或超时，第一个被唤醒的等待方成为新的发起方，其余继续合并
+                app_logger.info(f"合并请求的发起方已取消，重新发起: {cache_key}")
+
+        future = asyncio.get_running_loop().create_future()
+        # 避免无人等待时出现未获取异常的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[cache_key] = future
+        try:
+            if settings.AI_SINGLE_FLIGHT_REDIS:
+                result = await self._single_flight_across_workers(cache_key, call)
+            else:
+                result = await call()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # 不能取消共享的Future，否则仍在等待的其他请求也会收到CancelledError
+            future.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if self._inflight.get(cache_key) is future:
+                del self._inflight[cache_key]
+
+    async def _single_flight_across_workers(
+        self,
+        cache_key: str,
+        call: Callable[[], Awaitable[str]]
+    ) -> str:
+        """通过Redis锁在worker间合并相同请求"""
+        lock = cache_manager.redis.lock(
+            f"{settings.REDIS_PREFIX}ai_inflight:{cache_key}",
+            timeout=settings.AI_SINGLE_FLIGHT_LOCK_TTL
+        )
+        if await lock.acquire(blocking=False):
+            try:
+                return await call()
+            finally:
+                try:
+                    await lock.release()
+                except Exception as e:
+                    app_logger.warning(f"释放请求合并锁失败: {str(e)}")
+
+        app_logger.info(f"等待其他worker完成相同请求: {cache_key}")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.AI_SINGLE_FLIGHT_LOCK_TTL
+        while loop.time() < deadline:
+            await asyncio.sleep(settings.AI_SINGLE_FLIGHT_POLL_INTERVAL)
+            cached = await self._response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            if not await lock.locked():
+                # 持锁方已结束但未写入缓存（如调用失败），由本请求自行调用
+                break
+        return await call()
+
+    async def _replay_stream(self, chunks: List[str]) -> AsyncGenerator[str, None]:
+        """将缓存的数据块回放为流，可按配置控制节奏"""
+        for chunk in chunks:
+            if settings.AI_STREAM_REPLAY_DELAY > 0:
+                await asyncio.sleep(settings.AI_STREAM_REPLAY_DELAY)
+            yield chunk
+
+    async def _record_stream(
+        self,
+        cache_key: str,
+        lock_key: str,
+        source: AsyncIterator[str]
+    ) -> AsyncGenerator[str, None]:
+        """透传上游数据块，完整结束后缓存数据块序列并释放进行中标记"""
+        chunks = []
+        try:
+            async for chunk in source:
+                chunks.append(chunk)
+                yield chunk
+            await self._cache_response(
+                cache_key, json.dumps(chunks, ensure_ascii=False), CACHE_NAMESPACE_STREAM
+            )
+        finally:
+            try:
+                await cache_manager.redis.delete(lock_key)
+            except Exception as e:
+                app_logger.warning(f"释放流式请求标记失败: {str(e)}")
+
+    async def _abandon_shared_stream(self, shared_stream_id: str, lock_key: str, error: BaseException):
+        """发起方在发布前失败：向共享流写入错误并释放进行中标记，跟随方不必等到超时"""
+        if isinstance(error, asyncio.CancelledError):
+            message = "相同请求的发起方已取消，请重试"
+        else:
+            message = str(error) or "上游流式请求失败"
+        try:
+            await stream_broker.fail(shared_stream_id, message)
+            await cache_manager.redis.delete(lock_key)
+        except Exception as e:
+            app_logger.warning(f"释放共享流失败: {str(e)}")
+
+    async def _open_stream_source(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str
+    ) -> AsyncIterator[str]:
+        """获取流式响应的数据来源
+
+        命中缓存时回放缓存的数据块；相同请求正在生成时（可能在其他worker上）
+        跟随其共享流；否则由本请求调用上游，并把结果发布到共享流供后续相同请求复用。
+        """
+        cache_key = self._generate_cache_key(messages, model, namespace=CACHE_NAMESPACE_STREAM)
+        cached = await self._get_cached_response(cache_key, CACHE_NAMESPACE_STREAM)
+        if cached is not None:
+            app_logger.info(f"命中流式响应缓存: {cache_key}")
+            return self._replay_stream(json.loads(cached))
+
+        shared_stream_id = f"shared:{cache_key}"
+        lock_key = f"{settings.REDIS_PREFIX}stream_inflight:{cache_key}"
+        acquired = await cache_manager.redis.set(
+            lock_key, "1", nx=True, ex=settings.STREAM_BROKER_TTL
+        )
+        if acquired:
+            # 清除上一次失败留下的错误标记，新的跟随方不会读到它
+            await stream_broker.cleanup(shared_stream_id)
+            try:
+                stream = await self._make_api_call(messages=messages, model=model, stream=True)
+            except BaseException as e:
+                await self._abandon_shared_stream(shared_stream_id, lock_key, e)
+                raise
+            try:
+                await stream_broker.publish(
+                    shared_stream_id,
+                    self._record_stream(cache_key, lock_key, self._iter_stream_content(stream))
+                )
+            except BaseException as e:
+                # 发布任务未启动时流不会被读取，需要主动归还槽位
+                await stream.aclose()
+                await self._abandon_shared_stream(shared_stream_id, lock_key, e)
+                raise
+        else:
+            app_logger.info(f"复用进行中的相同流式请求: {cache_key}")
+
+        return stream_broker.subscribe(shared_stream_id)
+
     async def _make_api_call(
         self,
         messages: List[Dict[str, Any]],
@@ -75,9 +296,10 @@ class AIClient:
         stream: bool = False,
         temperature: float = 0.7,
         max_tokens: Optional[int] = None,
+        priority: int = PRIORITY_INTERACTIVE,
         **kwargs
     ) -> Any:
-        """进行API调用"""
+        """进行API调用，经由上游调度器控制并发和速率，遇到429时退避重试"""
         try:
             # 移除不支持的参数
             api_params = {
@@ -96,40 +318,161 @@ class AIClient:
                 if key not in ['session_id']:  # 排除不支持的参数
                     api_params[key] = value
 
-            try:
-                response = await self.client.chat.completions.create(**api_params)
-                return response
-            except Exception as e:
-                app_logger.error(f"API调用出错: {str(e)}")
-                raise APIError(f"API调用出错: {str(e)}")
+            estimated_tokens = count_messages_tokens(messages) + (
+                max_tokens or settings.UPSTREAM_DEFAULT_COMPLETION_TOKENS
+            )
+
+            for attempt in range(self.max_retries):
+                try:
+                    async with AsyncExitStack() as slot:
+                        await slot.enter_async_context(
+                            upstream_scheduler.slot(priority, estimated_tokens)
+                        )
+                        response = await self.client.chat.completions.create(**api_params)
+                        if stream:
+                            # 槽位转交给流对象，读完后再归还
+                            response = _SlotStream(response, slot.pop_all())
+                    upstream_scheduler.record_success()
+                    if not stream and getattr(response, "usage", None):
+                        upstream_scheduler.record_usage(
+                            estimated_tokens, response.usage.total_tokens
+                        )
+                    return response
+                except RateLimitError as e:
+                    upstream_scheduler.record_rate_limited(self._get_retry_after(e))
+                    if attempt == self.max_retries - 1:
+                        app_logger.error(f"API调用多次触发限流: {str(e)}")
+                        raise APIError(f"API调用出错: {str(e)}")
+                except Exception as e:
+                    app_logger.error(f"API调用出错: {str(e)}")
+                    raise APIError(f"API调用出错: {str(e)}")
                 
         except Exception as e:
             app_logger.error(f"API调用失败: {str(e)}")
             raise APIError(f"API调用失败: {str(e)}")
 
-    async def _get_cached_response(self, cache_key: str) -> Optional[str]:
-        """获取缓存的响应"""
-        return await self._response_cache.get(cache_key)
+    @staticmethod
+    def _get_retry_after(error: RateLimitError) -> Optional[float]:
+        """从429响应头中读取Retry-After秒数"""
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return None
 
-    async def _cache_response(self, cache_key: str, response: str, ttl: int = 3600):
-        """缓存响应结果"""
+    async def _get_cached_response(
+        self,
+        cache_key: str,
+        namespace: str = CACHE_NAMESPACE_CHAT
+    ) -> Optional[str]:
+        """获取缓存的响应，并记录命中统计"""
+        cached = await self._response_cache.get(cache_key)
+        await self._record_cache_stat(namespace, cached is not None)
+        return cached
+
+    async def _cache_response(
+        self,
+        cache_key: str,
+        response: str,
+        namespace: str = CACHE_NAMESPACE_CHAT
+    ):
+        """按命名空间的缓存时间缓存响应结果"""
+        ttl = self._cache_ttls.get(namespace, settings.AI_CACHE_TTL_CHAT)
         await self._response_cache.set(cache_key, response, ttl)
 
-    def _generate_cache_key(self, messages: List[Dict[str, Any]], **kwargs) -> str:
-        """生成缓存键"""
-        # 创建一个包含所有相关参数的字典
-        cache_dict = {
-            "messages": messages,
-            **kwargs
+    def _cache_stats_key(self) -> str:
+        return f"{settings.REDIS_PREFIX}ai_cache_stats"
+
+    async def _record_cache_stat(self, namespace: str, hit: bool):
+        """记录缓存命中/未命中次数，统计失败不影响正常请求"""
+        try:
+            field = f"{namespace}:{'hits' if hit else 'misses'}"
+            await cache_manager.redis.hincrby(self._cache_stats_key(), field, 1)
+        except Exception as e:
+            app_logger.warning(f"记录缓存统计失败: {str(e)}")
+
+    async def get_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各命名空间的缓存命中统计"""
+        raw = await cache_manager.redis.hgetall(self._cache_stats_key())
+        stats = {}
+        for namespace, ttl in self._cache_ttls.items():
+            hits = int(raw.get(f"{namespace}:hits", 0))
+            misses = int(raw.get(f"{namespace}:misses", 0))
+            total = hits + misses
+            stats[namespace] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "ttl": ttl
+            }
+        return stats
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        """规范化文本：统一Unicode组合形式和换行符，去掉行尾空白和多余空行
+
+        只做NFC规范化，全角标点和数字会原样发送给模型，不折叠为半角；
+        行首缩进和行内对齐可能影响含义（代码、YAML、表格），保持不变
+        """
+        text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+        lines = [line.rstrip() for line in text.split("\n")]
+        return _BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip("\n")
+
+    def _normalize_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """规范化消息列表，仅用于生成缓存键，不影响实际请求内容"""
+        normalized = []
+        for msg in messages:
+            content = msg.get("content")
+            if isinstance(content, str):
+                content = self._normalize_text(content)
+            elif isinstance(content, list):
+                content = [
+                    {**part, "text": self._normalize_text(part["text"])}
+                    if isinstance(part, dict) and isinstance(part.get("text"), str)
+                    else part
+                    for part in content
+                ]
+            normalized.append({"role": msg.get("role"), "content": content})
+        return normalized
+
+    def _canonical_request_digest(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        **kwargs
+    ) -> str:
+        """计算规范化请求的稳定摘要，跨进程、跨重启保持一致"""
+        canonical = {
+            "version": settings.AI_CACHE_KEY_VERSION,
+            "model": model,
+            "temperature": round(float(temperature), 4),
+            "messages": self._normalize_messages(messages),
+            "params": {k: v for k, v in kwargs.items() if k != 'session_id'},
         }
-        # 转换为JSON字符串并生成哈希
-        return f"ai_response:{hash(json.dumps(cache_dict, sort_keys=True))}"
+        payload = json.dumps(
+            canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+        )
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).hexdigest()
+
+    def _generate_cache_key(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float = 0.7,
+        namespace: str = CACHE_NAMESPACE_CHAT,
+        **kwargs
+    ) -> str:
+        """生成缓存键"""
+        digest = self._canonical_request_digest(messages, model, temperature, **kwargs)
+        return f"{namespace}:{digest}"
 
     async def generate_response(
         self,
         messages: List[Dict[str, Any]],
         system_prompt: Optional[str] = None,
         use_cache: bool = True,
+        cache_namespace: str = CACHE_NAMESPACE_CHAT,
+        priority: int = PRIORITY_INTERACTIVE,
         **kwargs
     ) -> str:
         """生成AI响应，支持缓存"""
@@ -138,22 +481,34 @@ class AIClient:
             if system_prompt:
                 messages.insert(0, {"role": "system", "content": system_prompt})
 
-            # 检查缓存
-            if use_cache:
-                cache_key = self._generate_cache_key(messages, **kwargs)
-                cached_response = await self._get_cached_response(cache_key)
-                if cached_response:
-                    return cached_response
+            model = kwargs.pop("model", None) or self.model
+            temperature = kwargs.pop("temperature", 0.7)
 
-            # 生成新响应
-            response = await self._make_api_call(messages, **kwargs)
-            result = response.choices[0].message.content
+            async def _call() -> str:
+                # 生成新响应
+                response = await self._make_api_call(
+                    messages, model=model, temperature=temperature, priority=priority, **kwargs
+                )
+                result = response.choices[0].message.content
 
-            # 缓存响应
-            if use_cache:
-                await self._cache_response(cache_key, result)
+                # 缓存响应
+                if use_cache:
+                    await self._cache_response(cache_key, result, cache_namespace)
+                return result
 
-            return result
+            if not use_cache:
+                return await _call()
+
+            # 检查缓存
+            cache_key = self._generate_cache_key(
+                messages, model, temperature, cache_namespace, **kwargs
+            )
+            cached_response = await self._get_cached_response(cache_key, cache_namespace)
+            if cached_response:
+                return cached_response
+
+            # 合并并发的相同请求
+            return await self._single_flight(cache_key, _call)
 
         except Exception as e:
             app_logger.error(f"生成响应失败: {str(e)}")
@@ -177,8 +532,9 @@ class AIClient:
                     segments[0], query, system_prompt, use_cache
                 )
             else:
-                # 多段处理
-                return await self._analyze_multiple_segments(
+                # 多段处理：分层map-reduce，避免最终提示词超长
+                from app.services.map_reduce_service import map_reduce_service
+                return await map_reduce_service.run(
                     segments, query, system_prompt, use_cache
                 )
 
@@ -186,29 +542,13 @@ class AIClient:
             app_logger.error(f"文档分析失败: {str(e)}")
             raise APIError(f"文档分析失败: {str(e)}")
 
-    def _split_text(self, text: str, max_length: int = 4000) -> List[str]:
-        """将长文本分段"""
-        if len(text) <= max_length:
-            return [text]
-
-        segments = []
-        current_segment = []
-        current_length = 0
-
-        for paragraph in text.split('\n'):
-            if current_length + len(paragraph) > max_length:
-                if current_segment:
-                    segments.append('\n'.join(current_segment))
-                    current_segment = []
-                    current_length = 0
-
-            current_segment.append(paragraph)
-            current_length += len(paragraph) + 1  # +1 for newline
-
-        if current_segment:
-            segments.append('\n'.join(current_segment))
-
-        return segments
+    def _split_text(self, text: str, max_tokens: Optional[int] = None) -> List[str]:
+        """按token预算将长文本分段，保留标题、表格和代码块结构"""
+        splitter = TextSplitter(
+            max_tokens or settings.DOC_SEGMENT_MAX_TOKENS,
+            settings.DOC_SEGMENT_OVERLAP_TOKENS
+        )
+        return list(splitter.split(text)) or [text]
 
     async def _analyze_single_segment(
         self,
@@ -222,42 +562,9 @@ class AIClient:
             {"role": "user", "content": f"文档内容：\n{text}\n\n分析要求：{query}"}
         ]
         return await self.generate_response(
-            messages, system_prompt, use_cache=use_cache
-        )
-
-    async def _analyze_multiple_segments(
-        self,
-        segments: List[str],
-        query: str,
-        system_prompt: Optional[str],
-        use_cache: bool
-    ) -> str:
-        """分析多个文本段落并整合结果"""
-        # 并行处理所有段落
-        segment_analyses = await asyncio.gather(*[
-            self._analyze_single_segment(
-                segment,
-                "请总结这段内容的要点。",
-                system_prompt,
-                use_cache
-            )
-            for segment in segments
-        ])
-
-        # 整合分析结果
-        combined_analysis = "\n\n".join([
-            f"第{i+1}部分分析：\n{analysis}"
-            for i, analysis in enumerate(segment_analyses)
-        ])
-
-        # 生成最终总结
-        final_messages = [
-            {"role": "user", "content": f"基于以下果，{query}\n\n{combined_analysis}"}
-        ]
-        return await self.generate_response(
-            final_messages,
-            system_prompt,
-            use_cache=use_cache
+            messages, system_prompt, use_cache=use_cache,
+            cache_namespace=CACHE_NAMESPACE_DOCUMENT,
+            priority=PRIORITY_BATCH
         )
 
     async def analyze_image(
@@ -287,25 +594,32 @@ class AIClient:
             if system_prompt:
                 messages.insert(0, {"role": "system", "content": system_prompt})
 
+            async def _call() -> str:
+                # 使用 qwen-vl-plus 模型，通过参数传递而不是kwargs
+                response = await self._make_api_call(
+                    messages=messages,
+                    model=self.vision_model  # 使用类属性中定义的视觉模型
+                )
+                result = response.choices[0].message.content
+
+                # 缓存响应
+                if use_cache:
+                    await self._cache_response(cache_key, result, CACHE_NAMESPACE_IMAGE)
+                return result
+
+            if not use_cache:
+                return await _call()
+
             # 检查缓存
-            if use_cache:
-                cache_key = self._generate_cache_key(messages)
-                cached_response = await self._get_cached_response(cache_key)
-                if cached_response:
-                    return cached_response
-
-            # 使用 qwen-vl-plus 模型，通过参数传递而不是kwargs
-            response = await self._make_api_call(
-                messages=messages,
-                model=self.vision_model  # 使用类属性中定义的视觉模型
+            cache_key = self._generate_cache_key(
+                messages, self.vision_model, namespace=CACHE_NAMESPACE_IMAGE
             )
-            result = response.choices[0].message.content
-
-            # 缓存响应
-            if use_cache:
-                await self._cache_response(cache_key, result)
+            cached_response = await self._get_cached_response(cache_key, CACHE_NAMESPACE_IMAGE)
+            if cached_response:
+                return cached_response
 
-            return result
+            # 合并并发的相同请求
+            return await self._single_flight(cache_key, _call)
 
         except Exception as e:
             app_logger.error(f"图片分析失败: {str(e)}")
@@ -317,15 +631,11 @@ class AIClient:
             # 清理现有的流
             await self.cleanup_stream(session_id)
             
-            # 创建新的流式响应
-            stream = await self._make_api_call(
-                messages=messages,
-                model=model or self.model,  # 使用传入的model或默认model
-                stream=True
-            )
+            # 获取流式响应来源（缓存回放、共享进行中的请求或新的上游调用）
+            source = await self._open_stream_source(messages, model or self.model)
             
-            # 存储流
-            self._active_streams[session_id] = stream
+            # 在后台消费数据来源并发布到Redis，任意worker均可读取
+            await stream_broker.publish(session_id, source)
             
         except Exception as e:
             app_logger.error(f"初始化流式响应失败: {str(e)}")
@@ -334,13 +644,11 @@ class AIClient:
     async def get_stream_response(self, session_id: str) -> AsyncGenerator[str, None]:
         """获取流式响应"""
         try:
-            stream = self._active_streams.get(session_id)
-            if not stream:
+            if not await stream_broker.exists(session_id):
                 raise APIError("未找到活动的流式响应")
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            async for content in stream_broker.subscribe(session_id):
+                yield content
                 
         except Exception as e:
             app_logger.error(f"获取流式响应失败: {str(e)}")
@@ -348,9 +656,7 @@ class AIClient:
         
     async def cleanup_stream(self, session_id: str):
         """清理指定会话的流"""
-        if session_id in self._active_streams:
-            # 从活动流中移除
-            del self._active_streams[session_id]
+        await stream_broker.cleanup(session_id)
 
     async def analyze_image_stream(
         self,
@@ -443,15 +749,11 @@ class AIClient:
             # 清理现有的流
             await self.cleanup_stream(session_id)
             
-            # 创建新的流式响应
-            stream = await self._make_api_call(
-                messages=messages,
-                model=self.vision_model,
-                stream=True
-            )
+            # 获取流式响应来源（缓存回放、共享进行中的请求或新的上游调用）
+            source = await self._open_stream_source(messages, self.vision_model)
             
-            # 存储流
-            self._active_streams[session_id] = stream
+            # 在后台消费数据来源并发布到Redis
+            await stream_broker.publish(session_id, source)
             
         except Exception as e:
             app_logger.error(f"初始化图片流式响应失败: {str(e)}")
@@ -460,15 +762,11 @@ class AIClient:
     async def get_stream(self, session_id: str):
         """获取流式响应"""
         try:
-            stream = self._active_streams.get(session_id)
-            if not stream:
+            if not await stream_broker.exists(session_id):
                 raise APIError("未找到活动的流式响应")
 
-            async for chunk in stream:
-                if hasattr(chunk.choices[0].delta, "content"):
-                    content = chunk.choices[0].delta.content
-                    if content:
-                        yield content
+            async for content in stream_broker.subscribe(session_id):
+                yield content
 
             # 清理流
             await self.cleanup_stream(session_id)
@@ -500,11 +798,15 @@ class AIClient:
                 **{k: v for k, v in kwargs.items() if k != 'session_id'}
             )
             
-            # 存储会话信息
-            self._analysis_sessions[analysis_session_id] = {
-                'stream': stream,
-                'messages': messages
-            }
+            # 在后台消费上游流并发布到Redis
+            try:
+                await stream_broker.publish(
+                    self._analysis_stream_id(analysis_session_id),
+                    self._iter_stream_content(stream)
+                )
+            except BaseException:
+                await stream.aclose()
+                raise
             self._current_analysis_session_id = analysis_session_id
             
             # 将会话ID存储到Redis中，设置过期时间为5分钟
@@ -529,23 +831,24 @@ class AIClient:
             if not is_active:
                 raise APIError("分析会话不存在或已过期")
 
-            session_data = self._analysis_sessions.get(analysis_session_id)
-            if not session_data:
+            stream_id = self._analysis_stream_id(analysis_session_id)
+            if not await stream_broker.exists(stream_id):
                 raise APIError("分析会话不存在")
 
-            stream = session_data['stream']
-            async for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            async for content in stream_broker.subscribe(stream_id):
+                yield content
 
         except Exception as e:
             app_logger.error(f"获取分析流失败: {str(e)}")
             raise APIError(f"获取分析流失败: {str(e)}")
         finally:
             # 清理会话
-            if analysis_session_id in self._analysis_sessions:
-                del self._analysis_sessions[analysis_session_id]
-                await self.redis_client.delete(f"analysis_session:{analysis_session_id}")
+            await stream_broker.cleanup(self._analysis_stream_id(analysis_session_id))
+            await self.redis_client.delete(f"analysis_session:{analysis_session_id}")
+
+    def _analysis_stream_id(self, analysis_session_id: str) -> str:
+        """分析会话在流中转中的ID"""
+        return f"analysis:{analysis_session_id}"
 
     async def get_current_analysis_session_id(self) -> Optional[str]:
         """获取当前分析会话ID"""
@@ -0,0 +1,144 @@
+from typing import AsyncIterable, NamedTuple, Optional
+from pathlib import Path
+import hashlib
+import os
+import uuid
+import aiofiles
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.db.models import FileBlob
+
+BLOB_DIR = "blobs"
+STAGING_DIR = "tmp"
+
+class StagedBlob(NamedTuple):
+    """已写入临时文件、尚未入库的上传内容"""
+    temp_path: Path
+    content_hash: str
+    size: int
+    suffix: str
+
+class BlobStore:
+    """内容寻址的文件存储
+
+    上传内容边写临时文件边计算SHA-256，再按哈希存放到 blobs/ab/cd/<hash><ext>；
+    相同内容只保存一份，file_blobs表记录每份内容被多少条文件记录引用，
+    引用数降为0时删除磁盘文件。修改引用数和删除磁盘文件时锁定对应记录（SELECT ... FOR UPDATE），
+    避免并发上传相同内容时引用到正在删除的文件。
+    """
+
+    def _blob_relative_path(self, content_hash: str, suffix: str) -> Path:
+        return Path(BLOB_DIR) / content_hash[:2] / content_hash[2:4] / f"{content_hash}{suffix}"
+
+    async def stage(self, chunks: AsyncIterable[bytes], suffix: str = "") -> StagedBlob:
+        """把上传内容写入临时文件，同时计算内容哈希"""
+        staging_dir = settings.UPLOAD_DIR / STAGING_DIR
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = staging_dir / uuid.uuid4().hex
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(temp_path, 'wb') as f:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return StagedBlob(temp_path, digest.hexdigest(), size, suffix.lower())
+
+    def discard(self, staged: StagedBlob):
+        """丢弃未入库的临时文件"""
+        staged.temp_path.unlink(missing_ok=True)
+
+    async def acquire(self, db: AsyncSession, staged: StagedBlob, mime_type: Optional[str] = None) -> FileBlob:
+        """把临时文件存入内容寻址存储并增加引用数；相同内容已存在时直接复用"""
+        blob = await self._get_by_hash(db, staged.content_hash, lock=True)
+        if blob is None:
+            relative_path = self._blob_relative_path(staged.content_hash, staged.suffix)
+            self._move_into_place(staged, relative_path)
+            blob = FileBlob(
+                content_hash=staged.content_hash,
+                storage_path=str(relative_path),
+                file_size=staged.size,
+                mime_type=mime_type,
+                ref_count=1
+            )
+            db.add(blob)
+            try:
+                await db.commit()
+                await db.refresh(blob)
+                return blob
+            except IntegrityError:
+                # 并发上传了相同内容，改为引用对方创建的记录
+                await db.rollback()
+                blob = await self._get_by_hash(db, staged.content_hash, lock=True)
+                if blob is None:
+                    raise
+                if blob.storage_path != str(relative_path):
+                    (settings.UPLOAD_DIR / relative_path).unlink(missing_ok=True)
+        else:
+            if (settings.UPLOAD_DIR / blob.storage_path).exists():
+                self.discard(staged)
+            else:
+                app_logger.warning(f"内容存储文件丢失，重新写入: {blob.storage_path}")
+                self._move_into_place(staged, Path(blob.storage_path))
+
+        await db.execute(
+            update(FileBlob)
+            .where(FileBlob.id == blob.id)
+            .values(ref_count=FileBlob.ref_count + 1)
+        )
+        await db.commit()
+        await db.refresh(blob)
+        app_logger.info(f"复用已存储的文件内容: {staged.content_hash[:12]}, 引用数={blob.ref_count}")
+        return blob
+
+    async def release(self, db: AsyncSession, blob_id: int):
+        """减少引用数，降为0时删除记录和磁盘文件；会一并提交调用方在同一会话中未提交的修改"""
+        result = await db.execute(
+            select(FileBlob)
+            .where(FileBlob.id == blob_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        blob = result.scalar_one_or_none()
+        if blob is None:
+            await db.commit()
+            return
+        if blob.ref_count > 1:
+            await db.execute(
+                update(FileBlob)
+                .where(FileBlob.id == blob_id)
+                .values(ref_count=FileBlob.ref_count - 1)
+            )
+            await db.commit()
+            return
+
+        # 持有行锁时删除磁盘文件，并发上传相同内容的请求会等到记录删除后重新写入
+        stored_path = settings.UPLOAD_DIR / blob.storage_path
+        stored_path.unlink(missing_ok=True)
+        # 同时删除以内容哈希命名的衍生文件（视觉模型版本、缩略图）
+        for derived_path in stored_path.parent.glob(f"{blob.content_hash}.*"):
+            derived_path.unlink(missing_ok=True)
+        await db.delete(blob)
+        await db.commit()
+
+    async def _get_by_hash(self, db: AsyncSession, content_hash: str, lock: bool = False) -> Optional[FileBlob]:
+        query = select(FileBlob).where(FileBlob.content_hash == content_hash)
+        if lock:
+            query = query.with_for_update().execution_options(populate_existing=True)
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+
+    def _move_into_place(self, staged: StagedBlob, relative_path: Path):
+        target = settings.UPLOAD_DIR / relative_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staged.temp_path, target)
+
+# 创建全局内容寻址存储实例
+blob_store = BlobStore()
@@ -1,27 +1,70 @@
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.context import get_conversation, add_message, get_context_messages
-from app.models.schemas import MessageCreate
+from app.services.context import get_conversation_id, get_context_window
+from app.models.schemas import MessageResponse
 from app.services.ai_client import ai_client
 from app.core.config import settings
 from app.core.logging import app_logger
+from app.utils.tokens import count_tokens, count_messages_tokens
+from app.services.summary_service import summary_service
+from app.services.message_writer import MessageWriter, save_assistant_reply
+from app.services.extraction_cache import extraction_cache, hash_bytes, hash_file
+from app.services.extraction_pool import extraction_pool
+from app.services.pdf_stream import PdfPageStream
+from app.services import extractors
 from app.services.exceptions import NotFoundError, APIError
 from sqlalchemy import select, and_, desc
 from app.db.models import Message, File
 import json
 from pathlib import Path
-import aiofiles
 import aiohttp
 import uuid
-import io
-from pypdf import PdfReader
-from docx import Document
-import tempfile
-import subprocess
-import markdown
-from bs4 import BeautifulSoup
-import re
-import chardet
+
+# 流式响应协议：full 每个数据块携带累计全文（兼容旧客户端），delta 只发送增量和序号，全文在end事件中发送一次
+STREAM_PROTOCOL_FULL = "full"
+STREAM_PROTOCOL_DELTA = "delta"
+STREAM_PROTOCOLS = (STREAM_PROTOCOL_FULL, STREAM_PROTOCOL_DELTA)
+
+def build_chunk_data(
+    protocol: str,
+    seq: int,
+    content: str,
+    full_text: str,
+    **extra: Any
+) -> Dict[str, Any]:
+    """按流式协议构建数据块事件"""
+    if protocol == STREAM_PROTOCOL_DELTA:
+        return {'type': 'chunk', 'data': {'seq': seq, 'content': content, **extra}}
+    return {'type': 'chunk', 'data': {'content': content, **extra, 'full_text': full_text}}
+
+def build_end_data(protocol: str, seq: int, full_text: str) -> Dict[str, Any]:
+    """按流式协议构建结束事件"""
+    if protocol == STREAM_PROTOCOL_DELTA:
+        return {'type': 'end', 'data': {'seq': seq, 'full_text': full_text}}
+    return {'type': 'end', 'data': {'full_text': full_text}}
+
+async def get_history_context(
+    db: AsyncSession,
+    conversation_id: int,
+    reserve_tokens: int = 0,
+    exclude_message_id: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[MessageResponse]]:
+    """获取会话摘要和摘要之后的最近消息
+    
+    Returns:
+        (摘要系统消息列表, 按token预算截取的上下文消息)
+    """
+    summary = await summary_service.get_summary(db, conversation_id)
+    summary_messages = [summary_service.build_prompt_message(summary)] if summary else []
+
+    context_messages = await get_context_window(
+        db,
+        conversation_id,
+        reserve_tokens=reserve_tokens + count_messages_tokens(summary_messages),
+        exclude_message_id=exclude_message_id,
+        after_message_id=summary.last_message_id if summary else None
+    )
+    return summary_messages, context_messages
 
 async def process_chat(
     db: AsyncSession,
@@ -31,25 +74,21 @@ async def process_chat(
 ) -> Dict[str, str]:
     """处理普通聊天请求"""
     # 获取会话
-    conversation = await get_conversation(db, session_id)
-    if not conversation:
+    conversation_id = await get_conversation_id(db, session_id)
+    if conversation_id is None:
         raise NotFoundError(detail=f"会话 {session_id} 不存在")
     
     try:
         print(f"system_prompt>>>>>>>>: {system_prompt}")
-        # 保存用户消息
-        user_msg = MessageCreate(
-            role="user",
-            content=user_message,
-            file_id=None
-        )
-        saved_user_msg = await add_message(db, conversation.id, user_msg)
+        # 用户消息和AI回复在得到回复后一次写入
+        writer = MessageWriter(db, conversation_id)
+        saved_user_msg = writer.add_user(user_message)
 
-        # 获取上下文消息
-        context_messages = await get_context_messages(
+        # 获取会话摘要和按token预算截取的最近消息（为系统提示和当前消息预留预算）
+        summary_messages, context_messages = await get_history_context(
             db,
-            conversation.id,
-            settings.MAX_CONTEXT_TURNS
+            conversation_id,
+            reserve_tokens=count_tokens(system_prompt) + count_tokens(user_message)
         )
 
               # 转换为AI客户端所需格式
@@ -58,6 +97,9 @@ async def process_chat(
         # 添加系统提示（如果有）
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
+
+        # 添加会话摘要
+        messages.extend(summary_messages)
             
         # 添加上下文消息
         messages.extend([
@@ -68,16 +110,19 @@ async def process_chat(
         # 添加当前用户消息
         messages.append({"role": "user", "content": user_message})
 
-        # 生成AI回复
-        ai_response = await ai_client.generate_response(messages)
+        # 生成AI回复，失败时仍保存用户消息，保证对话历史完整
+        try:
+            ai_response = await ai_client.generate_response(messages)
+        except Exception:
+            await writer.commit_quietly()
+            raise
 
-        # 保存AI回复，关联到用户消息
-        ai_msg = MessageCreate(
-            role="assistant",
-            content=ai_response,
-            parent_message_id=saved_user_msg.id  # 设置父消息ID，建立问答关系
-        )
-        await add_message(db, conversation.id, ai_msg)
+        # 保存用户消息和AI回复，回复关联到用户消息，建立问答关系
+        writer.add_assistant(ai_response, parent=saved_user_msg)
+        await writer.commit()
+
+        # 后台增量更新会话摘要
+        summary_service.schedule_update(conversation_id)
 
         return {
             "session_id": session_id,
@@ -94,20 +139,22 @@ async def initialize_stream_chat(
     system_prompt: Optional[str] = None
 ) -> None:
     """初始化流式聊天"""
-    conversation = await get_conversation(db, session_id)
-    if not conversation:
+    conversation_id = await get_conversation_id(db, session_id)
+    if conversation_id is None:
         raise NotFoundError(detail=f"话 {session_id} 不存在")
 
     try:
         # 保存用户消息
-        user_msg = MessageCreate(role="user", content=user_message)
-        saved_user_msg = await add_message(db, conversation.id, user_msg)
+        writer = MessageWriter(db, conversation_id)
+        saved_user_msg = writer.add_user(user_message)
+        await writer.commit()
 
-        # 获取上下文消息
-        context_messages = await get_context_messages(
+        # 获取会话摘要和按token预算截取的最近消息（为系统提示和当前消息预留预算）
+        summary_messages, context_messages = await get_history_context(
             db,
-            conversation.id,
-            settings.MAX_CONTEXT_TURNS
+            conversation_id,
+            reserve_tokens=count_tokens(system_prompt) + count_tokens(user_message),
+            exclude_message_id=saved_user_msg.id
         )
 
         # 转换为AI客户端所需格式
@@ -118,6 +165,9 @@ async def initialize_stream_chat(
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
 
+        # 添加会话摘要
+        messages.extend(summary_messages)
+
        # 添加上下文消息
         messages.extend([
             {"role": msg.role, "content": msg.content}
@@ -136,44 +186,36 @@ async def initialize_stream_chat(
 async def process_stream_chat(
     db: AsyncSession,
     session_id: str,
+    protocol: str = STREAM_PROTOCOL_FULL
 ) -> AsyncGenerator[str, None]:
     """处理流式聊天响应"""
-    conversation = None
+    conversation_id = None
     full_response = ""
+    seq = 0
     
     try:
-        conversation = await get_conversation(db, session_id)
-        if not conversation:
+        conversation_id = await get_conversation_id(db, session_id)
+        if conversation_id is None:
             raise NotFoundError(detail=f"会话 {session_id} 不存在")
 
         # 发送开始事件
         yield f"data: {json.dumps({'type': 'start', 'data': {}}, ensure_ascii=False)}\n\n"
 
         # 使用新的据库会话来获取最后的用户消息
-        last_user_message = await get_last_user_message(db, conversation.id)
+        last_user_message = await get_last_user_message(db, conversation_id)
         if not last_user_message:
-            app_logger.warning(f"未找到用户消息: conversation_id={conversation.id}")
+            app_logger.warning(f"未找到用户消息: conversation_id={conversation_id}")
             raise APIError(detail="未找到相关的用户消息")
 
         async for response_chunk in ai_client.get_stream_response(session_id):
             full_response += response_chunk
+            seq += 1
             # 发送数据块事件
-            chunk_data = {
-                'type': 'chunk',
-                'data': {
-                    'content': response_chunk,
-                    'full_text': full_response
-                }
-            }
+            chunk_data = build_chunk_data(protocol, seq, response_chunk, full_response)
             yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
 
         # 发送结束事件
-        end_data = {
-            'type': 'end',
-            'data': {
-                'full_text': full_response
-            }
-        }
+        end_data = build_end_data(protocol, seq, full_response)
         yield f"data: {json.dumps(end_data, ensure_ascii=False)}\n\n"
 
     except Exception as e:
@@ -190,28 +232,18 @@ async def process_stream_chat(
     finally:
         await ai_client.cleanup_stream(session_id)
 
-    # 在生成响应完成后，使用新的事务保存消息
+    # 在生成响应完成后保存AI回复（开启后台写入时放入写入队列），并更新会话摘要
     try:
-        if full_response and conversation:
-            # 创建并保存AI回复消息
-            ai_msg = MessageCreate(
-                role="assistant",
-                content=full_response,
-                parent_message_id=last_user_message.id
-            )
-            
-            # 保存消息并提交事务
-            await add_message(db, conversation.id, ai_msg)
-            await db.commit()
+        if full_response and conversation_id is not None:
+            await save_assistant_reply(db, conversation_id, full_response, last_user_message.id)
             
             app_logger.info(
-                f"成功保存AI回复消息: conversation_id={conversation.id}, "
+                f"成功保存AI回复消息: conversation_id={conversation_id}, "
                 f"parent_message_id={last_user_message.id}, "
                 f"content_preview={full_response[:100]}..."
             )
     except Exception as e:
         app_logger.error(f"保存AI回复消息失败: {str(e)}")
-        await db.rollback()
         # 这里我们不抛出异常，因为消息已经发送给了用��
 
 async def get_last_user_message(
@@ -238,32 +270,33 @@ async def init_image_stream_chat(
     session_id: str,
     message: str,
     image_url: str,
-    file_id: str
+    file_id: str,
+    file_record: Optional[File] = None
 ) -> None:
-    """初始化流式图片聊天"""
-    conversation = await get_conversation(db, session_id)
-    if not conversation:
+    """初始化流式图片聊天，file_record为尚未保存的文件记录时与用户消息一起写入"""
+    conversation_id = await get_conversation_id(db, session_id)
+    if conversation_id is None:
         raise NotFoundError(detail=f"会话 {session_id} 不存在")
 
     try:
-        # 保存用户消息到数据库
-        user_msg = MessageCreate(
-            role="user",
-            content=message,     # 只存储纯文本消息
-            file_id=file_id      # 文件ID存储在专门的字段中
-        )
-        saved_user_msg = await add_message(db, conversation.id, user_msg)
-
-        # 获取上下文消息
-        context_messages = await get_context_messages(
+        # 保存用户消息到数据库：只存储纯文本消息，文件ID存储在专门的字段中
+        writer = MessageWriter(db, conversation_id)
+        if file_record is not None:
+            writer.add_file(file_record)
+        saved_user_msg = writer.add_user(message, file_id=file_id)
+        await writer.commit()
+
+        # 获取会话摘要和按token预算截取的最近消息，排除刚保存的当前消息
+        summary_messages, context_messages = await get_history_context(
             db,
-            conversation.id,
-            settings.MAX_CONTEXT_TURNS
+            conversation_id,
+            reserve_tokens=count_tokens(message),
+            exclude_message_id=saved_user_msg.id
         )
 
         # 转换为AI客户端所需格式
-        messages = []
-        for msg in context_messages[:-1]:  # 排除最后条消息
+        messages = list(summary_messages)
+        for msg in context_messages:
             message_data = {"role": msg.role, "content": msg.content}
             if msg.file_id:  # 如果消息关联文件，添加文件信息
                 # 获取文件信息
@@ -303,40 +336,42 @@ async def init_file_stream_chat(
     message: str,
     file_id: str,
     file_type: str,
-    file_text: str
+    file_text: str,
+    file_record: Optional[File] = None
 ) -> None:
-    """初始化流式文件聊天"""
-    conversation = await get_conversation(db, session_id)
-    if not conversation:
+    """初始化流式文件聊天，file_record为尚未保存的文件记录时与用户消息一起写入"""
+    conversation_id = await get_conversation_id(db, session_id)
+    if conversation_id is None:
         raise NotFoundError(detail=f"会话 {session_id} 不存在")
 
     try:
         # 保存用户消息到数据库
-        user_msg = MessageCreate(
-            role="user",
-            content=message,
-            file_id=file_id
-        )
-        saved_user_msg = await add_message(db, conversation.id, user_msg)
-
-        # 获取上下文消息
-        context_messages = await get_context_messages(
+        writer = MessageWriter(db, conversation_id)
+        if file_record is not None:
+            writer.add_file(file_record)
+        saved_user_msg = writer.add_user(message, file_id=file_id)
+        await writer.commit()
+
+        # 获取会话摘要和按token预算截取的最近消息，排除刚保存的当前消息（文档内容计入预留预算）
+        summary_messages, context_messages = await get_history_context(
             db,
-            conversation.id,
-            settings.MAX_CONTEXT_TURNS
+            conversation_id,
+            reserve_tokens=count_tokens(message) + count_tokens(file_text),
+            exclude_message_id=saved_user_msg.id
         )
 
         # 转换为AI客户端所需格式
-        messages = []
-        for msg in context_messages[:-1]:  # 排除最后一条消息
+        messages = list(summary_messages)
+        for msg in context_messages:
             message_data = {"role": msg.role, "content": msg.content}
             messages.append(message_data)
 
         # 添加当前用户消息，包含文件内容
         if file_type == "image":
-            file_query = select(File).where(File.file_id == file_id)
-            result = await db.execute(file_query)
-            file_record = result.scalar_one_or_none()
+            if file_record is None:
+                file_query = select(File).where(File.file_id == file_id)
+                result = await db.execute(file_query)
+                file_record = result.scalar_one_or_none()
             messages.append({
                 "role": "user",
                 "content": [
@@ -363,279 +398,117 @@ async def init_file_stream_chat(
         app_logger.error(f"初始化流式文件聊天失败: {str(e)}")
         raise APIError(detail=f"初始化流式文件聊天失败: {str(e)}")
 
+# 支持提取文本的文件类型
+TEXT_EXTRACT_EXTENSIONS = ('.pdf', '.docx', '.doc', '.md', '.txt')
+
 @staticmethod
-async def extract_text(file_path: str) -> str:
-    """从文件中提取文本"""
+async def extract_text(
+    file_path: str,
+    content_hash: Optional[str] = None,
+    suffix: Optional[str] = None
+) -> str:
+    """从文件中提取文本，提取结果按文件内容的SHA-256缓存
+
+    本地文件由提取进程直接读取，主进程不加载文件内容；已知内容哈希时不再重新计算。
+    suffix为原始文件的扩展名，内容寻址存储中的文件路径可能沿用其他上传者的扩展名。
+    """
     try:
         app_logger.info(f"开始提取文件文: {file_path}")
+        file_ext = (suffix or Path(file_path).suffix).lower()
+        if file_ext not in TEXT_EXTRACT_EXTENSIONS:
+            error_msg = f"不支持的文件类型: {file_ext}"
+            app_logger.error(error_msg)
+            return error_msg
         
         # 如果是URL，尝试下载文件内容
         if file_path.startswith(('http://', 'https://')):
             app_logger.info("检测到URL文件，开始下载")
             async with aiohttp.ClientSession() as session:
                 async with session.get(file_path) as response:
-                    if response.status == 200:
-                        file_content = await response.read()
-                        app_logger.info(f"文件下载成功，大小: {len(file_content)} bytes")
-                        
-                        # 根据文件扩展名处理不同类型
-                        file_ext = Path(file_path).suffix.lower()
-                        if file_ext == '.pdf':
-                            return await process_pdf_content(file_content)
-                        elif file_ext in ['.docx', '.doc']:
-                            return await process_word_content(file_content, file_ext)
-                        elif file_ext == '.md':
-                            return await process_markdown_content(file_content.decode('utf-8'))
-                        elif file_ext == '.txt':
-                            return await process_txt_content(file_content)
-                    else:
+                    if response.status != 200:
                         error_msg = f"下载文件失败，状态码: {response.status}"
                         app_logger.error(error_msg)
                         return error_msg
-        
+                    file_content = await response.read()
+                    app_logger.info(f"文件下载成功，大小: {len(file_content)} bytes")
+
+            return await extraction_cache.get_or_extract(
+                hash_bytes(file_content),
+                f"chat{file_ext}",
+                lambda: extract_content(file_content, file_ext)
+            )
+
         # 处理本地文件
-        suffix = Path(file_path).suffix.lower()
-        app_logger.info(f"处理本地文件，文件类型: {suffix}")
-        
-        if suffix == '.pdf':
-            with open(file_path, 'rb') as f:
-                return await process_pdf_content(f.read())
-        elif suffix in ['.docx', '.doc']:
-            with open(file_path, 'rb') as f:
-                return await process_word_content(f.read(), suffix)
-        elif suffix == '.md':
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return await process_markdown_content(content)
-        elif suffix == '.txt':
-            with open(file_path, 'rb') as f:
-                return await process_txt_content(f.read())
-        else:
-            error_msg = f"不支持的文件类型: {suffix}"
-            app_logger.error(error_msg)
-            return error_msg
+        app_logger.info(f"处理本地文件，文件类型: {file_ext}")
+        local_path = Path(file_path)
+        return await extraction_cache.get_or_extract(
+            content_hash or await hash_file(local_path),
+            f"chat{file_ext}",
+            lambda: extract_content(local_path, file_ext)
+        )
 
     except Exception as e:
         app_logger.error(f"文本提取失败: {str(e)}", exc_info=True)
         return f"文本提取失败: {str(e)}"
 
+async def extract_content(content: Union[bytes, Path], file_ext: str) -> str:
+    """根据文件扩展名从文件内容或本地文件中提取文本，失败时抛出ValueError"""
+    if file_ext == '.pdf':
+        return await process_pdf_content(content)
+    elif file_ext in ['.docx', '.doc']:
+        return await process_word_content(content, file_ext)
+    elif file_ext == '.md':
+        return await process_markdown_content(
+            content.decode('utf-8') if isinstance(content, bytes) else content
+        )
+    elif file_ext == '.txt':
+        return await process_txt_content(content)
+    raise ValueError(f"不支持的文件类型: {file_ext}")
+
 @staticmethod
-async def process_pdf_content(content: bytes) -> str:
-    """处理PDF文件内容"""
+async def process_pdf_content(content: Union[bytes, Path]) -> str:
+    """处理PDF文件内容（在提取进程池中逐批解析页面）"""
     try:
-        app_logger.info("开始处理PDF文")
-        pdf = PdfReader(io.BytesIO(content))
-        text = []
-        total_pages = len(pdf.pages)
-        app_logger.info(f"PDF文件共 {total_pages} 页")
-        
-        for i, page in enumerate(pdf.pages, 1):
-            app_logger.debug(f"正在处理第 {i}/{total_pages} 页")
-            page_text = page.extract_text()
-            if page_text:
-                text.append(page_text)
-                
-        extracted_text = '\n'.join(text)
+        app_logger.info("开始处理PDF文件")
+        extracted_text = await PdfPageStream(content).read()
         app_logger.info(f"PDF文本提取成功，提取长度: {len(extracted_text)}")
         return extracted_text
     except Exception as e:
         app_logger.error(f"PDF文件处理失败: {str(e)}", exc_info=True)
-        return f"PDF文件处理失败: {str(e)}"
+        raise ValueError(f"PDF文件处理失败: {str(e)}")
 
 @staticmethod
-async def process_word_content(content: bytes, file_ext: str) -> str:
-    """处理Word文档内容"""
+async def process_word_content(content: Union[bytes, Path], file_ext: str) -> str:
+    """处理Word文档内容或本地文件（在提取进程池中解析）"""
     try:
         app_logger.info(f"开始处理Word文档 ({file_ext})")
-        
+        is_file = isinstance(content, Path)
         if file_ext == '.docx':
-            # 处理.docx文件
-            doc = Document(io.BytesIO(content))
-            paragraphs = []
-            
-            # 提取段落文本
-            app_logger.info(f"文档共有 {len(doc.paragraphs)} 个段落")
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    paragraphs.append(para.text)
-            
-            # 提取表格文本
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = ' | '.join(cell.text.strip() for cell in row.cells if cell.text.strip())
-                    if row_text:
-                        paragraphs.append(row_text)
-            
-            extracted_text = '\n'.join(paragraphs)
-            app_logger.info(f"DOCX文本提取成功，提取长度: {len(extracted_text)}")
-            return extracted_text
-            
-        elif file_ext == '.doc':
-            # 处理.doc文件 (需要使用临时文件)
-            app_logger.info("处理.doc文件，使用临时文件")
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.doc') as temp_file:
-                temp_file.write(content)
-                temp_path = temp_file.name
-            
-            try:
-                # 使用 antiword 转换 .doc 文件 (需要系统安装 antiword)
-                result = subprocess.run(
-                    ['antiword', temp_path],
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
-                
-                if result.returncode == 0:
-                    extracted_text = result.stdout
-                    app_logger.info(f"DOC文本提取成功，提取长度: {len(extracted_text)}")
-                    return extracted_text
-                else:
-                    error_msg = f"DOC文件处理失败: {result.stderr}"
-                    app_logger.error(error_msg)
-                    return error_msg
-                    
-            finally:
-                # 清理临时文件
-                Path(temp_path).unlink(missing_ok=True)
-                
+            extractor = extractors.extract_docx_file if is_file else extractors.extract_docx
+        else:
+            # .doc文件使用antiword转换（需要系统安装antiword）
+            extractor = extractors.extract_doc_file if is_file else extractors.extract_doc
+        extracted_text = await extraction_pool.run(extractor, str(content) if is_file else content)
+        app_logger.info(f"Word文本提取成功，提取长度: {len(extracted_text)}")
+        return extracted_text
     except Exception as e:
         app_logger.error(f"Word文档处理失败: {str(e)}", exc_info=True)
-        return f"Word文档处理失败: {str(e)}"
+        raise ValueError(f"Word文档处理失败: {str(e)}")
 
 @staticmethod
-async def process_markdown_content(content: str) -> str:
-    """处理Markdown文件内容"""
+async def process_markdown_content(content: Union[str, Path]) -> str:
+    """处理Markdown文件内容或本地文件（在提取进程池中解析），返回包含文档结构信息的文本"""
     try:
         app_logger.info("开始处理Markdown文件")
-        
-        # 保存原始的代码块
-        code_blocks = {}
-        
-        def save_code_block(match):
-            """保存代码块并返回占位符"""
-            block_id = f"CODE_BLOCK_{len(code_blocks)}"
-            code_blocks[block_id] = match.group(1)
-            return block_id
-        
-        # 保存代码块
-        content_with_placeholders = re.sub(
-            r'```[\w]*\n(.*?)```',
-            save_code_block,
-            content,
-            flags=re.DOTALL
-        )
-        
-        # 转换Markdown为HTML
-        html = markdown.markdown(
-            content_with_placeholders,
-            extensions=[
-                'markdown.extensions.tables',
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.nl2br'
-            ]
-        )
-        
-        # 使用BeautifulSoup提取文本
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # 提取所有文本内容
-        text_parts = []
-        
-        # 处理标题
-        for heading in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-            level = int(heading.name[1])
-            text_parts.append(f"{'#' * level} {heading.get_text().strip()}\n")
-        
-        # 处理段落
-        for p in soup.find_all('p'):
-            text_parts.append(p.get_text().strip() + '\n')
-        
-        # 处理列表
-        for ul in soup.find_all(['ul', 'ol']):
-            for li in ul.find_all('li'):
-                text_parts.append(f"- {li.get_text().strip()}\n")
-        
-        # 处理表格
-        for table in soup.find_all('table'):
-            for row in table.find_all('tr'):
-                cells = [cell.get_text().strip() for cell in row.find_all(['th', 'td'])]
-                text_parts.append(' | '.join(cells) + '\n')
-        
-        # 合并文本
-        extracted_text = '\n'.join(text_parts)
-        
-        # 还原代码块
-        for block_id, code in code_blocks.items():
-            extracted_text = extracted_text.replace(block_id, f"\n```\n{code}\n```\n")
-        
-        # 清理多余的空行
-        cleaned_text = re.sub(r'\n{3,}', '\n\n', extracted_text)
-        
-        app_logger.info(f"Markdown文本提取成功，提取长度: {len(cleaned_text)}")
-        
-        # 添加文档结构信息
-        structure_info = analyze_markdown_structure(content)
-        app_logger.info("Markdown文档结构分析完成")
-        
-        # 返回处理后的文本，包含文档结构信息
-        final_text = (
-            "# 文档结构信息\n"
-            f"{structure_info}\n\n"
-            "# 文档内容\n"
-            f"{cleaned_text}"
-        )
-        
+        if isinstance(content, Path):
+            final_text = await extraction_pool.run(extractors.extract_markdown_document_file, str(content))
+        else:
+            final_text = await extraction_pool.run(extractors.extract_markdown, content)
+        app_logger.info(f"Markdown文本提取成功，提取长度: {len(final_text)}")
         return final_text
-        
     except Exception as e:
         app_logger.error(f"Markdown文档处理失败: {str(e)}", exc_info=True)
-        return f"Markdown文档处理失败: {str(e)}"
-
-@staticmethod
-def analyze_markdown_structure(content: str) -> str:
-    """分析Markdown文档结构"""
-    try:
-        # 提取所有标题
-        headers = re.findall(r'^(#{1,6})\s+(.+)$', content, re.MULTILINE)
-        
-        # 统计代码块
-        code_blocks = re.findall(r'```(\w*)', content)
-        code_languages = [lang for lang in code_blocks if lang]
-        
-        # 统计链接和图片
-        links = re.findall(r'\[([^\]]+)\]\(([^\)]+)\)', content)
-        images = re.findall(r'!\[([^\]]*)\]\(([^\)]+)\)', content)
-        
-        # 构建结构信息
-        structure = []
-        structure.append("## 文档大纲")
-        for level, title in headers:
-            indent = "  " * (len(level) - 1)
-            structure.append(f"{indent}- {title}")
-        
-        if code_languages:
-            structure.append("\n## 代码块信息")
-            lang_count = {}
-            for lang in code_languages:
-                lang_count[lang] = lang_count.get(lang, 0) + 1
-            for lang, count in lang_count.items():
-                lang_name = lang if lang else '未指定语言'
-                structure.append(f"- {lang_name}: {count} 个代码块")
-        
-        if links:
-            structure.append("\n## 链接信息")
-            structure.append(f"- 总计: {len(links)} 个链接")
-        
-        if images:
-            structure.append("\n## 图片信息")
-            structure.append(f"- 总计: {len(images)} 张图片")
-        
-        return '\n'.join(structure)
-        
-    except Exception as e:
-        app_logger.error(f"Markdown结构分析失败: {str(e)}", exc_info=True)
-        return "Markdown结构分析失败"
+        raise ValueError(f"Markdown文档处理失败: {str(e)}")
 
 async def initialize_message_analysis_stream(
     messages: List[Dict[str, Any]],
@@ -694,7 +567,10 @@ async def initialize_message_analysis_stream(
         app_logger.error(f"初始化消息分析流失败: {str(e)}")
         raise APIError(f"初始化消息分析流失败: {str(e)}")
 
-async def get_message_analysis_stream(session_id: str) -> AsyncGenerator[str, None]:
+async def get_message_analysis_stream(
+    session_id: str,
+    protocol: str = STREAM_PROTOCOL_FULL
+) -> AsyncGenerator[str, None]:
     """获取消息分析的流式响应"""
     try:
         # 发送开始事件
@@ -713,30 +589,20 @@ async def get_message_analysis_stream(session_id: str) -> AsyncGenerator[str, No
             return
 
         full_response = ""
+        seq = 0
         async for chunk in ai_client.get_analysis_stream(session_id):
             # 确保chunk是UTF-8编码
             if isinstance(chunk, bytes):
                 chunk = chunk.decode('utf-8')
             
             full_response += chunk
-            # 构建数据块事件并确保使用UTF-8编码
-            chunk_data = {
-                'type': 'chunk',
-                'data': {
-                    'content': chunk,
-                    'section': 'analysis',
-                    'full_text': full_response
-                }
-            }
-            yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n".encode('utf-8').decode('utf-8')
+            seq += 1
+            # 构建数据块事件
+            chunk_data = build_chunk_data(protocol, seq, chunk, full_response, section='analysis')
+            yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
 
         # 发送结束事件
-        end_data = {
-            'type': 'end',
-            'data': {
-                'full_text': full_response
-            }
-        }
+        end_data = build_end_data(protocol, seq, full_response)
         yield f"data: {json.dumps(end_data, ensure_ascii=False)}\n\n".encode('utf-8').decode('utf-8')
 
     except Exception as e:
@@ -750,92 +616,17 @@ async def get_message_analysis_stream(session_id: str) -> AsyncGenerator[str, No
         yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
 
 @staticmethod
-async def process_txt_content(content: bytes) -> str:
-    """处理TXT文件内容"""
+async def process_txt_content(content: Union[bytes, Path]) -> str:
+    """处理TXT文件内容或本地文件（在提取进程池中检测编码并规范化）"""
     try:
-        app_logger.info("开始处理TXT文件")
-        app_logger.info(f"文件大小: {len(content)} bytes")
-
-        # 检测文件编码
-        detection = chardet.detect(content)
-        encoding = detection['encoding']
-        confidence = detection['confidence']
-        app_logger.info(f"检测到编码: {encoding} (置信度: {confidence})")
-
-        # 尝试不同的编码方式
-        encodings_to_try = [
-            encoding,  # 检测到的编码
-            'utf-8',
-            'gb18030',  # 支持中文
-            'gbk',
-            'gb2312',
-            'ascii',
-            'iso-8859-1'
-        ]
-
-        text = None
-        used_encoding = None
-
-        for enc in encodings_to_try:
-            if not enc:
-                continue
-            try:
-                text = content.decode(enc)
-                used_encoding = enc
-                app_logger.info(f"成功使用 {enc} 编码解析文件")
-                break
-            except UnicodeDecodeError:
-                app_logger.debug(f"使用 {enc} 编码解析失败，尝试下一个编码")
-                continue
-
-        if text is None:
-            error_msg = "无法使用任何编码解析文件内容"
-            app_logger.error(error_msg)
-            return error_msg
-
-        # 处理文本内容
-        # 1. 规范化���行符
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        
-        # 2. 删除连续的空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        # 3. 删除行尾空白字符
-        text = '\n'.join(line.rstrip() for line in text.split('\n'))
-
-        # 4. 确保文件开头和结尾没有多余的空行
-        text = text.strip()
-
-        # 计算行数
-        line_count = text.count('\n') + 1
-
-        # 构建文件信息字符串
-        info_parts = [
-            "# 文件信息",
-            f"- 文件大小: {len(content)} bytes",
-            f"- 使用编码: {used_encoding}",
-            f"- 行数: {line_count}",
-            f"- 字符数: {len(text)}",
-            "",
-            "# 文件内容",
-            ""
-        ]
-        
-        file_info = '\n'.join(info_parts)
-        final_text = f"{file_info}{text}"
-
-        # 构建日志信息字符串
-        log_parts = [
-            "TXT文件处理完成:",
-            f"- 最终使用的编码: {used_encoding}",
-            f"- 处理后文本长度: {len(final_text)}",
-            f"- 行数: {line_count}"
-        ]
-        
-        app_logger.info('\n'.join(log_parts))
-
+        if isinstance(content, Path):
+            app_logger.info(f"开始处理TXT文件: {content}")
+            final_text = await extraction_pool.run(extractors.extract_txt_file, str(content))
+        else:
+            app_logger.info(f"开始处理TXT文件，文件大小: {len(content)} bytes")
+            final_text = await extraction_pool.run(extractors.extract_txt, content)
+        app_logger.info(f"TXT文件处理完成，处理后文本长度: {len(final_text)}")
         return final_text
-
     except Exception as e:
         app_logger.error(f"TXT文件处理失败: {str(e)}", exc_info=True)
-        return f"TXT文件处理失败: {str(e)}"
\ No newline at end of file
+        raise ValueError(f"TXT文件处理失败: {str(e)}")
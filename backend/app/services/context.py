@@ -1,16 +1,33 @@
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, update, case, or_
 from app.db.models import Conversation, Message, File
 from app.models.schemas import ConversationCreate, MessageCreate, MessageResponse
 from app.core.config import settings
 from app.services.exceptions import DatabaseError
 from app.core.logging import app_logger
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
+from app.utils.cache import cache_manager
 from sqlalchemy import and_
+from app.utils.tokens import count_tokens, truncate_to_tokens, MESSAGE_TOKEN_OVERHEAD
+from app.utils.pagination import encode_cursor, decode_cursor
 import json
 
+# 被截断消息的结尾标记
+TRUNCATED_MARKER = "\n...（内容过长，已截断）"
+# 流式读取历史消息时每批从数据库取回的行数
+HISTORY_STREAM_BATCH = 100
+
+# session_id到会话主键的映射缓存
+conversation_id_cache = cache_manager.get_cache('conversation_id')
+
+def with_messages() -> LoaderOption:
+    """历史视图的加载选项：会话的全部消息及消息关联的文件"""
+    return selectinload(Conversation.messages).joinedload(Message.file)
+
 async def create_conversation(
     db: AsyncSession,
     conversation: ConversationCreate
@@ -22,10 +39,11 @@ async def create_conversation(
         if existing:
             raise DatabaseError(detail=f"会话ID '{conversation.session_id}' 已存在")
             
-        db_conversation = Conversation(session_id=conversation.session_id)
+        # 新会话没有消息，直接初始化消息集合，避免响应序列化时触发加载
+        db_conversation = Conversation(session_id=conversation.session_id, messages=[])
         db.add(db_conversation)
         await db.commit()
-        await db.refresh(db_conversation)
+        await _cache_conversation_id(conversation.session_id, db_conversation.id)
         return db_conversation
     except IntegrityError as e:
         app_logger.error(f"创建对话失败: {str(e)}")
@@ -36,16 +54,109 @@ async def create_conversation(
 
 async def get_conversation(
     db: AsyncSession,
-    session_id: str
+    session_id: str,
+    load_messages: bool = False
 ) -> Optional[Conversation]:
-    """获取指定会话ID的对话及其消息"""
+    """获取指定会话ID的对话，只有load_messages为True时才加载全部消息"""
     query = (
         select(Conversation)
         .where(Conversation.session_id == session_id)
     )
+    if load_messages:
+        query = query.options(with_messages())
     result = await db.execute(query)
     return result.scalar_one_or_none()
 
+async def get_conversation_id(
+    db: AsyncSession,
+    session_id: str
+) -> Optional[int]:
+    """获取会话主键，session_id到主键的映射不会变化，优先从缓存读取"""
+    try:
+        cached = await conversation_id_cache.get(session_id)
+        if cached:
+            return int(cached)
+    except Exception as e:
+        app_logger.warning(f"读取会话ID缓存失败: {str(e)}")
+
+    result = await db.execute(
+        select(Conversation.id).where(Conversation.session_id == session_id)
+    )
+    conversation_id = result.scalar_one_or_none()
+    if conversation_id is not None:
+        await _cache_conversation_id(session_id, conversation_id)
+    return conversation_id
+
+async def _cache_conversation_id(session_id: str, conversation_id: int):
+    try:
+        await conversation_id_cache.set(session_id, str(conversation_id), expire=settings.CONVERSATION_ID_CACHE_TTL)
+    except Exception as e:
+        app_logger.warning(f"写入会话ID缓存失败: {str(e)}")
+
+async def record_conversation_activity(
+    db: AsyncSession,
+    conversation_id: int,
+    messages: Sequence[Tuple[str, datetime]]
+):
+    """写入消息时同步更新会话的消息数、最后一条消息预览和最后活动时间（不提交事务）
+
+    messages为本次写入的(内容, 时间)；预览和时间只在比已记录的更新时才覆盖，
+    并发写入同一会话时不会被较早的消息覆盖。
+    """
+    if not messages:
+        return
+    content, last_at = max(messages, key=lambda item: item[1])
+    is_newer = or_(Conversation.last_message_at.is_(None), Conversation.last_message_at <= last_at)
+    # MySQL按顺序执行SET子句，预览必须在last_message_at更新之前判断
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .ordered_values(
+            (Conversation.message_count, Conversation.message_count + len(messages)),
+            (Conversation.last_message_preview, case(
+                (is_newer, content[:settings.CONVERSATION_PREVIEW_LENGTH]),
+                else_=Conversation.last_message_preview
+            )),
+            (Conversation.last_message_at, case((is_newer, last_at), else_=Conversation.last_message_at)),
+            (Conversation.updated_at, case(
+                (or_(Conversation.updated_at.is_(None), Conversation.updated_at < last_at), last_at),
+                else_=Conversation.updated_at
+            ))
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+async def list_conversations(
+    db: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[Conversation], Optional[str]]:
+    """按最后活动时间倒序分页获取会话列表（键集分页，只查询conversations表）
+
+    Returns:
+        (本页会话, 下一页游标；没有更多时为None)
+    """
+    query = (
+        select(Conversation)
+        .order_by(desc(Conversation.updated_at), desc(Conversation.id))
+        .limit(limit + 1)
+    )
+    if cursor:
+        updated_at, conversation_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id)
+        ))
+
+    result = await db.execute(query)
+    conversations = list(result.scalars().all())
+    next_cursor = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        next_cursor = encode_cursor(last.updated_at, last.id)
+    return conversations, next_cursor
+
 async def add_message(
     db: AsyncSession,
     conversation_id: int,
@@ -58,11 +169,15 @@ async def add_message(
             role=message.role,
             content=message.content,
             parent_message_id=message.parent_message_id,
-            file_id=message.file_id
+            file_id=message.file_id,
+            token_count=count_tokens(message.content),
+            created_at=datetime.utcnow()
         )
         db.add(db_message)
+        await record_conversation_activity(
+            db, conversation_id, [(db_message.content, db_message.created_at)]
+        )
         await db.commit()
-        await db.refresh(db_message)
         return db_message
     except Exception as e:
         app_logger.error(f"添加消息失败: {str(e)}")
@@ -78,7 +193,7 @@ async def get_context_messages(
         select(Message, File)
         .outerjoin(File, File.file_id == Message.file_id)
         .where(Message.conversation_id == conversation_id)
-        .order_by(desc(Message.created_at))
+        .order_by(desc(Message.created_at), desc(Message.id))
     )
     
     if limit:
@@ -87,24 +202,126 @@ async def get_context_messages(
     result = await db.execute(query)
     rows = result.all()
     
-    messages = []
-    for row in rows:
-        message = row[0]
-        file = row[1]
-        
-        file_info = None
-        if file:
-            file_info = {
-                "file_id": file.file_id,
-                "original_name": file.original_name,
-                "file_type": file.file_type,
-                "file_path": file.file_path
-            }
-        
-        messages.append(MessageResponse.from_db_model(message, file_info))
+    messages = [_to_message_response(message, file) for message, file in rows]
     
     return list(reversed(messages))
 
+class HistoryPage:
+    """一页历史消息（从新到旧），沿 (conversation_id, created_at, id) 索引做键集分页
+
+    遍历时边从数据库读取边输出，内存中不保留整页消息；遍历结束后 next_cursor
+    指向本页最早的一条消息，没有更早的消息时为None。
+    """
+
+    def __init__(self, conversation_id: int, limit: int, before: Optional[str] = None):
+        self.conversation_id = conversation_id
+        self.limit = limit
+        self.before = decode_cursor(before) if before else None
+        self.next_cursor: Optional[str] = None
+
+    def _query(self):
+        query = (
+            select(Message, File)
+            .outerjoin(File, File.file_id == Message.file_id)
+            .where(Message.conversation_id == self.conversation_id)
+            .order_by(desc(Message.created_at), desc(Message.id))
+            .limit(self.limit + 1)
+        )
+        if self.before:
+            created_at, message_id = self.before
+            query = query.where(or_(
+                Message.created_at < created_at,
+                and_(Message.created_at == created_at, Message.id < message_id)
+            ))
+        return query
+
+    async def iterate(self, db: AsyncSession) -> AsyncIterator[MessageResponse]:
+        """按从新到旧的顺序输出本页消息"""
+        result = await db.stream(self._query().execution_options(yield_per=HISTORY_STREAM_BATCH))
+        last = None
+        count = 0
+        try:
+            async for message, file in result:
+                if count == self.limit:
+                    # 多取的一条说明还有更早的消息
+                    self.next_cursor = encode_cursor(last.created_at, last.id)
+                    break
+                yield _to_message_response(message, file)
+                last = message
+                count += 1
+        finally:
+            await result.close()
+
+def _to_message_response(message: Message, file: Optional[File]) -> MessageResponse:
+    """将消息及其关联文件转换为响应模型"""
+    file_info = None
+    if file:
+        file_info = {
+            "file_id": file.file_id,
+            "original_name": file.original_name,
+            "file_type": file.file_type,
+            "file_path": file.file_path
+        }
+    return MessageResponse.from_db_model(message, file_info)
+
+async def get_context_window(
+    db: AsyncSession,
+    conversation_id: int,
+    max_tokens: Optional[int] = None,
+    max_turns: Optional[int] = None,
+    reserve_tokens: int = 0,
+    exclude_message_id: Optional[int] = None,
+    after_message_id: Optional[int] = None,
+    truncate_overflow: bool = True
+) -> List[MessageResponse]:
+    """按token预算组装上下文消息
+    
+    从最新的消息开始装入，直到用完预算（max_tokens - reserve_tokens）。
+    放不下的消息在剩余预算足够时截断保留开头部分，否则连同更早的消息一起丢弃。
+    after_message_id 用于跳过已被会话摘要覆盖的消息。
+    """
+    max_tokens = max_tokens or settings.MAX_TOKEN_LENGTH
+    max_turns = max_turns or settings.MAX_CONTEXT_TURNS
+    budget = max_tokens - reserve_tokens
+    if budget <= 0:
+        return []
+
+    query = (
+        select(Message, File)
+        .outerjoin(File, File.file_id == Message.file_id)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(desc(Message.created_at), desc(Message.id))
+        .limit(max_turns)
+    )
+    if exclude_message_id is not None:
+        query = query.where(Message.id != exclude_message_id)
+    if after_message_id is not None:
+        query = query.where(Message.id > after_message_id)
+
+    result = await db.execute(query)
+
+    window = []
+    used_tokens = 0
+    for message, file in result.all():
+        message_tokens = message.token_count
+        if message_tokens is None:
+            message_tokens = count_tokens(message.content)
+        message_tokens += MESSAGE_TOKEN_OVERHEAD
+
+        response = _to_message_response(message, file)
+        if used_tokens + message_tokens <= budget:
+            window.append(response)
+            used_tokens += message_tokens
+            continue
+
+        remaining = budget - used_tokens - MESSAGE_TOKEN_OVERHEAD - count_tokens(TRUNCATED_MARKER)
+        if truncate_overflow and remaining >= settings.CONTEXT_TRUNCATE_MIN_TOKENS:
+            truncated = truncate_to_tokens(message.content, remaining) + TRUNCATED_MARKER
+            window.append(response.model_copy(update={"content": truncated}))
+        break
+
+    return list(reversed(window))
+
 async def clear_context(
     db: AsyncSession,
     session_id: str
@@ -146,9 +363,18 @@ async def delete_conversation(
         if not conversation:
             return False
         
-        # 由于设置了 CASCADE，删除会话时会自动删除相关消息
+        # 消息不随会话加载，直接解除消息与会话的关联后删除会话（与原先ORM删除时的处理一致）
+        await db.execute(
+            update(Message)
+            .where(Message.conversation_id == conversation.id)
+            .values(conversation_id=None)
+        )
         await db.delete(conversation)
         await db.commit()
+        try:
+            await conversation_id_cache.delete(session_id)
+        except Exception as e:
+            app_logger.warning(f"删除会话ID缓存失败: {str(e)}")
         
         return True
     except Exception as e:
@@ -162,13 +388,12 @@ async def update_conversation_name(
 ) -> Optional[Conversation]:
     """更新会话名称"""
     try:
-        conversation = await get_conversation(db, session_id)
+        conversation = await get_conversation(db, session_id, load_messages=True)
         if not conversation:
             return None
             
         conversation.name = name
         await db.commit()
-        await db.refresh(conversation)
         return conversation
     except Exception as e:
         app_logger.error(f"更新会话名称失败: {str(e)}")
@@ -1,27 +1,63 @@
-from typing import Dict, Any, Optional, List
+from typing import AsyncGenerator, AsyncIterator, Dict, Any, Optional, List, Set, Tuple, Union
 import asyncio
+import hashlib
+import json
+import uuid
+import aiofiles
+from datetime import datetime
 from pathlib import Path
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
-import ebooklib
-from ebooklib import epub
-import markdown
-from bs4 import BeautifulSoup
+from app.core.config import settings
 from app.core.logging import app_logger
+from app.db.database import AsyncSessionLocal
 from app.services.ai_client import ai_client
+from app.services.map_reduce_service import map_reduce_service
+from app.services.stream_broker import stream_broker
+from app.services.write_behind import write_behind
+from app.services.file_service import file_service
+from app.services.extraction_cache import extraction_cache, hash_bytes, hash_file
+from app.services.extraction_pool import extraction_pool
+from app.services.pdf_stream import PdfPageStream
+from app.services import extractors
+from app.utils.text_splitter import TextSplitter
+from app.utils.tokens import truncate_to_tokens
 from app.db.models import File, AnalysisRecord
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 import aiohttp
-import io
-from docx import Document
+
+DEFAULT_DOCUMENT_QUERY = "请对这篇文档进行总结，包括主要内容、关键点和结论。"
+DEFAULT_DOCUMENT_SYSTEM_PROMPT = """你是一个专业的文档分析助手。请仔细分析文档内容，提供准确、清晰的分析结果。
+                分析应该包括：
+                1. 文档主题和类型
+                2. 主要内容概述
+                3. 关键点分析
+                4. 结论或建议
+                请用清晰的结构化格式呈现分析结果。"""
 
 class DocumentService:
     """文档处理服务"""
+
+    # 本地文件扩展名对应的提取方法
+    LOCAL_EXTRACTORS = {
+        '.txt': '_extract_plain_text',
+        '.pdf': '_extract_pdf_text',
+        '.docx': '_extract_docx_text',
+        '.epub': '_extract_epub_text',
+        '.md': '_extract_markdown_text',
+    }
+
+    def __init__(self):
+        self._analysis_tasks: Set[asyncio.Task] = set()
     
-    async def extract_text(self, file_path: str) -> str:
-        """从文件中提取文本"""
+    async def extract_text(
+        self,
+        file_path: str,
+        content_hash: Optional[str] = None,
+        suffix: Optional[str] = None
+    ) -> str:
+        """从文件中提取文本，提取结果按文件内容的SHA-256缓存；suffix为原始文件的扩展名，默认取路径的扩展名"""
         try:
+            file_path = str(file_path)
             # 处理远程URL
             if file_path.startswith(('http://', 'https://')):
                 async with aiohttp.ClientSession() as session:
@@ -32,102 +68,82 @@ class DocumentService:
                         # 读取文件内容
                         file_content = await response.read()
                         
-                        # 根据文件类型处理
-                        if file_path.endswith('.docx'):
-                            # 将二进制内容转换为文档对象
-                            doc = Document(io.BytesIO(file_content))
-                            # 提取所有段落的文本
-                            text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-                            return text
-                        elif file_path.endswith('.pdf'):
-                            return await self._extract_pdf_text_from_bytes(file_content)
-                        elif file_path.endswith('.txt'):
-                            return file_content.decode('utf-8')
-                        else:
-                            return f"不支持的远程文件类型: {file_path}"
+                if not file_path.endswith(('.docx', '.pdf', '.txt')):
+                    return f"不支持的远程文件类型: {file_path}"
+                return await extraction_cache.get_or_extract(
+                    hash_bytes(file_content),
+                    f"document{Path(file_path).suffix.lower()}",
+                    lambda: self._extract_remote_content(file_path, file_content)
+                )
 
             # 本地文件处理逻辑
             path = Path(file_path)
-            suffix = path.suffix.lower()
-            
-            if suffix in ['.txt']:
-                async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                    return await f.read()
-            elif suffix in ['.pdf']:
-                return await self._extract_pdf_text(file_path)
-            elif suffix in ['.doc', '.docx']:
-                return await self._extract_doc_text(file_path)
-            else:
+            suffix = (suffix or path.suffix).lower()
+            if suffix not in self.LOCAL_EXTRACTORS:
                 return f"不支持的文件类型: {suffix}"
 
+            return await extraction_cache.get_or_extract(
+                content_hash or await hash_file(path),
+                f"document{suffix}",
+                lambda: getattr(self, self.LOCAL_EXTRACTORS[suffix])(path)
+            )
+
         except Exception as e:
             app_logger.error(f"文本提取失败: {str(e)}")
             return f"文本提取失败: {str(e)}"
 
+    async def _extract_remote_content(self, file_path: str, file_content: bytes) -> str:
+        """根据URL后缀从下载的内容中提取文本"""
+        if file_path.endswith('.docx'):
+            return await extraction_pool.run(extractors.extract_docx, file_content)
+        elif file_path.endswith('.pdf'):
+            return await self._extract_pdf_text_from_bytes(file_content)
+        return file_content.decode('utf-8')
+
+    async def _extract_plain_text(self, file_path: Path) -> str:
+        """提取纯文本"""
+        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+            return await f.read()
+
     async def _extract_pdf_text(self, file_path: Path) -> str:
         """提取PDF文本"""
         try:
-            # 使用线程池执行同步操作
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._pdf_extract_worker, file_path)
+            # 在提取进程池中逐批解析页面，避免阻塞事件循环
+            return await PdfPageStream(file_path).read()
         except Exception as e:
             raise ValueError(f"PDF文本提取失败: {str(e)}")
 
-    def _pdf_extract_worker(self, file_path: Path) -> str:
-        """PDF文本提取工作函数"""
-        text = []
-        with open(file_path, 'rb') as file:
-            pdf = PdfReader(file)
-            for page in pdf.pages:
-                text.append(page.extract_text())
-        return '\n'.join(text)
-
     async def _extract_docx_text(self, file_path: Path) -> str:
         """提取DOCX文本"""
         try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._docx_extract_worker, file_path)
+            return await extraction_pool.run(extractors.extract_docx_file, str(file_path))
         except Exception as e:
             raise ValueError(f"DOCX文本提取失败: {str(e)}")
 
-    def _docx_extract_worker(self, file_path: Path) -> str:
-        """DOCX文本提取工作函数"""
-        doc = DocxDocument(file_path)
-        return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-
     async def _extract_epub_text(self, file_path: Path) -> str:
         """提取EPUB文本"""
         try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._epub_extract_worker, file_path)
+            return await extraction_pool.run(extractors.extract_epub_file, str(file_path))
         except Exception as e:
             raise ValueError(f"EPUB文本提取失败: {str(e)}")
 
-    def _epub_extract_worker(self, file_path: Path) -> str:
-        """EPUB文本提取工作函数"""
-        book = epub.read_epub(str(file_path))
-        text = []
-        for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
-            text.append(soup.get_text())
-        return '\n'.join(text)
-
     async def _extract_markdown_text(self, file_path: Path) -> str:
         """提取Markdown文本"""
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            html = markdown.markdown(content)
-            soup = BeautifulSoup(html, 'html.parser')
-            return soup.get_text()
+        try:
+            return await extraction_pool.run(extractors.extract_markdown_file, str(file_path))
+        except Exception as e:
+            raise ValueError(f"Markdown文本提取失败: {str(e)}")
 
     async def analyze_document(
         self,
         db: AsyncSession,
         file_id: str,
         query: Optional[str] = None,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None
     ) -> Dict[str, Any]:
-        """分析文档内容"""
+        """分析文档内容，可限制最多提取的PDF页数和token数"""
         try:
             # 获取文件记录
             file_query = select(File).where(File.file_id == file_id)
@@ -139,38 +155,36 @@ class DocumentService:
                 
             # 获取文件路径
             file_path = Path(settings.UPLOAD_DIR) / file_record.file_path
-            
-            # 提取文本
-            text = await self.extract_text(file_path)
+            content_hash = file_record.content_hash or await hash_file(file_path)
             
             # 构建分析提示
-            if not query:
-                query = "请对这篇文档进行总结，包括主要内容、关键点和结论。"
-                
-            if not system_prompt:
-                system_prompt = """你是一个专业的文档分析助手。请仔细分析文档内容，提供准确、清晰的分析结果。
-                分析应该包括：
-                1. 文档主题和类型
-                2. 主要内容概述
-                3. 关键点分析
-                4. 结论或建议
-                请用清晰的结构化格式呈现分析结果。"""
-            
-            # 调用AI进行分析
-            analysis_result = await ai_client.analyze_document(
-                text=text,
-                query=query,
-                system_prompt=system_prompt
-            )
+            query = query or DEFAULT_DOCUMENT_QUERY
+            system_prompt = system_prompt or DEFAULT_DOCUMENT_SYSTEM_PROMPT
+            max_pages, max_tokens = self._extraction_limits(max_pages, max_tokens)
             
-            # 保存分析记录
-            analysis_record = AnalysisRecord(
-                file_id=file_id,
-                analysis_type="document",
-                result=analysis_result
-            )
-            db.add(analysis_record)
-            await db.commit()
+            # 相同内容和相同分析要求已有结果时直接复用（例如重复上传的文件）
+            request_hash = self._analysis_request_hash(content_hash, query, system_prompt, max_pages, max_tokens)
+            analysis_result = await self._find_analysis(db, request_hash)
+            if analysis_result is None:
+                # 提取文本并分段（PDF边提取边分析）
+                segments, job_key = await self._document_segments(
+                    file_path, content_hash, max_pages, max_tokens, file_service.document_suffix(file_record)
+                )
+                
+                # 调用AI进行分析
+                analysis_result = await map_reduce_service.run(
+                    segments, query, system_prompt, job_key=job_key
+                )
+                
+                # 保存分析记录（后台批量写入），复用已有结果时不再重复保存
+                write_behind.add(
+                    AnalysisRecord,
+                    file_id=file_id,
+                    analysis_type="document",
+                    result=analysis_result,
+                    request_hash=request_hash,
+                    created_at=datetime.utcnow()
+                )
             
             return {
                 "file_id": file_id,
@@ -182,6 +196,221 @@ class DocumentService:
             app_logger.error(f"文档分析失败: {str(e)}")
             raise
 
+    def _extraction_limits(
+        self,
+        max_pages: Optional[int],
+        max_tokens: Optional[int]
+    ) -> Tuple[int, int]:
+        """未指定时使用配置中的提取上限"""
+        return (
+            settings.DOC_MAX_PAGES if max_pages is None else max_pages,
+            settings.DOC_MAX_EXTRACT_TOKENS if max_tokens is None else max_tokens
+        )
+
+    def _analysis_request_hash(
+        self,
+        content_hash: str,
+        query: str,
+        system_prompt: str,
+        max_pages: int,
+        max_tokens: int
+    ) -> str:
+        """文件内容和分析要求的摘要，相同摘要的分析结果可以直接复用"""
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (
+            content_hash, ai_client.model, query, system_prompt,
+            str(max_pages), str(max_tokens), str(settings.EXTRACTION_CACHE_VERSION)
+        ):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def _find_analysis(self, db: AsyncSession, request_hash: str) -> Optional[str]:
+        """查找相同内容和分析要求的已有分析结果"""
+        result = await db.execute(
+            select(AnalysisRecord.result)
+            .where(AnalysisRecord.request_hash == request_hash, AnalysisRecord.result.isnot(None))
+            .order_by(AnalysisRecord.id.desc())
+            .limit(1)
+        )
+        cached = result.scalar_one_or_none()
+        if cached is not None:
+            app_logger.info(f"复用已有的文档分析结果: request_hash={request_hash}")
+        return cached
+
+    async def _document_segments(
+        self,
+        file_path: Path,
+        content_hash: Optional[str],
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        suffix: Optional[str] = None
+    ) -> Tuple[Union[List[str], AsyncIterator[str]], Optional[str]]:
+        """获取文档分段和检查点标识：PDF未命中提取缓存时边提取边分段，其他情况提取全文后分段"""
+        max_pages, max_tokens = self._extraction_limits(max_pages, max_tokens)
+
+        suffix = (suffix or file_path.suffix).lower()
+        if suffix != '.pdf':
+            text = await self.extract_text(file_path, content_hash, suffix)
+            if max_tokens:
+                text = truncate_to_tokens(text, max_tokens)
+            return ai_client._split_text(text), None
+
+        content_hash = content_hash or await hash_file(file_path)
+        job_key = (
+            f"{content_hash}:p{max_pages}:t{max_tokens}:v{settings.EXTRACTION_CACHE_VERSION}:"
+            f"{settings.DOC_SEGMENT_MAX_TOKENS}:{settings.DOC_SEGMENT_OVERLAP_TOKENS}"
+        )
+        if settings.EXTRACTION_CACHE_ENABLED and not max_pages:
+            cached = await extraction_cache.get(content_hash, "document.pdf")
+            if cached is not None:
+                if max_tokens:
+                    cached = truncate_to_tokens(cached, max_tokens)
+                return ai_client._split_text(cached), job_key
+        return self._stream_pdf_segments(file_path, content_hash, max_pages, max_tokens), job_key
+
+    async def _stream_pdf_segments(
+        self,
+        file_path: Path,
+        content_hash: str,
+        max_pages: int,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """逐页提取PDF并分段，完整提取且没有页面OCR失败时把全文写入提取缓存"""
+        stream = PdfPageStream(file_path, max_pages, max_tokens)
+        pages: List[str] = []
+
+        async def _collect():
+            async for page in stream.pages():
+                if page:
+                    pages.append(page)
+                yield page
+
+        splitter = TextSplitter(settings.DOC_SEGMENT_MAX_TOKENS, settings.DOC_SEGMENT_OVERLAP_TOKENS)
+        async for segment in splitter.split_pages(_collect()):
+            yield segment
+
+        if not stream.truncated and not stream.ocr_failed_pages and settings.EXTRACTION_CACHE_ENABLED:
+            await extraction_cache.set(content_hash, "document.pdf", '\n'.join(pages))
+
+    def _analysis_stream_id(self, task_id: str) -> str:
+        """文档分析任务在流中转中的ID"""
+        return f"doc_analysis:{task_id}"
+
+    async def start_analysis_task(
+        self,
+        db: AsyncSession,
+        file_id: str,
+        query: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """启动后台文档分析任务，进度事件经由Redis中转，可通过任务ID以SSE方式获取"""
+        file_query = select(File).where(File.file_id == file_id)
+        file_record = (await db.execute(file_query)).scalar_one_or_none()
+        if not file_record:
+            raise ValueError(f"File not found: {file_id}")
+
+        task_id = str(uuid.uuid4())
+        # 分析在独立的任务中执行，事件经队列交给发布任务；流过期或被清理时分析仍会完成并保存记录
+        events: asyncio.Queue = asyncio.Queue()
+        analysis = asyncio.create_task(self._run_analysis(
+            events,
+            file_id,
+            Path(settings.UPLOAD_DIR) / file_record.file_path,
+            file_record.content_hash,
+            file_service.document_suffix(file_record),
+            query or DEFAULT_DOCUMENT_QUERY,
+            system_prompt or DEFAULT_DOCUMENT_SYSTEM_PROMPT,
+            max_pages,
+            max_tokens
+        ))
+        self._analysis_tasks.add(analysis)
+        analysis.add_done_callback(self._analysis_tasks.discard)
+        try:
+            await stream_broker.publish(self._analysis_stream_id(task_id), self._drain_events(events))
+        except BaseException:
+            analysis.cancel()
+            raise
+        app_logger.info(f"启动文档分析任务: task_id={task_id}, file_id={file_id}")
+        return task_id
+
+    async def _run_analysis(self, events: asyncio.Queue, *args) -> None:
+        """执行文档分析，把事件放入队列；异常作为事件传递，队列以None结束"""
+        try:
+            async for event in self._analysis_events(*args):
+                events.put_nowait(event)
+        except Exception as e:
+            app_logger.error(f"文档分析任务失败: {str(e)}")
+            events.put_nowait(e)
+        finally:
+            events.put_nowait(None)
+
+    async def _drain_events(self, events: asyncio.Queue) -> AsyncGenerator[str, None]:
+        """按顺序取出分析事件供发布任务写入流"""
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    async def _analysis_events(
+        self,
+        file_id: str,
+        file_path: Path,
+        content_hash: Optional[str],
+        suffix: str,
+        query: str,
+        system_prompt: str,
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """执行文档分析并产出JSON格式的进度事件，完成后保存分析记录（复用已有结果时不保存）
+
+        PDF在第一批页面解析完后即开始分析，提取期间map进度事件的 total 为 None。
+        """
+        content_hash = content_hash or await hash_file(file_path)
+        max_pages, max_tokens = self._extraction_limits(max_pages, max_tokens)
+        request_hash = self._analysis_request_hash(content_hash, query, system_prompt, max_pages, max_tokens)
+
+        async with AsyncSessionLocal() as db:
+            existing = await self._find_analysis(db, request_hash)
+        if existing is not None:
+            events = self._reused_analysis_events(existing)
+        else:
+            yield json.dumps({"type": "progress", "stage": "extract"}, ensure_ascii=False)
+            segments, job_key = await self._document_segments(
+                file_path, content_hash, max_pages, max_tokens, suffix
+            )
+            events = map_reduce_service.analyze(segments, query, system_prompt, job_key=job_key)
+
+        async for event in events:
+            if event["type"] == "result" and not event.get("reused"):
+                write_behind.add(
+                    AnalysisRecord,
+                    file_id=file_id,
+                    analysis_type="document",
+                    result=event["content"],
+                    request_hash=request_hash,
+                    created_at=datetime.utcnow()
+                )
+            yield json.dumps(event, ensure_ascii=False)
+
+    async def _reused_analysis_events(self, result: str) -> AsyncGenerator[Dict[str, Any], None]:
+        yield {"type": "result", "content": result, "reused": True}
+
+    async def is_analysis_task_active(self, task_id: str) -> bool:
+        """检查文档分析任务是否存在（跨worker）"""
+        return await stream_broker.exists(self._analysis_stream_id(task_id))
+
+    async def get_analysis_events(self, task_id: str) -> AsyncGenerator[str, None]:
+        """获取文档分析任务的进度事件"""
+        async for event in stream_broker.subscribe(self._analysis_stream_id(task_id)):
+            yield event
+
     async def analyze_multiple_documents(
         self,
         db: AsyncSession,
@@ -222,20 +451,10 @@ class DocumentService:
     async def _extract_pdf_text_from_bytes(self, file_content: bytes) -> str:
         """从二进制内容中提取PDF文本"""
         try:
-            # 使用线程池执行同步操作
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._pdf_extract_worker_from_bytes, file_content)
+            return await PdfPageStream(file_content).read()
         except Exception as e:
             raise ValueError(f"PDF文本提取失败: {str(e)}")
 
-    def _pdf_extract_worker_from_bytes(self, file_content: bytes) -> str:
-        """PDF文本提取工作函数(二进制版本)"""
-        text = []
-        pdf = PdfReader(io.BytesIO(file_content))
-        for page in pdf.pages:
-            text.append(page.extract_text())
-        return '\n'.join(text)
-
     async def extract_text_from_url(self, url: str) -> str:
         """从URL中提取文本内容"""
         try:
@@ -249,12 +468,7 @@ class DocumentService:
                     
                     # 根据URL后缀处理不同类型的文件
                     if url.lower().endswith('.docx'):
-                        doc = Document(io.BytesIO(file_content))
-                        paragraphs = []
-                        for paragraph in doc.paragraphs:
-                            if paragraph.text.strip():  # 只添加非空段落
-                                paragraphs.append(paragraph.text)
-                        return '\n'.join(paragraphs)
+                        return await extraction_pool.run(extractors.extract_docx, file_content)
                     else:
                         raise ValueError(f"不支持的文件类型: {url}")
                     
@@ -0,0 +1,106 @@
+from typing import Awaitable, Callable, Optional, Union
+from pathlib import Path
+import asyncio
+import hashlib
+import os
+import uuid
+import aiofiles
+from app.core.config import settings
+from app.core.logging import app_logger
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_bytes(content: bytes) -> str:
+    """计算文件内容的SHA-256"""
+    return hashlib.sha256(content).hexdigest()
+
+def _hash_file_worker(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def hash_file(file_path: Union[str, Path]) -> str:
+    """在线程池中计算本地文件的SHA-256"""
+    return await asyncio.to_thread(_hash_file_worker, Path(file_path))
+
+class PartialText(str):
+    """不完整的提取结果（如部分页面OCR失败），可以返回给调用方，但不写入缓存"""
+
+class ExtractionCache:
+    """文本提取结果的磁盘缓存
+
+    以文件内容的SHA-256和提取器名称为键，同一文件再次提问时直接读取提取结果，
+    跳过PDF/Word解析和OCR。提取失败或结果不完整（PartialText）时不写入缓存。
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def _path(self, content_hash: str, extractor: str) -> Path:
+        return (
+            settings.EXTRACTION_CACHE_DIR
+            / content_hash[:2]
+            / f"{content_hash}.{extractor}.v{settings.EXTRACTION_CACHE_VERSION}.txt"
+        )
+
+    async def get(self, content_hash: str, extractor: str) -> Optional[str]:
+        """读取缓存的提取结果"""
+        path = self._path(content_hash, extractor)
+        try:
+            async with aiofiles.open(path, 'r', encoding='utf-8') as f:
+                return await f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            app_logger.warning(f"读取提取缓存失败: {path}, error={str(e)}")
+            return None
+
+    async def set(self, content_hash: str, extractor: str, text: str):
+        """写入提取结果，先写临时文件再原子替换，避免并发读到半个文件"""
+        path = self._path(content_hash, extractor)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+                await f.write(text)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            app_logger.warning(f"写入提取缓存失败: {path}, error={str(e)}")
+            Path(tmp_path).unlink(missing_ok=True)
+
+    async def get_or_extract(
+        self,
+        content_hash: str,
+        extractor: str,
+        extract: Callable[[], Awaitable[str]]
+    ) -> str:
+        """命中缓存时直接返回，否则执行提取并缓存结果；同一文件的并发提取只执行一次"""
+        if not settings.EXTRACTION_CACHE_ENABLED:
+            return await extract()
+
+        cached = await self.get(content_hash, extractor)
+        if cached is not None:
+            app_logger.info(f"命中提取缓存: {content_hash[:12]} ({extractor})")
+            return cached
+
+        key = (content_hash, extractor)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                cached = await self.get(content_hash, extractor)
+                if cached is not None:
+                    return cached
+                text = await extract()
+                if isinstance(text, PartialText):
+                    app_logger.warning(f"提取结果不完整，不写入缓存: {content_hash[:12]} ({extractor})")
+                else:
+                    await self.set(content_hash, extractor, text)
+                return text
+        finally:
+            if not lock.locked() and self._locks.get(key) is lock:
+                del self._locks[key]
+
+# 创建全局提取缓存实例
+extraction_cache = ExtractionCache()
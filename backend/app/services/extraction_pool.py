@@ -0,0 +1,190 @@
+from typing import Any, Callable, List, Optional
+from multiprocessing.connection import Connection
+import asyncio
+import multiprocessing
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils.exceptions import APIError
+
+def _init_worker(memory_limit_mb: int):
+    """工作进程初始化：设置地址空间上限（仅类Unix系统支持）"""
+    if memory_limit_mb <= 0:
+        return
+    try:
+        import resource
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def _worker_main(conn: Connection, memory_limit_mb: int):
+    """工作进程主循环：逐个接收任务并返回结果，收到None时退出"""
+    _init_worker(memory_limit_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args = job
+        # 通知主进程任务开始执行，超时从此时计算（不包括进程启动和导入模块的时间）
+        conn.send(("started", None))
+        try:
+            conn.send(("ok", func(*args)))
+        except BaseException as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                # 异常对象无法序列化时只传递说明
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+class _WorkerCrashed(Exception):
+    """工作进程在执行任务期间退出"""
+
+class _Worker:
+    """一个提取工作进程及其通信管道"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, settings.EXTRACTION_MEMORY_LIMIT_MB),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def _receive(self, timeout: float, error: type):
+        if not self.conn.poll(timeout):
+            raise error()
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            raise _WorkerCrashed()
+
+    async def call(self, func: Callable[..., Any], args: tuple, timeout: float) -> Any:
+        """执行任务，超时从工作进程开始执行时计算"""
+        self.tasks += 1
+        try:
+            self.conn.send((func, args))
+        except (BrokenPipeError, OSError):
+            raise _WorkerCrashed()
+        # 进程启动或任务反序列化长时间没有完成时按进程异常处理
+        await asyncio.to_thread(self._receive, settings.EXTRACTION_QUEUE_TIMEOUT, _WorkerCrashed)
+        status, value = await asyncio.to_thread(self._receive, timeout, asyncio.TimeoutError)
+        if status == "error":
+            raise value
+        return value
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self):
+        """正常退出：通知进程结束，不等待"""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.conn.close()
+
+    def kill(self):
+        """强制终止进程；管道不在此关闭，仍在等待结果的线程会因连接断开而结束"""
+        self.process.kill()
+        self.process.join(timeout=1)
+
+class ExtractionPool:
+    """文本提取进程池
+
+    PDF、Word、Markdown等解析是CPU密集的同步操作，放到独立进程中执行，避免阻塞事件循环。
+    同时执行的任务数等于进程数，其余调用在进程外排队（有数量和等待时间上限），
+    超时只从进程开始执行任务时计算。任务超时或调用方取消时只终止执行该任务的进程并补充新进程，
+    其他进程中的任务不受影响；进程因超出内存上限等原因异常退出时补充新进程并重试一次。
+    """
+
+    def __init__(self):
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[_Worker] = []
+        self._waiting = 0
+        self._ctx = multiprocessing.get_context("spawn")
+
+    def _get_idle(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(settings.EXTRACTION_WORKERS):
+                self._idle.put_nowait(None)  # None表示尚未启动的进程，使用时再启动
+        return self._idle
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx)
+        self._workers.append(worker)
+        return worker
+
+    def _discard(self, worker: _Worker, kill: bool):
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+
+    async def _acquire_worker(self) -> Optional[_Worker]:
+        if self._waiting >= settings.EXTRACTION_MAX_QUEUE and self._get_idle().empty():
+            raise APIError("文本提取任务繁忙，请稍后重试")
+        self._waiting += 1
+        try:
+            return await asyncio.wait_for(self._get_idle().get(), settings.EXTRACTION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise APIError("文本提取任务繁忙，请稍后重试")
+        finally:
+            self._waiting -= 1
+
+    def _release_worker(self, worker: Optional[_Worker]):
+        if worker is not None and settings.EXTRACTION_MAX_TASKS_PER_CHILD \
+                and worker.tasks >= settings.EXTRACTION_MAX_TASKS_PER_CHILD:
+            # 处理一定数量的任务后重启进程，释放内存碎片
+            self._discard(worker, kill=False)
+            worker = None
+        self._get_idle().put_nowait(worker)
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """在提取进程中执行解析函数"""
+        timeout = timeout or settings.EXTRACTION_TIMEOUT
+        worker = await self._acquire_worker()
+        try:
+            for attempt in range(2):
+                if worker is None or not worker.alive:
+                    if worker is not None:
+                        self._discard(worker, kill=True)
+                    worker = self._spawn()
+                try:
+                    return await worker.call(func, args, timeout)
+                except asyncio.TimeoutError:
+                    app_logger.error(f"文本提取超时: {func.__name__}, timeout={timeout}s")
+                    self._discard(worker, kill=True)
+                    worker = None
+                    raise ValueError(f"文本提取超时（{timeout}秒）")
+                except _WorkerCrashed:
+                    app_logger.warning(f"文本提取进程异常退出: {func.__name__}, attempt={attempt + 1}")
+                    self._discard(worker, kill=True)
+                    worker = None
+                    if attempt:
+                        raise ValueError("文本提取进程异常退出，文件可能过大或已损坏")
+                except asyncio.CancelledError:
+                    # 调用方已取消，进程中的任务无法中断，终止该进程
+                    self._discard(worker, kill=True)
+                    worker = None
+                    raise
+        finally:
+            self._release_worker(worker)
+
+    def close(self):
+        """终止所有提取进程"""
+        for worker in list(self._workers):
+            self._discard(worker, kill=True)
+        self._idle = None
+
+# 创建全局提取进程池实例
+extraction_pool = ExtractionPool()
@@ -0,0 +1,376 @@
+# 文档解析函数：均为模块级同步函数，参数和返回值可序列化，供提取进程池在独立进程中执行。
+# 此模块不依赖应用配置和数据库，避免工作进程启动时加载整个应用。
+from typing import List, Tuple, Union
+from pathlib import Path
+import io
+import os
+import re
+import subprocess
+import tempfile
+import chardet
+import ebooklib
+import markdown
+from bs4 import BeautifulSoup
+from docx import Document
+from ebooklib import epub
+from PIL import Image, ImageOps
+from pypdf import PdfReader
+import pytesseract
+
+def _read_bytes(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+def extract_pdf_pages(source: Union[str, bytes], start: int, stop: int) -> Tuple[List[str], int]:
+    """提取PDF第start页到第stop-1页的文本，同时返回总页数"""
+    pdf = PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    total = len(pdf.pages)
+    pages = [pdf.pages[i].extract_text() or "" for i in range(start, min(stop, total))]
+    return pages, total
+
+def extract_docx(content: bytes) -> str:
+    """提取DOCX段落和表格文本"""
+    doc = Document(io.BytesIO(content))
+    paragraphs = [para.text for para in doc.paragraphs if para.text.strip()]
+
+    # 提取表格文本
+    for table in doc.tables:
+        for row in table.rows:
+            row_text = ' | '.join(cell.text.strip() for cell in row.cells if cell.text.strip())
+            if row_text:
+                paragraphs.append(row_text)
+
+    return '\n'.join(paragraphs)
+
+def extract_docx_file(file_path: str) -> str:
+    """提取本地DOCX文件文本"""
+    return extract_docx(_read_bytes(file_path))
+
+def extract_doc_file(file_path: str) -> str:
+    """使用antiword提取本地DOC文件文本（需要系统安装antiword）"""
+    result = subprocess.run(
+        ['antiword', file_path],
+        capture_output=True,
+        text=True,
+        encoding='utf-8'
+    )
+    if result.returncode != 0:
+        raise ValueError(f"DOC文件处理失败: {result.stderr}")
+    return result.stdout
+
+def extract_doc(content: bytes) -> str:
+    """使用antiword提取DOC文本，内容先写入临时文件"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.doc') as temp_file:
+        temp_file.write(content)
+        temp_path = temp_file.name
+
+    try:
+        return extract_doc_file(temp_path)
+    finally:
+        # 清理临时文件
+        Path(temp_path).unlink(missing_ok=True)
+
+def extract_epub_file(file_path: str) -> str:
+    """提取本地EPUB文件文本"""
+    book = epub.read_epub(file_path)
+    text = []
+    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+        soup = BeautifulSoup(item.get_content(), 'html.parser')
+        text.append(soup.get_text())
+    return '\n'.join(text)
+
+def extract_markdown_file(file_path: str) -> str:
+    """提取本地Markdown文件的纯文本"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        html = markdown.markdown(f.read())
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+def analyze_markdown_structure(content: str) -> str:
+    """分析Markdown文档结构"""
+    # 提取所有标题
+    headers = re.findall(r'^(#{1,6})\s+(.+)$', content, re.MULTILINE)
+
+    # 统计代码块
+    code_blocks = re.findall(r'```(\w*)', content)
+    code_languages = [lang for lang in code_blocks if lang]
+
+    # 统计链接和图片
+    links = re.findall(r'\[([^\]]+)\]\(([^\)]+)\)', content)
+    images = re.findall(r'!\[([^\]]*)\]\(([^\)]+)\)', content)
+
+    # 构建结构信息
+    structure = []
+    structure.append("## 文档大纲")
+    for level, title in headers:
+        indent = "  " * (len(level) - 1)
+        structure.append(f"{indent}- {title}")
+
+    if code_languages:
+        structure.append("\n## 代码块信息")
+        lang_count = {}
+        for lang in code_languages:
+            lang_count[lang] = lang_count.get(lang, 0) + 1
+        for lang, count in lang_count.items():
+            structure.append(f"- {lang}: {count} 个代码块")
+
+    if links:
+        structure.append("\n## 链接信息")
+        structure.append(f"- 总计: {len(links)} 个链接")
+
+    if images:
+        structure.append("\n## 图片信息")
+        structure.append(f"- 总计: {len(images)} 张图片")
+
+    return '\n'.join(structure)
+
+def extract_markdown(content: str) -> str:
+    """提取Markdown文本，保留标题、列表、表格和代码块，并附带文档结构信息"""
+    # 保存原始的代码块
+    code_blocks = {}
+
+    def save_code_block(match):
+        """保存代码块并返回占位符"""
+        block_id = f"CODE_BLOCK_{len(code_blocks)}"
+        code_blocks[block_id] = match.group(1)
+        return block_id
+
+    content_with_placeholders = re.sub(
+        r'```[\w]*\n(.*?)```',
+        save_code_block,
+        content,
+        flags=re.DOTALL
+    )
+
+    # 转换Markdown为HTML
+    html = markdown.markdown(
+        content_with_placeholders,
+        extensions=[
+            'markdown.extensions.tables',
+            'markdown.extensions.fenced_code',
+            'markdown.extensions.nl2br'
+        ]
+    )
+    soup = BeautifulSoup(html, 'html.parser')
+
+    text_parts: List[str] = []
+
+    # 处理标题
+    for heading in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+        level = int(heading.name[1])
+        text_parts.append(f"{'#' * level} {heading.get_text().strip()}\n")
+
+    # 处理段落
+    for p in soup.find_all('p'):
+        text_parts.append(p.get_text().strip() + '\n')
+
+    # 处理列表
+    for ul in soup.find_all(['ul', 'ol']):
+        for li in ul.find_all('li'):
+            text_parts.append(f"- {li.get_text().strip()}\n")
+
+    # 处理表格
+    for table in soup.find_all('table'):
+        for row in table.find_all('tr'):
+            cells = [cell.get_text().strip() for cell in row.find_all(['th', 'td'])]
+            text_parts.append(' | '.join(cells) + '\n')
+
+    extracted_text = '\n'.join(text_parts)
+
+    # 还原代码块
+    for block_id, code in code_blocks.items():
+        extracted_text = extracted_text.replace(block_id, f"\n```\n{code}\n```\n")
+
+    # 清理多余的空行
+    cleaned_text = re.sub(r'\n{3,}', '\n\n', extracted_text)
+
+    return (
+        "# 文档结构信息\n"
+        f"{analyze_markdown_structure(content)}\n\n"
+        "# 文档内容\n"
+        f"{cleaned_text}"
+    )
+
+def extract_markdown_document_file(file_path: str) -> str:
+    """提取本地Markdown文件，保留结构并附带文档结构信息"""
+    return extract_markdown(_read_bytes(file_path).decode('utf-8'))
+
+def extract_txt_file(file_path: str) -> str:
+    """提取本地TXT文件文本"""
+    return extract_txt(_read_bytes(file_path))
+
+def extract_txt(content: bytes) -> str:
+    """检测编码并规范化TXT文本，开头附带文件信息"""
+    detection = chardet.detect(content)
+
+    # 尝试不同的编码方式
+    encodings_to_try = [
+        detection['encoding'],  # 检测到的编码
+        'utf-8',
+        'gb18030',  # 支持中文
+        'gbk',
+        'gb2312',
+        'ascii',
+        'iso-8859-1'
+    ]
+
+    text = None
+    used_encoding = None
+    for enc in encodings_to_try:
+        if not enc:
+            continue
+        try:
+            text = content.decode(enc)
+            used_encoding = enc
+            break
+        except (UnicodeDecodeError, LookupError):
+            continue
+
+    if text is None:
+        raise ValueError("无法使用任何编码解析文件内容")
+
+    # 规范化换行符，删除连续的空行和行尾空白字符
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+
+    line_count = text.count('\n') + 1
+    info_parts = [
+        "# 文件信息",
+        f"- 文件大小: {len(content)} bytes",
+        f"- 使用编码: {used_encoding}",
+        f"- 行数: {line_count}",
+        f"- 字符数: {len(text)}",
+        "",
+        "# 文件内容",
+        ""
+    ]
+    return '\n'.join(info_parts) + text
+
+def extract_pdf_page_images(file_path: str, page_index: int) -> List[bytes]:
+    """提取PDF页面中嵌入的图片（原始编码），用于纯图片页面的OCR"""
+    page = PdfReader(file_path).pages[page_index]
+    return [image.data for image in page.images]
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """按EXIF方向摆正并转为灰度，透明背景填充为白色"""
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert('L')
+
+def _row_profile(gray: Image.Image) -> List[float]:
+    """每一行的平均灰度（缩放到宽度为1）"""
+    return list(gray.resize((1, gray.height), Image.Resampling.BOX).getdata())
+
+def _estimate_skew(gray: Image.Image, max_angle: float) -> float:
+    """用投影轮廓估计倾斜角度：文字行水平时各行平均灰度的方差最大"""
+    small = gray.copy()
+    small.thumbnail((800, 800))
+    ink = small.point(lambda v: 255 if v < 128 else 0)
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle * 2)
+    for step in range(-steps, steps + 1):
+        angle = step / 2
+        profile = _row_profile(ink.rotate(angle, Image.Resampling.BILINEAR, fillcolor=0))
+        mean = sum(profile) / len(profile)
+        score = sum((v - mean) ** 2 for v in profile)
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+def _tile_bounds(gray: Image.Image, tile_height: int) -> List[Tuple[int, int]]:
+    """按高度切片，切分位置选在目标高度附近最亮（空白）的行，避免切断文字行"""
+    height = gray.height
+    if tile_height <= 0 or height <= tile_height * 5 // 4:
+        return [(0, height)]
+    profile = _row_profile(gray)
+    cuts = [0]
+    while height - cuts[-1] > tile_height * 5 // 4:
+        target = cuts[-1] + tile_height
+        window = range(target - tile_height // 4, min(target + tile_height // 4, height - 1))
+        cuts.append(max(window, key=lambda y: profile[y]))
+    cuts.append(height)
+    return list(zip(cuts, cuts[1:]))
+
+def prepare_ocr_image(
+    source: Union[str, bytes],
+    target_dpi: int,
+    max_side: int,
+    tile_height: int,
+    max_skew: float
+) -> List[bytes]:
+    """OCR预处理：灰度、对比度拉伸、缩放到目标DPI、纠正倾斜并切片，返回PNG编码的切片"""
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as img:
+        dpi = (img.info.get('dpi') or (0, 0))[0]
+        gray = _flatten(img)
+
+    # 高于目标DPI的扫描件缩小到目标DPI；无DPI信息时限制长边
+    scale = 1.0
+    if dpi and dpi > target_dpi:
+        scale = target_dpi / dpi
+    if max(gray.size) * scale > max_side:
+        scale = max_side / max(gray.size)
+    if scale < 1:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.Resampling.LANCZOS)
+    gray = ImageOps.autocontrast(gray)
+
+    if max_skew > 0:
+        angle = _estimate_skew(gray, max_skew)
+        if angle:
+            gray = gray.rotate(angle, Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+
+    tiles = []
+    for top, bottom in _tile_bounds(gray, tile_height):
+        buffer = io.BytesIO()
+        gray.crop((0, top, gray.width, bottom)).save(buffer, format='PNG')
+        tiles.append(buffer.getvalue())
+    return tiles
+
+def ocr_image_tile(tile: bytes, lang: str) -> str:
+    """对单个切片执行Tesseract识别"""
+    # 进程池已按切片并行，限制Tesseract内部线程数，避免CPU过度争用
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    with Image.open(io.BytesIO(tile)) as img:
+        try:
+            return pytesseract.image_to_string(img, lang=lang).strip()
+        except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+            # pytesseract的异常无法在主进程中反序列化，会被当作进程池崩溃，这里转换为ValueError
+            raise ValueError(str(e))
+
+def render_image_renditions(
+    file_path: str,
+    outputs: List[Tuple[str, int, int]],
+    image_format: str,
+    quality: int
+) -> None:
+    """生成视觉模型使用的缩放版本和缩略图
+
+    outputs按尺寸从大到小排列，每项为(输出路径, 最大宽度, 最大高度)；
+    原图只解码一次，较小的版本由上一个版本继续缩小。先写临时文件再替换，
+    并发生成同一内容时不会读到写了一半的文件。
+    """
+    with Image.open(file_path) as img:
+        # JPEG可以在解码时按2的幂次缩小，超大图片不必完整解码
+        max_width, max_height = outputs[0][1], outputs[0][2]
+        img.draft('RGB', (max_width, max_height))
+        img = ImageOps.exif_transpose(img)
+        keep_alpha = image_format == 'WEBP' and img.mode in ('RGBA', 'LA', 'P')
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            if not keep_alpha:
+                background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+                img = Image.alpha_composite(background, img)
+        img = img.convert('RGBA' if keep_alpha else 'RGB')
+
+    for output_path, max_width, max_height in outputs:
+        img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            img.save(temp_path, format=image_format, quality=quality, optimize=True)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
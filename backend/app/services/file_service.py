@@ -1,80 +1,173 @@
-from datetime import datetime
 from pathlib import Path
-import aiofiles
 import magic
 import uuid
 from fastapi import UploadFile, HTTPException
 from app.core.config import settings
 from app.core.logging import app_logger
 from app.db.models import File
+from app.services.blob_store import blob_store, StagedBlob
+from app.services.rendition_service import rendition_service
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_
-from typing import List, Optional
+from typing import Collection, List, Optional
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 class FileService:
+    def _allowed_types(self, file_type: str) -> Optional[Collection[str]]:
+        """文件类型对应的允许的MIME类型，通用文件不限制"""
+        if file_type == "document":
+            return settings.ALLOWED_DOCUMENT_TYPES
+        if file_type == "file":
+            return None
+        return settings.ALLOWED_IMAGE_TYPES
+
+    def check_content_type(self, head: bytes, file_type: str) -> str:
+        """根据文件开头的内容检测MIME类型，不在允许范围内时拒绝"""
+        content_type = magic.from_buffer(head, mime=True)
+        allowed_types = self._allowed_types(file_type)
+        if allowed_types is not None and content_type not in allowed_types:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的文件类型: {content_type}"
+            )
+        return content_type
+
     async def save_file(
         self,
         file: UploadFile,
         file_type: str,
         db: AsyncSession,
-        session_id: str
+        session_id: Optional[str],
+        max_size: Optional[int] = None
     ) -> File:
-        """保存上传的文件并创建数据库记录"""
+        """保存上传的文件并创建数据库记录
+
+        文件按内容寻址存储：边写入边计算SHA-256，相同内容只保存一份，
+        新的文件记录引用已有内容，提取缓存和分析结果也随内容哈希复用。
+        写入过程中累计大小，超过上限立即中止。
+        """
+        max_size = max_size or settings.MAX_UPLOAD_SIZE
+        staged = None
         try:
-            # 验证文件类型
-            content_type = magic.from_buffer(await file.read(1024), mime=True)
-            await file.seek(0)
-            
-            allowed_types = (settings.ALLOWED_DOCUMENT_TYPES 
-                           if file_type == "document" 
-                           else settings.ALLOWED_IMAGE_TYPES)
-            
-            if content_type not in allowed_types:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"不支持的文件类型: {content_type}"
-                )
-            
-            # 生成存储路径
-            today = datetime.now()
-            relative_path = Path(file_type + "s") / str(today.year) / f"{today.month:02d}" / f"{today.day:02d}"
-            full_path = settings.UPLOAD_DIR / relative_path
-            full_path.mkdir(parents=True, exist_ok=True)
-            
-            # 生成唯一文件名
-            file_id = str(uuid.uuid4())
-            safe_filename = f"{file_id}_{file.filename}"
-            file_path = full_path / safe_filename
-            
-            # 保存文件
-            async with aiofiles.open(file_path, 'wb') as f:
-                while chunk := await file.read(8192):
-                    await f.write(chunk)
+            # 读取第一个分块检测文件类型，不符合时不写入磁盘
+            head = await file.read(UPLOAD_CHUNK_SIZE)
+            content_type = self.check_content_type(head, file_type)
+
+            async def _chunks():
+                size = 0
+                chunk = head
+                while chunk:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"文件大小超过限制: {max_size} bytes"
+                        )
+                    yield chunk
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+
+            # 分块写入临时文件，同时计算内容哈希，内存中只保留一个分块
+            staged = await blob_store.stage(_chunks(), Path(file.filename or "").suffix)
+        except HTTPException:
+            raise
+        except Exception as e:
+            app_logger.error(f"文件保存失败: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"文件保存失败: {str(e)}"
+            )
+
+        return await self.save_staged(db, staged, file.filename, file_type, content_type, session_id)
+
+    async def save_staged(
+        self,
+        db: AsyncSession,
+        staged: StagedBlob,
+        original_name: Optional[str],
+        file_type: str,
+        content_type: str,
+        session_id: Optional[str]
+    ) -> File:
+        """把已写入临时文件的内容存入内容寻址存储并创建文件记录"""
+        blob = None
+        try:
+            blob = await blob_store.acquire(db, staged, content_type)
             
             # 创建数据库记录
             db_file = File(
-                file_id=file_id,
-                original_name=file.filename,
-                file_path=str(relative_path / safe_filename),
+                file_id=str(uuid.uuid4()),
+                original_name=original_name,
+                file_path=blob.storage_path,
                 file_type=file_type,
                 mime_type=content_type,
-                file_size=file_path.stat().st_size,
+                file_size=blob.file_size,
+                content_hash=blob.content_hash,
+                blob_id=blob.id,
                 user_session_id=session_id
             )
             
             db.add(db_file)
             await db.commit()
             await db.refresh(db_file)
+
+            # 图片上传时预生成视觉模型版本和缩略图
+            if content_type.startswith("image/"):
+                await rendition_service.ensure_quietly(db_file)
             
             return db_file
             
         except Exception as e:
             app_logger.error(f"文件保存失败: {str(e)}")
+            if blob is not None:
+                await db.rollback()
+                await blob_store.release(db, blob.id)
+            else:
+                blob_store.discard(staged)
             raise HTTPException(
                 status_code=500,
                 detail=f"文件保存失败: {str(e)}"
             )
 
+    def document_suffix(self, file_record: File) -> str:
+        """文件的原始扩展名，用于选择文本提取方式
+
+        内容相同的文件共用一个存储文件，存储路径沿用首次上传时的扩展名，不能据此判断本次上传的类型。
+        """
+        return Path(file_record.original_name or "").suffix.lower() or Path(file_record.file_path).suffix.lower()
+
+    async def delete_file(self, db: AsyncSession, file_id: str) -> bool:
+        """删除文件记录并释放其引用的存储内容，最后一个引用删除时同时删除磁盘文件"""
+        result = await db.execute(select(File).where(File.file_id == file_id))
+        file_record = result.scalar_one_or_none()
+        if not file_record:
+            return False
+
+        try:
+            blob_id = file_record.blob_id
+            await db.delete(file_record)
+            await db.flush()
+            if blob_id is not None:
+                # 文件记录的删除和引用数的减少在同一事务中提交
+                await blob_store.release(db, blob_id)
+            else:
+                await db.commit()
+            return True
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail=f"文件仍被消息、笔记或分析记录引用: {file_id}"
+            )
+        except Exception as e:
+            await db.rollback()
+            app_logger.error(f"文件删除失败: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"文件删除失败: {str(e)}"
+            )
+
     async def get_file_path(self, file_id: str, db: AsyncSession) -> Path:
         """获取文件的完整路径"""
         query = select(File).where(File.file_id == file_id)
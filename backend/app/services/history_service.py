@@ -18,7 +18,7 @@ class HistoryService:
         time_spent: int = 0,
         comments: str = None
     ) -> RevisionHistory:
-        """记录一次复习历史"""
+        """记录一次复习历史，历史记录与笔记状态在同一事务中提交"""
         try:
             app_logger.info(f"开始记录复习历史 - 任务ID: {task_id}")
             
@@ -1,82 +1,28 @@
-from typing import Dict, Any, Optional, List, Tuple
-import asyncio
+from typing import Dict, Any, Optional
 from pathlib import Path
-from PIL import Image
-import pytesseract
+from datetime import datetime
 from app.core.logging import app_logger
 from app.services.ai_client import ai_client
+from app.services.ocr_service import ocr_service
+from app.services.rendition_service import rendition_service
+from app.services.write_behind import write_behind
 from app.db.models import File, AnalysisRecord
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-import base64
-import io
 from app.core.config import settings
 import aiohttp
 
 class ImageService:
     """图片处理服务"""
     
-    async def process_image(self, file_path: Path) -> Tuple[str, Dict[str, Any]]:
-        """处理图片并返回base64编码和元数据"""
+    async def extract_text(self, file_path: Path, content_hash: Optional[str] = None) -> str:
+        """从图片中提取文字（预处理、切片后并行OCR），结果按图片内容的SHA-256缓存"""
         try:
-            # 在线程池中执行同步图片处理
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._process_image_worker, file_path)
-        except Exception as e:
-            app_logger.error(f"图片处理失败: {str(e)}")
-            raise
-
-    def _process_image_worker(self, file_path: Path) -> Tuple[str, Dict[str, Any]]:
-        """图片处理工作函数"""
-        with Image.open(file_path) as img:
-            # 获图片元数据
-            metadata = {
-                "format": img.format,
-                "mode": img.mode,
-                "size": img.size,
-                "width": img.width,
-                "height": img.height,
-            }
-            
-            # 转换为RGB模式（如果需要）
-            if img.mode not in ('RGB', 'L'):
-                img = img.convert('RGB')
-            
-            # 调整图片大小（如果太大）
-            max_size = (1920, 1080)
-            if img.width > max_size[0] or img.height > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # 转换为base64
-            buffered = io.BytesIO()
-            img.save(buffered, format=img.format or 'JPEG')
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            
-            return img_base64, metadata
-
-    async def extract_text(self, file_path: Path) -> str:
-        """从图片中提取文字"""
-        try:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, self._extract_text_worker, file_path)
+            return await ocr_service.extract_text(file_path, content_hash)
         except Exception as e:
             app_logger.error(f"文字提取失败: {str(e)}")
             raise
 
-    def _extract_text_worker(self, file_path: Path) -> str:
-        """OCR文字提取工作函数"""
-        try:
-            with Image.open(file_path) as img:
-                # 转换为RGB模式（如果需要）
-                if img.mode not in ('RGB', 'L'):
-                    img = img.convert('RGB')
-                
-                # 使用pytesseract进行OCR
-                text = pytesseract.image_to_string(img, lang='chi_sim+eng')
-                return text.strip()
-        except Exception as e:
-            raise ValueError(f"OCR处理失败: {str(e)}")
-
     async def analyze_image(
         self,
         db: AsyncSession,
@@ -98,13 +44,14 @@ class ImageService:
             # 获取文件路径
             file_path = Path(settings.UPLOAD_DIR) / file_record.file_path
             
-            # 处理图片
-            img_base64, metadata = await self.process_image(file_path)
+            # 使用上传时生成的视觉模型版本，旧文件缺少时补生成
+            image_url = await rendition_service.vision_image_url(file_record)
+            metadata = await rendition_service.metadata(file_record)
             
             # 提取文字（如果需要）
             extracted_text = None
             if extract_text:
-                extracted_text = await self.extract_text(file_path)
+                extracted_text = await self.extract_text(file_path, file_record.content_hash)
             
             # 构建分析提示
             if not query:
@@ -121,20 +68,20 @@ class ImageService:
             
             # 调用AI进行分析
             analysis_result = await ai_client.analyze_image(
-                image_base64=img_base64,
+                image_url=image_url,
                 query=query,
                 system_prompt=system_prompt,
                 extracted_text=extracted_text
             )
             
-            # 保存分析记录
-            analysis_record = AnalysisRecord(
+            # 保存分析记录（后台批量写入）
+            write_behind.add(
+                AnalysisRecord,
                 file_id=file_id,
                 analysis_type="image",
-                result=analysis_result
+                result=analysis_result,
+                created_at=datetime.utcnow()
             )
-            db.add(analysis_record)
-            await db.commit()
             
             return {
                 "file_id": file_id,
@@ -180,15 +127,15 @@ class ImageService:
                 system_prompt=system_prompt
             )
 
-            # 如果提供了file_id，创建分析记录
+            # 如果提供了file_id，创建分析记录（后台批量写入）
             if file_id:
-                analysis_record = AnalysisRecord(
+                write_behind.add(
+                    AnalysisRecord,
                     file_id=file_id,
                     analysis_type="image",
-                    result=analysis_result
+                    result=analysis_result,
+                    created_at=datetime.utcnow()
                 )
-                db.add(analysis_record)
-                await db.commit()
             
             return {
                 "url": image_url,
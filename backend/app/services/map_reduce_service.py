@@ -0,0 +1,352 @@
+from typing import AsyncGenerator, AsyncIterable, Dict, Any, List, Optional, Union
+import asyncio
+import hashlib
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services.ai_client import ai_client, CACHE_NAMESPACE_DOCUMENT
+from app.services.upstream_scheduler import PRIORITY_BATCH
+from app.utils.cache import cache_manager
+from app.utils.exceptions import APIError
+from app.utils.tokens import count_tokens
+
+MAP_QUERY_TEMPLATE = "请结合分析要求“{query}”，总结这段内容的要点。"
+REDUCE_QUERY_TEMPLATE = (
+    "以下是同一文档中连续几部分的分析结果。请将它们合并为一份完整的要点总结，"
+    "保留与分析要求“{query}”相关的信息，去除重复内容。"
+)
+
+class MapReduceService:
+    """文档分析的map-reduce引擎
+
+    map阶段并发分析每个分段；reduce阶段按扇入数和token预算把结果分组，逐层合并成树，
+    直到只剩一个结果，最后一层使用用户的分析要求生成最终结果，避免最终提示词超长。
+    每个分段和每个合并节点的结果都会记录到Redis检查点中，重试或崩溃后重新提交相同的
+    文档和要求时会从检查点继续，而不是从头开始。
+    """
+
+    def _checkpoint_key(self, job_id: str) -> str:
+        return f"{settings.REDIS_PREFIX}doc_mapreduce:{job_id}"
+
+    def _job_id(
+        self,
+        segments: List[str],
+        query: str,
+        system_prompt: Optional[str]
+    ) -> str:
+        """根据分段内容和分析要求生成稳定的任务ID，用于定位检查点"""
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (ai_client.model, system_prompt or "", query, str(settings.DOC_REDUCE_FAN_IN)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        for segment in segments:
+            digest.update(segment.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    async def _load_checkpoint(self, job_id: str) -> Dict[str, str]:
+        try:
+            return await cache_manager.redis.hgetall(self._checkpoint_key(job_id))
+        except Exception as e:
+            app_logger.warning(f"读取文档分析检查点失败: {str(e)}")
+            return {}
+
+    async def _save_checkpoint(self, job_id: str, field: str, value: str):
+        """保存单个节点的结果，检查点写入失败不影响分析"""
+        try:
+            key = self._checkpoint_key(job_id)
+            await cache_manager.redis.hset(key, field, value)
+            await cache_manager.redis.expire(key, settings.DOC_CHECKPOINT_TTL)
+        except Exception as e:
+            app_logger.warning(f"保存文档分析检查点失败: {str(e)}")
+
+    async def _clear_checkpoint(self, job_id: str):
+        try:
+            await cache_manager.redis.delete(self._checkpoint_key(job_id))
+        except Exception as e:
+            app_logger.warning(f"清理文档分析检查点失败: {str(e)}")
+
+    async def _complete(
+        self,
+        content: str,
+        system_prompt: Optional[str],
+        use_cache: bool
+    ) -> str:
+        return await ai_client.generate_response(
+            [{"role": "user", "content": content}],
+            system_prompt,
+            use_cache=use_cache,
+            cache_namespace=CACHE_NAMESPACE_DOCUMENT,
+            priority=PRIORITY_BATCH
+        )
+
+    def _group_for_reduce(self, results: List[str]) -> List[List[str]]:
+        """按扇入数和输入token预算分组"""
+        groups: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for result in results:
+            tokens = count_tokens(result)
+            # 每组至少合并两个结果，保证每一层的结果数都会减少
+            if len(current) >= max(2, settings.DOC_REDUCE_FAN_IN) or (
+                len(current) >= 2
+                and current_tokens + tokens > settings.DOC_REDUCE_MAX_INPUT_TOKENS
+            ):
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(result)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def _keyed_job_id(self, job_key: str, query: str, system_prompt: Optional[str]) -> str:
+        """根据调用方提供的来源标识（如文件哈希和提取参数）生成任务ID，边提取边分析时分段尚未全部产生"""
+        return self._job_id([f"stream:{job_key}"], query, system_prompt)
+
+    def _map_prompt(self, segment: str, query: str) -> str:
+        return f"文档内容：\n{segment}\n\n分析要求：{MAP_QUERY_TEMPLATE.format(query=query)}"
+
+    async def _analyze_single(
+        self,
+        segment: str,
+        query: str,
+        system_prompt: Optional[str],
+        use_cache: bool
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        yield {"type": "progress", "stage": "map", "completed": 0, "total": 1}
+        result = await self._complete(
+            f"文档内容：\n{segment}\n\n分析要求：{query}", system_prompt, use_cache
+        )
+        yield {"type": "progress", "stage": "map", "completed": 1, "total": 1}
+        yield {"type": "result", "content": result}
+
+    async def analyze(
+        self,
+        segments: Union[List[str], AsyncIterable[str]],
+        query: str,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        job_key: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """执行分析，依次产出进度事件，最后产出 type=result 的结果事件
+
+        segments 可以是异步迭代器（边提取边分段），此时每产生一个分段就开始分析，
+        无需等待提取完成，并需要提供 job_key 用于定位检查点；同一来源的分段列表和
+        异步迭代器使用相同的 job_key 时共享检查点。
+        """
+        if isinstance(segments, list):
+            events = self._analyze_list(segments, query, system_prompt, use_cache, job_key)
+        else:
+            if not job_key:
+                raise APIError("流式分段分析需要提供job_key")
+            events = self._analyze_stream(segments, job_key, query, system_prompt, use_cache)
+        async for event in events:
+            yield event
+
+    async def _analyze_list(
+        self,
+        segments: List[str],
+        query: str,
+        system_prompt: Optional[str],
+        use_cache: bool,
+        job_key: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        if not segments:
+            raise APIError("文档内容为空")
+
+        if len(segments) == 1:
+            async for event in self._analyze_single(segments[0], query, system_prompt, use_cache):
+                yield event
+            return
+
+        if job_key:
+            job_id = self._keyed_job_id(job_key, query, system_prompt)
+        else:
+            job_id = self._job_id(segments, query, system_prompt)
+        checkpoint = await self._load_checkpoint(job_id)
+        if checkpoint:
+            app_logger.info(f"从检查点恢复文档分析: job_id={job_id}, 已完成节点数={len(checkpoint)}")
+
+        # map阶段：并发分析各分段（并发和速率由上游调度器控制）
+        total = len(segments)
+        results: List[Optional[str]] = [checkpoint.get(f"map:{i}") for i in range(total)]
+        completed = sum(1 for r in results if r is not None)
+        yield {"type": "progress", "stage": "map", "completed": completed, "total": total}
+
+        async def _map(index: int):
+            content = await self._complete(
+                self._map_prompt(segments[index], query), system_prompt, use_cache
+            )
+            await self._save_checkpoint(job_id, f"map:{index}", content)
+            return index, content
+
+        tasks = [asyncio.create_task(_map(i)) for i, r in enumerate(results) if r is None]
+        try:
+            for future in asyncio.as_completed(tasks):
+                index, content = await future
+                results[index] = content
+                completed += 1
+                yield {"type": "progress", "stage": "map", "completed": completed, "total": total}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        async for event in self._reduce(job_id, checkpoint, results, query, system_prompt, use_cache):
+            yield event
+
+    async def _analyze_stream(
+        self,
+        segments: AsyncIterable[str],
+        job_key: str,
+        query: str,
+        system_prompt: Optional[str],
+        use_cache: bool
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """边接收分段边执行map；分段总数在提取结束前未知，进度事件中 total 为 None"""
+        iterator = segments.__aiter__()
+        try:
+            # 只有一个分段时直接用原始要求分析，因此先确认是否存在第二个分段
+            first = await anext(iterator, None)
+            if first is None:
+                raise APIError("文档内容为空")
+            second = await anext(iterator, None)
+            if second is None:
+                async for event in self._analyze_single(first, query, system_prompt, use_cache):
+                    yield event
+                return
+
+            job_id = self._keyed_job_id(job_key, query, system_prompt)
+            checkpoint = await self._load_checkpoint(job_id)
+            if checkpoint:
+                app_logger.info(f"从检查点恢复文档分析: job_id={job_id}, 已完成节点数={len(checkpoint)}")
+
+            results: List[Optional[str]] = []
+            map_tasks = set()
+            completed = 0
+            total: Optional[int] = None
+
+            async def _map(index: int, segment: str):
+                content = await self._complete(self._map_prompt(segment, query), system_prompt, use_cache)
+                await self._save_checkpoint(job_id, f"map:{index}", content)
+                return index, content
+
+            def _submit(segment: str) -> bool:
+                index = len(results)
+                results.append(checkpoint.get(f"map:{index}"))
+                if results[index] is None:
+                    map_tasks.add(asyncio.create_task(_map(index, segment)))
+                    return False
+                return True
+
+            completed += _submit(first) + _submit(second)
+            yield {"type": "progress", "stage": "map", "completed": completed, "total": total}
+
+            next_segment = asyncio.ensure_future(anext(iterator, None))
+            try:
+                while next_segment or map_tasks:
+                    waiting = set(map_tasks)
+                    if next_segment:
+                        waiting.add(next_segment)
+                    done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                    if next_segment in done:
+                        segment = next_segment.result()
+                        if segment is None:
+                            next_segment = None
+                            total = len(results)
+                        else:
+                            completed += _submit(segment)
+                            next_segment = asyncio.ensure_future(anext(iterator, None))
+                        yield {"type": "progress", "stage": "map", "completed": completed, "total": total}
+
+                    for task in done & map_tasks:
+                        map_tasks.discard(task)
+                        index, content = task.result()
+                        results[index] = content
+                        completed += 1
+                        yield {"type": "progress", "stage": "map", "completed": completed, "total": total}
+            finally:
+                if next_segment:
+                    next_segment.cancel()
+                for task in map_tasks:
+                    task.cancel()
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose:
+                await aclose()
+
+        async for event in self._reduce(job_id, checkpoint, results, query, system_prompt, use_cache):
+            yield event
+
+    async def _reduce(
+        self,
+        job_id: str,
+        checkpoint: Dict[str, str],
+        results: List[str],
+        query: str,
+        system_prompt: Optional[str],
+        use_cache: bool
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """reduce阶段：逐层合并，直到只剩一个结果"""
+        level = 0
+        while True:
+            level += 1
+            groups = self._group_for_reduce(results)
+            is_final = len(groups) == 1
+            yield {
+                "type": "progress", "stage": "reduce", "level": level,
+                "completed": 0, "total": len(groups)
+            }
+
+            async def _merge(index: int, group: List[str], level: int = level, is_final: bool = is_final):
+                field = f"reduce:{level}:{index}"
+                if field in checkpoint:
+                    return index, checkpoint[field]
+                combined = "\n\n".join(
+                    f"第{i + 1}部分分析：\n{item}" for i, item in enumerate(group)
+                )
+                if is_final:
+                    prompt = f"基于以下各部分的分析结果，{query}\n\n{combined}"
+                else:
+                    prompt = f"{REDUCE_QUERY_TEMPLATE.format(query=query)}\n\n{combined}"
+                content = await self._complete(prompt, system_prompt, use_cache)
+                await self._save_checkpoint(job_id, field, content)
+                return index, content
+
+            next_results: List[Optional[str]] = [None] * len(groups)
+            tasks = [asyncio.create_task(_merge(i, g)) for i, g in enumerate(groups)]
+            try:
+                for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+                    index, content = await future
+                    next_results[index] = content
+                    yield {
+                        "type": "progress", "stage": "reduce", "level": level,
+                        "completed": done, "total": len(groups)
+                    }
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            results = next_results
+            if is_final:
+                break
+
+        await self._clear_checkpoint(job_id)
+        yield {"type": "result", "content": results[0]}
+
+    async def run(
+        self,
+        segments: Union[List[str], AsyncIterable[str]],
+        query: str,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        job_key: Optional[str] = None
+    ) -> str:
+        """执行分析并直接返回最终结果"""
+        async for event in self.analyze(segments, query, system_prompt, use_cache, job_key):
+            if event["type"] == "result":
+                return event["content"]
+        raise APIError("文档分析未产生结果")
+
+# 创建全局map-reduce分析实例
+map_reduce_service = MapReduceService()
@@ -0,0 +1,122 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.db.models import Message, File
+from app.services.summary_service import summary_service
+from app.services.context import record_conversation_activity
+from app.services.exceptions import DatabaseError
+from app.services.write_behind import write_behind
+from app.utils.tokens import count_tokens
+
+class MessageWriter:
+    """一个聊天轮次的消息写入单元
+
+    用户消息、AI回复和关联的文件记录先暂存在内存中，commit时在同一个事务里一次写入：
+    自增ID由INSERT直接返回，回复通过关系引用用户消息，不需要额外的refresh查询。
+    暂存期间对象不加入会话，读取历史消息时不会被自动flush提前写入。
+    """
+
+    def __init__(self, db: AsyncSession, conversation_id: int):
+        self.db = db
+        self.conversation_id = conversation_id
+        self._pending: List[object] = []
+
+    def add_file(self, file_record: File) -> File:
+        """暂存文件记录"""
+        self._pending.append(file_record)
+        return file_record
+
+    def add_user(self, content: str, file_id: Optional[str] = None) -> Message:
+        """暂存用户消息"""
+        return self._add_message("user", content, file_id=file_id)
+
+    def add_assistant(
+        self,
+        content: str,
+        parent: Optional[Message] = None,
+        parent_message_id: Optional[int] = None
+    ) -> Message:
+        """暂存AI回复，parent为同一轮次中尚未写入的用户消息"""
+        message = self._add_message("assistant", content, parent_message_id=parent_message_id)
+        if parent is not None:
+            message.parent_message = parent
+        return message
+
+    def _add_message(self, role: str, content: str, **fields) -> Message:
+        # 消息时间取暂存时刻，用户消息不会因为等待AI回复而晚于实际发送时间
+        message = Message(
+            conversation_id=self.conversation_id,
+            role=role,
+            content=content,
+            token_count=count_tokens(content),
+            created_at=datetime.utcnow(),
+            **fields
+        )
+        self._pending.append(message)
+        return message
+
+    async def commit(self):
+        """在一个事务中写入所有暂存的记录"""
+        if not self._pending:
+            return
+        try:
+            self.db.add_all(self._pending)
+            await record_conversation_activity(self.db, self.conversation_id, [
+                (record.content, record.created_at)
+                for record in self._pending if isinstance(record, Message)
+            ])
+            await self.db.commit()
+            self._pending = []
+        except Exception as e:
+            await self.db.rollback()
+            app_logger.error(f"保存消息失败: {str(e)}")
+            raise DatabaseError(detail="保存消息失败")
+
+    async def commit_quietly(self):
+        """写入已暂存的记录，失败只记录日志；用于AI调用失败时仍保留用户消息，不掩盖原始错误"""
+        try:
+            await self.commit()
+        except DatabaseError:
+            pass
+
+def _schedule_summary_updates(rows: List[Dict[str, Any]]):
+    """后台写入的AI回复入库后更新相应会话的摘要"""
+    for conversation_id in {row["conversation_id"] for row in rows}:
+        summary_service.schedule_update(conversation_id)
+
+async def _record_activity(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """后台写入AI回复时同步更新会话的汇总字段"""
+    activity: Dict[int, List[Tuple[str, datetime]]] = {}
+    for row in rows:
+        activity.setdefault(row["conversation_id"], []).append((row["content"], row["created_at"]))
+    for conversation_id, messages in activity.items():
+        await record_conversation_activity(db, conversation_id, messages)
+
+write_behind.on_insert(Message, _record_activity)
+write_behind.on_written(Message, _schedule_summary_updates)
+
+async def save_assistant_reply(
+    db: AsyncSession,
+    conversation_id: int,
+    content: str,
+    parent_message_id: Optional[int]
+):
+    """保存已发送给用户的AI回复，开启后台写入时放入批量写入缓冲"""
+    if settings.CHAT_DEFER_ASSISTANT_WRITES:
+        write_behind.add(
+            Message,
+            conversation_id=conversation_id,
+            role="assistant",
+            content=content,
+            parent_message_id=parent_message_id,
+            token_count=count_tokens(content),
+            created_at=datetime.utcnow()
+        )
+        return
+
+    writer = MessageWriter(db, conversation_id)
+    writer.add_assistant(content, parent_message_id=parent_message_id)
+    await writer.commit()
+    summary_service.schedule_update(conversation_id)
@@ -257,6 +257,7 @@ class NoteService:
             if note.message_ids:
                 messages_query = (
                     select(Message)
+                    .options(joinedload(Message.file))
                     .where(Message.id.in_(note.message_ids))
                 )
                 messages_result = await db.execute(messages_query)
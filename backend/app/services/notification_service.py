@@ -3,6 +3,7 @@ from sqlalchemy import select, func
 from app.db.models import RevisionSettings, RevisionTask, Note
 from datetime import datetime, timedelta
 from app.core.logging import app_logger
+from app.utils.dates import day_bounds
 import asyncio
 from fastapi import HTTPException
 from sqlalchemy.orm import joinedload
@@ -13,12 +14,12 @@ class NotificationService:
         """获取每日复习任务摘要"""
         try:
             # 获取今天的开始和结束时间
-            today_start = datetime.combine(date.date(), datetime.min.time())
-            today_end = datetime.combine(date.date(), datetime.max.time())
+            today_start, today_end = day_bounds(date)
             
             # 查询今天的任务，并预加载笔记信息
             base_query = select(RevisionTask).filter(
-                func.date(RevisionTask.scheduled_date) == date.date()
+                RevisionTask.scheduled_date >= today_start,
+                RevisionTask.scheduled_date < today_end
             ).options(
                 joinedload(RevisionTask.note)  # 预加载关联的笔记信息
             )
@@ -0,0 +1,68 @@
+from typing import Optional, Union
+from pathlib import Path
+import asyncio
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services.extraction_cache import extraction_cache, hash_bytes, hash_file
+from app.services.extraction_pool import extraction_pool
+from app.services import extractors
+
+class OcrService:
+    """OCR识别服务
+
+    图片先在提取进程池中预处理（灰度、纠偏、缩放到目标DPI）并按空白行切片，
+    各切片再并行交给Tesseract识别；识别结果按图片内容的SHA-256缓存。
+    同时识别的切片数不超过提取进程数，避免大批扫描页占满提取队列。
+    """
+
+    def __init__(self):
+        self._slots = asyncio.Semaphore(max(1, settings.EXTRACTION_WORKERS))
+
+    async def _recognize_tile(self, tile: bytes) -> str:
+        async with self._slots:
+            return await extraction_pool.run(extractors.ocr_image_tile, tile, settings.OCR_LANG)
+
+    async def recognize(self, source: Union[str, Path, bytes]) -> str:
+        """识别图片文字（不使用缓存）"""
+        try:
+            tiles = await extraction_pool.run(
+                extractors.prepare_ocr_image,
+                source if isinstance(source, bytes) else str(source),
+                settings.OCR_TARGET_DPI,
+                settings.OCR_MAX_SIDE,
+                settings.OCR_TILE_HEIGHT,
+                settings.OCR_DESKEW_MAX_ANGLE
+            )
+            texts = await asyncio.gather(*(self._recognize_tile(tile) for tile in tiles))
+        except Exception as e:
+            raise ValueError(f"OCR处理失败: {str(e)}")
+        return '\n'.join(text for text in texts if text)
+
+    async def extract_text(self, file_path: Union[str, Path], content_hash: Optional[str] = None) -> str:
+        """识别图片文件文字，结果按文件内容的SHA-256缓存"""
+        return await extraction_cache.get_or_extract(
+            content_hash or await hash_file(file_path),
+            "ocr",
+            lambda: self.recognize(file_path)
+        )
+
+    async def extract_bytes(self, content: bytes) -> str:
+        """识别内存中的图片文字，结果按图片内容的SHA-256缓存"""
+        return await extraction_cache.get_or_extract(
+            hash_bytes(content),
+            "ocr",
+            lambda: self.recognize(content)
+        )
+
+    async def extract_pdf_page(self, file_path: str, page_index: int) -> Optional[str]:
+        """识别PDF纯图片页面中嵌入的图片，失败时返回None，由调用方决定是否缓存结果"""
+        try:
+            images = await extraction_pool.run(extractors.extract_pdf_page_images, file_path, page_index)
+            texts = await asyncio.gather(*(self.extract_bytes(image) for image in images))
+            return '\n'.join(text for text in texts if text)
+        except Exception as e:
+            app_logger.warning(f"PDF页面OCR失败: page={page_index + 1}, error={str(e)}")
+            return None
+
+# 创建全局OCR服务实例
+ocr_service = OcrService()
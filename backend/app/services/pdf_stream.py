@@ -0,0 +1,121 @@
+from typing import AsyncIterator, List, Optional, Union
+from pathlib import Path
+import asyncio
+import tempfile
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.services.extraction_cache import PartialText
+from app.services.extraction_pool import extraction_pool
+from app.services.ocr_service import ocr_service
+from app.services import extractors
+from app.utils.tokens import count_tokens, truncate_to_tokens
+
+def _write_temp_pdf(content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        temp_file.write(content)
+        return temp_file.name
+
+class PdfPageStream:
+    """逐页提取PDF文本
+
+    在提取进程池中按批解析页面，并预取下一批，调用方处理当前页时下一批已在解析；
+    第一批页数较少、之后逐批加倍，使分段和上游分析能在第一页解析完后就开始。
+    没有文本层的扫描页面回退到OCR识别，识别失败的页面记入ocr_failed_pages，此时结果不应写入缓存。
+    可按页数或token数限制提取范围，达到上限后不再解析剩余页面。
+    """
+
+    def __init__(
+        self,
+        source: Union[str, Path, bytes],
+        max_pages: Optional[int] = None,
+        max_tokens: Optional[int] = None
+    ):
+        self.source = source if isinstance(source, bytes) else str(source)
+        self.max_pages = max_pages or 0
+        self.max_tokens = max_tokens or 0
+        self.total_pages: Optional[int] = None
+        self.pages_read = 0
+        self.tokens_read = 0
+        self.truncated = False
+        self.ocr_failed_pages = 0
+
+    async def _batches(self, path: str) -> AsyncIterator[List[str]]:
+        """按批产出页面文本，产出当前批之前已提交下一批"""
+        start, size = 0, max(1, settings.PDF_FIRST_BATCH_PAGES)
+        task = asyncio.create_task(extraction_pool.run(extractors.extract_pdf_pages, path, start, start + size))
+        try:
+            while task:
+                pages, total = await task
+                self.total_pages = total
+                limit = min(total, self.max_pages) if self.max_pages else total
+                batch_start = start
+                start += size
+                size = min(size * 2, max(1, settings.PDF_MAX_BATCH_PAGES))
+                task = None
+                if start < limit:
+                    task = asyncio.create_task(
+                        extraction_pool.run(extractors.extract_pdf_pages, path, start, min(start + size, limit))
+                    )
+                if settings.OCR_PDF_FALLBACK:
+                    pages = await self._ocr_image_pages(path, batch_start, pages)
+                yield pages
+        finally:
+            if task:
+                task.cancel()
+
+    async def _ocr_image_pages(self, path: str, batch_start: int, pages: List[str]) -> List[str]:
+        """没有文本层的页面（扫描件）改为识别页面中嵌入的图片，各页并行识别"""
+        blank = [i for i, text in enumerate(pages) if len(text.strip()) < settings.OCR_PDF_MIN_CHARS]
+        if not blank:
+            return pages
+        texts = await asyncio.gather(*(ocr_service.extract_pdf_page(path, batch_start + i) for i in blank))
+        pages = list(pages)
+        for i, text in zip(blank, texts):
+            if text is None:
+                self.ocr_failed_pages += 1
+            elif text:
+                pages[i] = text
+        return pages
+
+    async def pages(self) -> AsyncIterator[str]:
+        """逐页产出文本，达到页数或token上限时停止"""
+        path, temp_path = self.source, None
+        if isinstance(self.source, bytes):
+            # 内存中的PDF先写入临时文件，避免每一批都把整个文件传给工作进程
+            temp_path = await asyncio.to_thread(_write_temp_pdf, self.source)
+            path = temp_path
+
+        batches = self._batches(path)
+        try:
+            async for batch in batches:
+                for text in batch:
+                    if self.max_pages and self.pages_read >= self.max_pages:
+                        self.truncated = True
+                        return
+                    tokens = count_tokens(text)
+                    if self.max_tokens and self.tokens_read + tokens > self.max_tokens:
+                        self.truncated = True
+                        text = truncate_to_tokens(text, self.max_tokens - self.tokens_read)
+                        if text:
+                            self.pages_read += 1
+                            self.tokens_read = self.max_tokens
+                            yield text
+                        return
+                    self.pages_read += 1
+                    self.tokens_read += tokens
+                    yield text
+            if self.total_pages is not None and self.pages_read < self.total_pages:
+                self.truncated = True
+        finally:
+            await batches.aclose()
+            if temp_path:
+                Path(temp_path).unlink(missing_ok=True)
+            app_logger.info(
+                f"PDF逐页提取结束: pages={self.pages_read}/{self.total_pages}, "
+                f"tokens={self.tokens_read}, truncated={self.truncated}, ocr_failed={self.ocr_failed_pages}"
+            )
+
+    async def read(self) -> str:
+        """提取全部（或到上限为止的）文本，拼接方式与一次性提取相同；有页面OCR失败时返回PartialText"""
+        text = '\n'.join([text async for text in self.pages() if text])
+        return PartialText(text) if self.ocr_failed_pages else text
@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, NamedTuple
+from pathlib import Path
+import asyncio
+import base64
+import aiofiles
+from PIL import Image
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.db.models import File
+from app.services.extraction_pool import extraction_pool
+from app.services import extractors
+
+STATIC_DIR = Path("static")
+
+RENDITION_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+RENDITION_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+class Rendition(NamedTuple):
+    """一个衍生文件：相对UPLOAD_DIR的路径和最大宽高"""
+    name: str
+    path: Path
+    max_width: int
+    max_height: int
+
+class RenditionService:
+    """图片衍生文件服务
+
+    上传图片时在提取进程池中生成视觉模型使用的缩放版本和若干缩略图，与原图放在同一目录，
+    文件名包含内容哈希和生成参数；相同内容的图片共用衍生文件，参数调整后自动生成新文件。
+    图片分析直接读取已生成的版本，不再每次解码、缩放和重新编码原图。
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def _format(self) -> str:
+        image_format = settings.VISION_IMAGE_FORMAT.upper()
+        return image_format if image_format in RENDITION_EXTENSIONS else "JPEG"
+
+    def renditions(self, file_record: File) -> List[Rendition]:
+        """文件的所有衍生文件，按尺寸从大到小排列"""
+        stored_path = Path(file_record.file_path)
+        stem = file_record.content_hash or stored_path.stem
+        ext = RENDITION_EXTENSIONS[self._format]
+        quality = settings.VISION_IMAGE_QUALITY
+        width, height = settings.VISION_IMAGE_MAX_WIDTH, settings.VISION_IMAGE_MAX_HEIGHT
+
+        renditions = [Rendition(
+            "vision",
+            stored_path.parent / f"{stem}.vision-{width}x{height}q{quality}{ext}",
+            width,
+            height
+        )]
+        for size in sorted(settings.IMAGE_THUMBNAIL_SIZES, reverse=True):
+            renditions.append(Rendition(
+                f"thumb{size}",
+                stored_path.parent / f"{stem}.thumb{size}q{quality}{ext}",
+                size,
+                size
+            ))
+        return renditions
+
+    async def ensure(self, file_record: File) -> Dict[str, Path]:
+        """生成缺失的衍生文件，返回名称到相对路径的映射"""
+        renditions = self.renditions(file_record)
+        missing = [r for r in renditions if not (settings.UPLOAD_DIR / r.path).exists()]
+        if missing:
+            key = str(renditions[0].path)
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            try:
+                async with lock:
+                    # 等待期间可能已由其他请求生成
+                    missing = [r for r in missing if not (settings.UPLOAD_DIR / r.path).exists()]
+                    if missing:
+                        await extraction_pool.run(
+                            extractors.render_image_renditions,
+                            str(settings.UPLOAD_DIR / file_record.file_path),
+                            [(str(settings.UPLOAD_DIR / r.path), r.max_width, r.max_height) for r in missing],
+                            self._format,
+                            settings.VISION_IMAGE_QUALITY
+                        )
+            finally:
+                if not lock.locked():
+                    self._locks.pop(key, None)
+        return {r.name: r.path for r in renditions}
+
+    async def vision_image_url(self, file_record: File) -> str:
+        """视觉模型使用的图片地址：配置了本站地址时使用URL，否则使用base64数据URL"""
+        vision_path = (await self.ensure(file_record))["vision"]
+        if settings.VISION_IMAGE_BASE_URL:
+            return f"{settings.VISION_IMAGE_BASE_URL.rstrip('/')}{self.static_url(vision_path)}"
+
+        async with aiofiles.open(settings.UPLOAD_DIR / vision_path, 'rb') as f:
+            content = await f.read()
+        encoded = base64.b64encode(content).decode()
+        return f"data:{RENDITION_MIME_TYPES[self._format]};base64,{encoded}"
+
+    def thumbnail_urls(self, file_record: File) -> Dict[str, str]:
+        """已生成的缩略图访问URL"""
+        return {
+            r.name: self.static_url(r.path)
+            for r in self.renditions(file_record)[1:]
+            if (settings.UPLOAD_DIR / r.path).exists()
+        }
+
+    def static_url(self, relative_path: Path) -> str:
+        """UPLOAD_DIR下文件的静态访问URL"""
+        stored_path = settings.UPLOAD_DIR / relative_path
+        return f"/static/{stored_path.relative_to(STATIC_DIR).as_posix()}"
+
+    async def metadata(self, file_record: File) -> Dict[str, Any]:
+        """读取原图的格式和尺寸（只读取文件头，不解码图片）"""
+        return await asyncio.to_thread(self._metadata_worker, settings.UPLOAD_DIR / file_record.file_path)
+
+    def _metadata_worker(self, file_path: Path) -> Dict[str, Any]:
+        with Image.open(file_path) as img:
+            return {
+                "format": img.format,
+                "mode": img.mode,
+                "size": img.size,
+                "width": img.width,
+                "height": img.height,
+            }
+
+    async def ensure_quietly(self, file_record: File):
+        """上传时预生成衍生文件，失败只记录日志，分析时会再次尝试"""
+        try:
+            await self.ensure(file_record)
+        except Exception as e:
+            app_logger.warning(f"生成图片衍生文件失败: {file_record.file_id}, error={str(e)}")
+
+# 创建全局图片衍生文件服务实例
+rendition_service = RenditionService()
@@ -12,6 +12,20 @@ from sqlalchemy.orm import joinedload, selectinload
 from fastapi import HTTPException, status
 from app.core.logging import app_logger
 from app.services.history_service import HistoryService  # 确保导入
+from app.utils.dates import day_bounds
+
+def _revision_counts(plan_id: int):
+    """计划中各任务复习次数的分组子查询，与任务查询外连接后一次取回"""
+    return (
+        select(
+            RevisionHistory.task_id,
+            func.count(RevisionHistory.id).label("revision_count")
+        )
+        .join(RevisionTask, RevisionTask.id == RevisionHistory.task_id)
+        .where(RevisionTask.plan_id == plan_id)
+        .group_by(RevisionHistory.task_id)
+        .subquery()
+    )
 
 class RevisionService:
     @staticmethod
@@ -148,9 +162,11 @@ class RevisionService:
     ) -> List[RevisionTask]:
         """获取计划的任务列表"""
         try:
-            # 构建基础查询
+            # 构建基础查询，复习次数通过分组子查询一并取回
+            revision_counts = _revision_counts(plan_id)
             query = (
-                select(RevisionTask)
+                select(RevisionTask, func.coalesce(revision_counts.c.revision_count, 0))
+                .outerjoin(revision_counts, revision_counts.c.task_id == RevisionTask.id)
                 .options(joinedload(RevisionTask.note))  # 预加载笔记信息
                 .where(RevisionTask.plan_id == plan_id)
             )
@@ -159,16 +175,24 @@ class RevisionService:
             if status:
                 query = query.where(RevisionTask.status == status)
             if date:
-                query = query.where(func.date(RevisionTask.scheduled_date) == date)
+                # 使用范围条件代替func.date()，才能使用scheduled_date上的索引
+                day_start, day_end = day_bounds(date)
+                query = query.where(
+                    RevisionTask.scheduled_date >= day_start,
+                    RevisionTask.scheduled_date < day_end
+                )
 
             # 添加排序
             query = query.order_by(RevisionTask.scheduled_date)
 
             result = await db.execute(query)
-            tasks = result.unique().scalars().all()
+            rows = result.unique().all()
 
             # 设置默认值和补充信息
-            for task in tasks:
+            tasks = []
+            for task, revision_count in rows:
+                task.revision_count = revision_count
+                tasks.append(task)
                 if task.status is None:
                     task.status = "pending"
                 if task.mastery_level is None:
@@ -178,13 +202,6 @@ class RevisionService:
                 if task.priority is None:
                     task.priority = 0
 
-                # 获取复习次数
-                history_count = await db.execute(
-                    select(func.count(RevisionHistory.id))
-                    .where(RevisionHistory.task_id == task.id)
-                )
-                task.revision_count = history_count.scalar() or 0
-
                 # 确保笔记信息完整
                 if task.note:
                     if task.note.status is None:
@@ -233,12 +250,13 @@ class RevisionService:
                 task.mastery_level = update_data.mastery_level
                 task.completed_at = datetime.utcnow()
                 
-                # 创建历史记录
+                # 创建历史记录，与任务状态在同一事务中提交
                 history = RevisionHistory(
                     note_id=task.note_id,
                     task_id=task.id,
                     mastery_level=update_data.mastery_level,
-                    revision_date=datetime.utcnow()
+                    revision_mode=task.revision_mode or "normal",
+                    revision_date=task.completed_at
                 )
                 db.add(history)
             
@@ -277,11 +295,13 @@ class RevisionService:
         """获取每日任务列表"""
         try:
             # 建基础查询
+            day_start, day_end = day_bounds(date)
             query = (
                 select(RevisionTask)
                 .options(joinedload(RevisionTask.note))  # 预加载笔记信息
                 .where(
-                    func.date(RevisionTask.scheduled_date) == date
+                    RevisionTask.scheduled_date >= day_start,
+                    RevisionTask.scheduled_date < day_end
                 )
             )
             
@@ -332,8 +352,10 @@ class RevisionService:
             if mode == "normal":
                 conditions.append(RevisionTask.revision_mode == "normal")
             
+            revision_counts = _revision_counts(plan_id)
             stmt = (
-                select(RevisionTask)
+                select(RevisionTask, func.coalesce(revision_counts.c.revision_count, 0))
+                .outerjoin(revision_counts, revision_counts.c.task_id == RevisionTask.id)
                 .options(joinedload(RevisionTask.note))
                 .where(and_(*conditions))
                 .order_by(
@@ -344,9 +366,11 @@ class RevisionService:
             )
             
             result = await db.execute(stmt)
-            task = result.unique().scalar_one_or_none()
+            row = result.unique().one_or_none()
+            task = row[0] if row else None
             
             if task:
+                task.revision_count = row[1]
                 # 设置默认值
                 if task.status is None:
                     task.status = "pending"
@@ -367,13 +391,6 @@ class RevisionService:
                         task.note.content = ""
                     if task.note.title is None:
                         task.note.title = ""
-                    
-                # 获取复习次数
-                history_count = await db.execute(
-                    select(func.count(RevisionHistory.id))
-                    .where(RevisionHistory.task_id == task.id)
-                )
-                task.revision_count = history_count.scalar() or 0
                 
                 app_logger.info(f"找到下一个任务: {task.id}")
             else:
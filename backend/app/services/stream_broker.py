@@ -0,0 +1,130 @@
+from typing import AsyncGenerator, AsyncIterator, Dict
+import asyncio
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils.cache import cache_manager
+from app.utils.exceptions import APIError
+
+class StreamBroker:
+    """基于Redis Streams的流式响应中转
+
+    初始化接口所在的worker在后台任务中消费上游流，并把数据块写入以会话为键的
+    Redis Stream；任意worker都可以通过读取该键来输出SSE响应，无需会话粘滞。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def _redis(self):
+        return cache_manager.redis
+
+    def _key(self, stream_id: str) -> str:
+        """生成流的Redis键名"""
+        return f"{settings.REDIS_PREFIX}chat_stream:{stream_id}"
+
+    async def publish(self, stream_id: str, chunks: AsyncIterator[str]) -> None:
+        """创建流并在后台任务中发布数据块"""
+        await self.cleanup(stream_id)
+
+        key = self._key(stream_id)
+        # 先写入初始化标记，保证GET请求到达时流已存在
+        await self._redis.xadd(key, {"type": "init"})
+        await self._redis.expire(key, settings.STREAM_BROKER_TTL)
+
+        task = asyncio.create_task(self._pump(stream_id, chunks))
+        self._tasks[stream_id] = task
+        task.add_done_callback(lambda t: self._discard_task(stream_id, t))
+
+    def _discard_task(self, stream_id: str, task: asyncio.Task):
+        if self._tasks.get(stream_id) is task:
+            del self._tasks[stream_id]
+
+    async def _pump(self, stream_id: str, chunks: AsyncIterator[str]) -> None:
+        """消费上游数据块并写入Redis Stream"""
+        key = self._key(stream_id)
+        try:
+            async for chunk in chunks:
+                # 每次写入都刷新过期时间，耗时较长的任务流不会在发布期间过期
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.xadd(
+                        key,
+                        {"type": "chunk", "content": chunk},
+                        maxlen=settings.STREAM_BROKER_MAXLEN,
+                        approximate=True,
+                        nomkstream=True
+                    )
+                    pipe.expire(key, settings.STREAM_BROKER_TTL)
+                    entry_id, _ = await pipe.execute()
+                if entry_id is None:
+                    # 流已被其他worker清理（如客户端断开），停止消费上游
+                    app_logger.info(f"流已被清理，停止发布: stream_id={stream_id}")
+                    return
+            await self._redis.xadd(key, {"type": "end"}, nomkstream=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            app_logger.error(f"发布流式响应失败: stream_id={stream_id}, error={str(e)}")
+            await self._redis.xadd(key, {"type": "error", "message": str(e)}, nomkstream=True)
+        finally:
+            try:
+                await self._redis.expire(key, settings.STREAM_BROKER_TTL)
+            except Exception as e:
+                app_logger.warning(f"设置流过期时间失败: {str(e)}")
+
+    async def fail(self, stream_id: str, message: str) -> None:
+        """写入错误标记，正在等待该流的订阅方立即收到错误"""
+        key = self._key(stream_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"type": "error", "message": message})
+            pipe.expire(key, settings.STREAM_BROKER_TTL)
+            await pipe.execute()
+
+    async def subscribe(self, stream_id: str) -> AsyncGenerator[str, None]:
+        """从头读取流中的数据块，直到结束标记"""
+        key = self._key(stream_id)
+        last_id = "0-0"
+        block_ms = settings.QWEN_API_TIMEOUT * 1000
+
+        while True:
+            response = await self._redis.xread({key: last_id}, count=100, block=block_ms)
+            if not response:
+                raise APIError("等待流式响应超时")
+
+            for _, entries in response:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    entry_type = fields.get("type")
+                    if entry_type == "chunk":
+                        yield fields.get("content", "")
+                    elif entry_type == "end":
+                        return
+                    elif entry_type == "error":
+                        raise APIError(fields.get("message") or "上游流式响应失败")
+
+    async def exists(self, stream_id: str) -> bool:
+        """检查流是否已初始化"""
+        return bool(await self._redis.exists(self._key(stream_id)))
+
+    async def cleanup(self, stream_id: str) -> None:
+        """取消本进程内的发布任务并删除流"""
+        task = self._tasks.pop(stream_id, None)
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self._redis.delete(self._key(stream_id))
+
+    async def close(self) -> None:
+        """取消所有发布任务"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# 创建全局流中转实例
+stream_broker = StreamBroker()
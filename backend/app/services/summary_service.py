@@ -0,0 +1,175 @@
+from typing import Dict, Any, Optional
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, desc
+from sqlalchemy.exc import IntegrityError
+from app.db.database import AsyncSessionLocal
+from app.db.models import ConversationSummary, Message
+from app.services.ai_client import ai_client
+from app.services.upstream_scheduler import PRIORITY_BATCH
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.utils.tokens import truncate_to_tokens
+
+# 单条消息纳入摘要前的最大token数，避免粘贴的长文档撑爆摘要请求
+SUMMARY_MESSAGE_MAX_TOKENS = 800
+
+SUMMARY_SYSTEM_PROMPT = """你是一个对话摘要助手。请将已有摘要与新增对话合并为一份新的摘要：
+1. 保留用户的目标、偏好、关键事实和已得出的结论
+2. 省略寒暄和重复内容
+3. 使用第三人称、简洁的中文陈述
+只输出摘要正文。"""
+
+class SummaryService:
+    """会话滚动摘要服务
+
+    每次保存AI回复后在后台增量更新摘要：最近 SUMMARY_KEEP_MESSAGES 条消息保留原文，
+    更早且尚未摘要的消息与已有摘要合并。构建提示词时使用“摘要 + 最近消息”。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def get_summary(
+        self,
+        db: AsyncSession,
+        conversation_id: int
+    ) -> Optional[ConversationSummary]:
+        """获取会话摘要"""
+        query = select(ConversationSummary).where(
+            ConversationSummary.conversation_id == conversation_id
+        )
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+
+    def build_prompt_message(self, summary: ConversationSummary) -> Dict[str, Any]:
+        """将摘要转换为提示词中的系统消息"""
+        return {
+            "role": "system",
+            "content": f"以下是此前对话的摘要，请结合摘要理解后续对话：\n{summary.content}"
+        }
+
+    def schedule_update(self, conversation_id: int) -> None:
+        """在后台调度摘要更新，同一会话同时只运行一个更新任务"""
+        if not settings.SUMMARY_ENABLED:
+            return
+
+        task = self._tasks.get(conversation_id)
+        if task and not task.done():
+            return
+
+        task = asyncio.create_task(self._run_update(conversation_id))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda t: self._discard_task(conversation_id, t))
+
+    def _discard_task(self, conversation_id: int, task: asyncio.Task):
+        if self._tasks.get(conversation_id) is task:
+            del self._tasks[conversation_id]
+
+    async def _run_update(self, conversation_id: int) -> None:
+        """使用独立的数据库会话执行摘要更新"""
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.update_summary(db, conversation_id)
+        except Exception as e:
+            app_logger.error(f"更新会话摘要失败: conversation_id={conversation_id}, error={str(e)}")
+
+    async def update_summary(
+        self,
+        db: AsyncSession,
+        conversation_id: int
+    ) -> Optional[ConversationSummary]:
+        """将已超出保留窗口的消息增量合并进摘要，摘要被其他任务抢先更新时返回None"""
+        summary = await self.get_summary(db, conversation_id)
+        last_message_id = summary.last_message_id if summary else 0
+
+        # 找到保留窗口中最早的一条消息，其之前的消息才需要摘要
+        boundary_query = (
+            select(Message.id)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.id > last_message_id
+            )
+            .order_by(desc(Message.id))
+            .offset(settings.SUMMARY_KEEP_MESSAGES - 1)
+            .limit(1)
+        )
+        boundary_id = (await db.execute(boundary_query)).scalar_one_or_none()
+        if boundary_id is None:
+            return summary
+
+        pending_query = (
+            select(Message.id, Message.role, Message.content)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.id > last_message_id,
+                Message.id < boundary_id
+            )
+            .order_by(Message.id)
+            .limit(settings.SUMMARY_MAX_BATCH)
+        )
+        pending = (await db.execute(pending_query)).all()
+        if len(pending) < settings.SUMMARY_MIN_BATCH:
+            return summary
+
+        dialogue = "\n".join(
+            f"{row.role}: {truncate_to_tokens(row.content, SUMMARY_MESSAGE_MAX_TOKENS)}"
+            for row in pending
+        )
+        previous = summary.content if summary else "（无）"
+        content = await ai_client.generate_response(
+            [{
+                "role": "user",
+                "content": f"已有摘要：\n{previous}\n\n新增对话：\n{dialogue}"
+            }],
+            system_prompt=SUMMARY_SYSTEM_PROMPT,
+            use_cache=False,
+            model=ai_client.model,
+            temperature=0.3,
+            max_tokens=settings.SUMMARY_MAX_TOKENS,
+            priority=PRIORITY_BATCH
+        )
+
+        new_last_message_id = pending[-1].id
+        try:
+            if summary:
+                # 以旧的last_message_id作为乐观锁，避免多个worker重复合并
+                result = await db.execute(
+                    update(ConversationSummary)
+                    .where(
+                        ConversationSummary.id == summary.id,
+                        ConversationSummary.last_message_id == last_message_id
+                    )
+                    .values(
+                        content=content,
+                        last_message_id=new_last_message_id,
+                        summarized_count=(summary.summarized_count or 0) + len(pending)
+                    )
+                )
+                if result.rowcount == 0:
+                    await db.rollback()
+                    app_logger.info(f"会话摘要已被其他任务更新: conversation_id={conversation_id}")
+                    return None
+            else:
+                summary = ConversationSummary(
+                    conversation_id=conversation_id,
+                    content=content,
+                    last_message_id=new_last_message_id,
+                    summarized_count=len(pending)
+                )
+                db.add(summary)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            app_logger.info(f"会话摘要已由其他任务创建: conversation_id={conversation_id}")
+            return None
+
+        await db.refresh(summary)
+        app_logger.info(
+            f"会话摘要已更新: conversation_id={conversation_id}, "
+            f"last_message_id={new_last_message_id}, 新增消息数={len(pending)}"
+        )
+        return summary
+
+# 创建全局摘要服务实例
+summary_service = SummaryService()
@@ -0,0 +1,224 @@
+from typing import AsyncIterable, Optional
+from contextlib import asynccontextmanager
+from pathlib import Path
+import asyncio
+import time
+import uuid
+import aiofiles
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.db.models import File
+from app.services.blob_store import STAGING_DIR, StagedBlob
+from app.services.exceptions import NotFoundError, ServiceError, ValidationError
+from app.services.extraction_cache import hash_file
+from app.services.file_service import file_service
+from app.utils.cache import cache_manager
+
+class UploadSessionService:
+    """分片上传会话（可断点续传）
+
+    客户端先声明文件名和总大小创建会话，再按偏移量逐片上传，分片直接追加到
+    UPLOAD_DIR/tmp/<upload_id>.part；会话状态保存在Redis中，任意工作进程都能继续上传。
+    中断后查询会话得到已接收的字节数，从该偏移量继续即可。全部接收后计算内容哈希，
+    存入内容寻址存储并创建文件记录。同一会话的分片写入和完成操作通过Redis锁互斥。
+    会话过期后遗留的分片文件，以及普通上传中断后遗留的临时文件，由后台任务定期清理。
+    """
+
+    def __init__(self):
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def _key(self, upload_id: str) -> str:
+        return f"{settings.REDIS_PREFIX}upload_session:{upload_id}"
+
+    @asynccontextmanager
+    async def _session_lock(self, upload_id: str):
+        """跨工作进程的会话锁，已被其他请求持有时返回409，由客户端查询偏移量后重试"""
+        lock = cache_manager.redis.lock(
+            f"{settings.REDIS_PREFIX}upload_session_lock:{upload_id}",
+            timeout=settings.UPLOAD_SESSION_LOCK_TTL
+        )
+        if not await lock.acquire(blocking=False):
+            raise ServiceError("该上传会话正在处理其他请求，请稍后重试", 409)
+        try:
+            yield lock
+        finally:
+            try:
+                await lock.release()
+            except Exception as e:
+                app_logger.warning(f"释放上传会话锁失败: {upload_id}, error={str(e)}")
+
+    def _part_path(self, upload_id: str) -> Path:
+        return settings.UPLOAD_DIR / STAGING_DIR / f"{upload_id}.part"
+
+    def _received(self, upload_id: str) -> int:
+        part_path = self._part_path(upload_id)
+        return part_path.stat().st_size if part_path.exists() else 0
+
+    async def create(
+        self,
+        filename: str,
+        size: int,
+        file_type: str,
+        session_id: Optional[str] = None
+    ) -> dict:
+        """创建分片上传会话"""
+        if size <= 0:
+            raise ValidationError("文件大小必须大于0")
+        if size > settings.UPLOAD_MAX_RESUMABLE_SIZE:
+            raise ServiceError(f"文件大小超过限制: {settings.UPLOAD_MAX_RESUMABLE_SIZE} bytes", 413)
+
+        upload_id = uuid.uuid4().hex
+        part_path = self._part_path(upload_id)
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path.touch()
+
+        state = {
+            "filename": filename,
+            "size": str(size),
+            "file_type": file_type,
+            "session_id": session_id or ""
+        }
+        key = self._key(upload_id)
+        await cache_manager.redis.hset(key, mapping=state)
+        await cache_manager.redis.expire(key, settings.UPLOAD_SESSION_TTL)
+        app_logger.info(f"创建分片上传会话: {upload_id}, 文件={filename}, 大小={size}")
+        return await self.get(upload_id)
+
+    async def get(self, upload_id: str) -> dict:
+        """查询上传会话，received为已接收的字节数，即下一片的偏移量"""
+        state = await cache_manager.redis.hgetall(self._key(upload_id))
+        if not state:
+            raise NotFoundError("上传会话不存在或已过期")
+        return {
+            "upload_id": upload_id,
+            "filename": state["filename"],
+            "size": int(state["size"]),
+            "file_type": state["file_type"],
+            "session_id": state["session_id"] or None,
+            "received": self._received(upload_id),
+            "chunk_size": settings.UPLOAD_MAX_CHUNK_SIZE
+        }
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterable[bytes]) -> dict:
+        """从指定偏移量追加一个分片，边接收边写入，超出分片或文件大小限制时中止"""
+        async with self._session_lock(upload_id) as lock:
+            upload = await self.get(upload_id)
+            if offset != upload["received"]:
+                raise ServiceError(f"偏移量不匹配，应从 {upload['received']} 继续上传", 409)
+
+            part_path = self._part_path(upload_id)
+            limit = min(settings.UPLOAD_MAX_CHUNK_SIZE, upload["size"] - offset)
+            written = 0
+            loop = asyncio.get_running_loop()
+            renewed_at = loop.time()
+            async with aiofiles.open(part_path, 'ab') as f:
+                try:
+                    async for chunk in chunks:
+                        written += len(chunk)
+                        if written > limit:
+                            raise ServiceError(f"分片大小超过限制: {limit} bytes", 413)
+                        await f.write(chunk)
+                        # 慢速上传时续期，避免锁在写入期间过期
+                        if loop.time() - renewed_at > settings.UPLOAD_SESSION_LOCK_TTL / 2:
+                            await lock.reacquire()
+                            renewed_at = loop.time()
+                except BaseException:
+                    # 丢弃不完整的分片，客户端可从原偏移量重传
+                    await f.flush()
+                    await f.truncate(offset)
+                    raise
+
+            await cache_manager.redis.expire(self._key(upload_id), settings.UPLOAD_SESSION_TTL)
+            upload["received"] = offset + written
+            return upload
+
+    async def complete(self, db: AsyncSession, upload_id: str) -> File:
+        """所有分片接收完成后计算内容哈希，存入内容寻址存储并创建文件记录"""
+        async with self._session_lock(upload_id):
+            upload = await self.get(upload_id)
+            if upload["received"] != upload["size"]:
+                raise ServiceError(
+                    f"文件尚未上传完成: {upload['received']}/{upload['size']} bytes", 409
+                )
+
+            part_path = self._part_path(upload_id)
+            async with aiofiles.open(part_path, 'rb') as f:
+                head = await f.read(2048)
+            try:
+                content_type = file_service.check_content_type(head, upload["file_type"])
+            except HTTPException:
+                await self.abort(upload_id)
+                raise
+
+            # 哈希状态无法跨请求和工作进程保存，因此在完成时对整个文件计算一次
+            staged = StagedBlob(
+                part_path,
+                await hash_file(part_path),
+                upload["size"],
+                Path(upload["filename"]).suffix.lower()
+            )
+            db_file = await file_service.save_staged(
+                db, staged, upload["filename"], upload["file_type"], content_type, upload["session_id"]
+            )
+            await cache_manager.redis.delete(self._key(upload_id))
+        return db_file
+
+    async def abort(self, upload_id: str):
+        """取消上传会话并删除已接收的分片"""
+        await cache_manager.redis.delete(self._key(upload_id))
+        self._part_path(upload_id).unlink(missing_ok=True)
+
+    async def sweep_expired(self) -> int:
+        """删除会话已过期的分片文件和遗留的上传临时文件，返回删除的文件数"""
+        staging_dir = settings.UPLOAD_DIR / STAGING_DIR
+        if not staging_dir.exists():
+            return 0
+        # 每次追加分片都会更新文件修改时间并刷新会话有效期，超过有效期未修改的文件其会话已过期
+        part_deadline = time.time() - settings.UPLOAD_SESSION_TTL
+        # 普通上传的临时文件（blob_store.stage写入）在同一请求内入库或删除，长时间未修改说明请求已中断
+        staged_deadline = time.time() - settings.UPLOAD_STAGING_TTL
+        removed = 0
+        for path in staging_dir.iterdir():
+            try:
+                if not path.is_file():
+                    continue
+                is_part = path.suffix == ".part"
+                if path.stat().st_mtime > (part_deadline if is_part else staged_deadline):
+                    continue
+                if is_part and await cache_manager.redis.exists(self._key(path.stem)):
+                    continue
+                path.unlink(missing_ok=True)
+                removed += 1
+            except Exception as e:
+                app_logger.warning(f"清理上传临时文件失败: {path.name}, error={str(e)}")
+        if removed:
+            app_logger.info(f"清理过期的上传临时文件: {removed}个")
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep_expired()
+            except Exception as e:
+                app_logger.error(f"清理上传临时文件失败: {str(e)}")
+            await asyncio.sleep(settings.UPLOAD_SWEEP_INTERVAL)
+
+    def start(self):
+        """启动时清理一次，之后定期清理"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        """停止定期清理"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+# 创建全局分片上传会话实例
+upload_session_service = UploadSessionService()
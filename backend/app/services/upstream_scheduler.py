@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import time
+from app.core.config import settings
+from app.core.logging import app_logger
+
+# 优先级通道：数值越小越优先
+PRIORITY_INTERACTIVE = 0  # 交互式对话
+PRIORITY_BATCH = 10  # 文档分段分析、摘要等批量任务
+
+# 令牌被更高优先级的等待者占用时，重新检查的间隔（秒）
+BUCKET_YIELD_INTERVAL = 0.05
+
+class TokenBucket:
+    """按分钟速率连续补充的令牌桶，rate_per_minute为0时不限制"""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._waiting: Dict[int, int] = {}  # 各优先级正在等待令牌的调用数
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated_at) * self.capacity / 60
+        )
+        self._updated_at = now
+
+    def _higher_priority_waiting(self, priority: int) -> bool:
+        return any(p < priority and count for p, count in self._waiting.items())
+
+    async def acquire(self, amount: float = 1, priority: int = PRIORITY_INTERACTIVE):
+        """取出令牌，不足时等待补充；超过桶容量的请求在桶满时放行
+
+        检查和扣除之间没有await，不需要加锁；等待期间不占用桶，其他调用可以继续取用，
+        有更高优先级的调用在等待时让其先取，批量任务不会挡住交互式对话。
+        """
+        if not self.enabled:
+            return
+        amount = min(amount, self.capacity)
+        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        try:
+            while True:
+                self._refill()
+                if self._higher_priority_waiting(priority):
+                    delay = BUCKET_YIELD_INTERVAL
+                elif self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                else:
+                    delay = (amount - self._tokens) * 60 / self.capacity
+                await asyncio.sleep(delay)
+        finally:
+            self._waiting[priority] -= 1
+
+    def adjust(self, delta: float):
+        """按实际用量修正已扣除的令牌，delta为正表示补扣"""
+        if not self.enabled:
+            return
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - delta)
+
+class UpstreamScheduler:
+    """上游模型调用调度器
+
+    所有上游调用共享一个并发上限，等待中的请求按优先级（同级先到先得）获得执行槽位；
+    获得槽位后再经过每分钟请求数和每分钟token数两个令牌桶限速。
+    并发上限采用AIMD策略：成功时缓慢增加，遇到429时减半并暂停一段时间。
+    """
+
+    def __init__(self):
+        self._max_limit = settings.UPSTREAM_MAX_CONCURRENCY
+        self._limit = float(self._max_limit)
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._cooldown_until = 0.0
+        self._request_bucket = TokenBucket(settings.UPSTREAM_RPM_LIMIT)
+        self._token_bucket = TokenBucket(settings.UPSTREAM_TPM_LIMIT)
+
+    @property
+    def limit(self) -> int:
+        return max(settings.UPSTREAM_MIN_CONCURRENCY, int(self._limit))
+
+    def _dispatch(self):
+        """按优先级唤醒等待者，直到达到当前并发上限"""
+        while self._waiters and self._active < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    async def _acquire_slot(self, priority: int):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配槽位但调用方被取消，归还槽位
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        self._active -= 1
+        self._dispatch()
+
+    async def _wait_cooldown(self):
+        delay = self._cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, tokens: int = 0):
+        """获取一次上游调用的执行槽位"""
+        await self._acquire_slot(priority)
+        try:
+            await self._wait_cooldown()
+            await self._request_bucket.acquire(1, priority)
+            await self._token_bucket.acquire(tokens, priority)
+            yield self
+        finally:
+            self._release_slot()
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """按实际消耗的token数修正每分钟token令牌桶"""
+        if actual_tokens is not None:
+            self._token_bucket.adjust(actual_tokens - estimated_tokens)
+
+    def record_success(self):
+        """加性增：每次成功调用使并发上限增加 1/当前上限"""
+        if self._limit < self._max_limit:
+            self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+            self._dispatch()
+
+    def record_rate_limited(self, retry_after: Optional[float] = None):
+        """乘性减：遇到429时并发上限减半，并在冷却期内暂停发起新调用"""
+        self._limit = max(settings.UPSTREAM_MIN_CONCURRENCY, self._limit / 2)
+        cooldown = retry_after if retry_after else settings.UPSTREAM_RATE_LIMIT_COOLDOWN
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + cooldown)
+        app_logger.warning(
+            f"上游触发限流，并发上限降为 {self.limit}，暂停 {cooldown:.1f} 秒"
+        )
+
+# 创建全局上游调度器实例
+upstream_scheduler = UpstreamScheduler()
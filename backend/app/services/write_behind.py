@@ -0,0 +1,108 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.logging import app_logger
+from app.db.database import AsyncSessionLocal
+
+class WriteBehindBuffer:
+    """日志类记录的后台批量写入缓冲
+
+    分析记录等只追加、不会被其他查询立即读取的记录先放入内存缓冲，
+    达到批量大小或到达刷新间隔时按表用一条批量insert写入，请求不再等待这些写入。
+    数据库暂时不可用时记录保留到下一次刷新重试；应用正常关闭时在lifespan中写完缓冲中的全部记录。
+    """
+
+    def __init__(self):
+        self._rows: Dict[Any, List[Dict[str, Any]]] = {}
+        self._callbacks: Dict[Any, Callable[[List[Dict[str, Any]]], None]] = {}
+        self._insert_hooks: Dict[Any, Callable[[AsyncSession, List[Dict[str, Any]]], Awaitable[None]]] = {}
+        self._size = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def on_written(self, model, callback: Callable[[List[Dict[str, Any]]], None]):
+        """注册某个表的记录写入成功后的回调"""
+        self._callbacks[model] = callback
+
+    def on_insert(self, model, hook: Callable[[AsyncSession, List[Dict[str, Any]]], Awaitable[None]]):
+        """注册与批量insert在同一事务中执行的操作（如维护汇总字段）"""
+        self._insert_hooks[model] = hook
+
+    def add(self, model, **values):
+        """放入一条待写入的记录"""
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._worker = asyncio.create_task(self._run())
+        self._rows.setdefault(model, []).append(values)
+        self._size += 1
+        if self._size >= settings.WRITE_BEHIND_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.WRITE_BEHIND_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """写入缓冲中的全部记录"""
+        if not self._size or self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            pending, self._rows, self._size = self._rows, {}, 0
+            for model, rows in pending.items():
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await db.execute(insert(model), rows)
+                        hook = self._insert_hooks.get(model)
+                        if hook is not None:
+                            await hook(db, rows)
+                        await db.commit()
+                except (OperationalError, InterfaceError) as e:
+                    # 数据库暂时不可用，保留记录等待下一次刷新
+                    app_logger.error(f"批量写入{model.__tablename__}失败，稍后重试: count={len(rows)}, error={str(e)}")
+                    self._requeue(model, rows)
+                    continue
+                except Exception as e:
+                    # 数据本身无法写入（如违反约束），重试也不会成功
+                    app_logger.error(f"批量写入{model.__tablename__}失败，已丢弃: count={len(rows)}, error={str(e)}")
+                    continue
+
+                callback = self._callbacks.get(model)
+                if callback is not None:
+                    try:
+                        callback(rows)
+                    except Exception as e:
+                        app_logger.warning(f"批量写入回调失败: {model.__tablename__}, error={str(e)}")
+
+    def _requeue(self, model, rows: List[Dict[str, Any]]):
+        """写入失败的记录放回缓冲，超过上限时丢弃最早的记录"""
+        room = settings.WRITE_BEHIND_MAX_PENDING - self._size
+        if room < len(rows):
+            app_logger.error(f"写入缓冲已满，丢弃{len(rows) - max(room, 0)}条{model.__tablename__}记录")
+            rows = rows[len(rows) - max(room, 0):]
+        self._rows[model] = rows + self._rows.get(model, [])
+        self._size += len(rows)
+
+    async def close(self):
+        """停止后台刷新并写入剩余记录"""
+        if self._worker is not None:
+            # 等待正在进行的刷新完成后再停止，避免已取出的记录丢失
+            async with self._flush_lock:
+                self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+# 创建全局后台批量写入实例
+write_behind = WriteBehindBuffer()
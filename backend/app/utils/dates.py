@@ -0,0 +1,9 @@
+from typing import Tuple, Union
+from datetime import date, datetime, timedelta
+
+def day_bounds(day: Union[date, datetime]) -> Tuple[datetime, datetime]:
+    """某一天的时间范围[当天0点, 次日0点)，用于可以走索引的范围查询"""
+    if isinstance(day, datetime):
+        day = day.date()
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
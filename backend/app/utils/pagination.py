@@ -0,0 +1,18 @@
+from typing import Optional, Tuple
+from datetime import datetime
+import base64
+import json
+
+def encode_cursor(timestamp: Optional[datetime], row_id: int) -> str:
+    """把键集分页的位置（时间, ID）编码为不透明的游标"""
+    payload = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """解析游标，格式不正确时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
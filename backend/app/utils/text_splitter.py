@@ -0,0 +1,332 @@
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+import itertools
+import re
+from app.utils.tokens import count_tokens, truncate_to_tokens
+
+DEFAULT_MAX_TOKENS = 2000
+DEFAULT_OVERLAP_TOKENS = 100
+
+BLOCK_HEADING = "heading"
+BLOCK_CODE = "code"
+BLOCK_TABLE = "table"
+BLOCK_PARAGRAPH = "paragraph"
+
+_HEADING_PATTERN = re.compile(r'^(#{1,6})\s+\S')
+_FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+_TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|?\s*:?-{3,}')
+# 按句末标点或换行切分句子，保留标点
+_SENTENCE_PATTERN = re.compile(r'[^。！？!?；;\n]*(?:[。！？!?；;]+[”’」』"\')）]*|\n|$)')
+
+class Block:
+    """文档结构块：标题、代码块、表格或段落"""
+    __slots__ = ("kind", "text", "level")
+
+    def __init__(self, kind: str, text: str, level: int = 0):
+        self.kind = kind
+        self.text = text
+        self.level = level
+
+def iter_lines(text: str) -> Iterator[str]:
+    """逐行产出文本（不含换行符），不复制整段文本"""
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def _is_table_line(line: str) -> bool:
+    return line.count("|") >= 2
+
+class BlockParser:
+    """增量解析结构块：逐行输入，识别Markdown标题、围栏代码块和表格，其余按空行分段"""
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._kind: Optional[str] = None
+        self._fence: Optional[str] = None
+
+    def _flush(self) -> Iterator[Block]:
+        if self._buffer:
+            yield Block(self._kind, "\n".join(self._buffer))
+        self._buffer, self._kind = [], None
+
+    def feed(self, line: str) -> Iterator[Block]:
+        """输入一行，产出已完整的结构块"""
+        if self._kind == BLOCK_CODE:
+            self._buffer.append(line)
+            if line.strip().startswith(self._fence):
+                yield from self._flush()
+            return
+
+        fence_match = _FENCE_PATTERN.match(line)
+        if fence_match:
+            yield from self._flush()
+            self._kind, self._fence = BLOCK_CODE, fence_match.group(1)
+            self._buffer.append(line)
+            return
+
+        heading_match = _HEADING_PATTERN.match(line)
+        if heading_match:
+            yield from self._flush()
+            yield Block(BLOCK_HEADING, line.strip(), len(heading_match.group(1)))
+            return
+
+        if not line.strip():
+            yield from self._flush()
+            return
+
+        line_kind = BLOCK_TABLE if _is_table_line(line) else BLOCK_PARAGRAPH
+        if self._kind is not None and self._kind != line_kind:
+            yield from self._flush()
+        self._kind = line_kind
+        self._buffer.append(line)
+
+    def close(self) -> Iterator[Block]:
+        """输入结束，产出最后一个结构块"""
+        yield from self._flush()
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[Block]:
+    """把行流解析为结构块"""
+    parser = BlockParser()
+    for line in lines:
+        yield from parser.feed(line)
+    yield from parser.close()
+
+def split_sentences(text: str) -> List[str]:
+    """按句末标点和换行切分句子"""
+    return [s for s in _SENTENCE_PATTERN.findall(text) if s.strip()]
+
+def _hard_split(text: str, max_tokens: int) -> Iterator[str]:
+    """按token数硬切分无法再按结构切分的文本"""
+    while text:
+        piece = truncate_to_tokens(text, max_tokens) or text[:1]
+        yield piece
+        text = text[len(piece):]
+
+def _split_lines_with_header(
+    lines: List[str],
+    header: List[str],
+    footer: List[str],
+    max_tokens: int
+) -> Iterator[str]:
+    """按行切分代码块或表格，每一段都带上表头或代码围栏"""
+    fixed_tokens = count_tokens("\n".join(header + footer))
+    budget = max(1, max_tokens - fixed_tokens)
+    current: List[str] = []
+    current_tokens = 0
+    for line in lines:
+        tokens = count_tokens(line) + 1
+        if tokens > budget:
+            if current:
+                yield "\n".join(header + current + footer)
+                current, current_tokens = [], 0
+            for piece in _hard_split(line, budget):
+                yield "\n".join(header + [piece] + footer)
+            continue
+        if current and current_tokens + tokens > budget:
+            yield "\n".join(header + current + footer)
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        yield "\n".join(header + current + footer)
+
+def split_block(block: Block, max_tokens: int) -> Iterator[str]:
+    """把超出预算的结构块切分为不超过max_tokens的片段"""
+    if block.kind == BLOCK_CODE:
+        lines = block.text.split("\n")
+        opening = lines[0]
+        closing = lines[-1] if len(lines) > 1 and _FENCE_PATTERN.match(lines[-1]) else None
+        body = lines[1:-1] if closing else lines[1:]
+        yield from _split_lines_with_header(body, [opening], [closing or opening.strip()[:3]], max_tokens)
+    elif block.kind == BLOCK_TABLE:
+        lines = block.text.split("\n")
+        header_size = 2 if len(lines) > 1 and _TABLE_SEPARATOR_PATTERN.match(lines[1]) else 1
+        yield from _split_lines_with_header(lines[header_size:], lines[:header_size], [], max_tokens)
+    else:
+        current: List[str] = []
+        current_tokens = 0
+        for sentence in split_sentences(block.text):
+            tokens = count_tokens(sentence)
+            if tokens > max_tokens:
+                if current:
+                    yield "".join(current)
+                    current, current_tokens = [], 0
+                yield from _hard_split(sentence, max_tokens)
+                continue
+            if current and current_tokens + tokens > max_tokens:
+                yield "".join(current)
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            yield "".join(current)
+
+class ChunkPacker:
+    """把结构块按token预算装箱为分段
+
+    新分段以当前所在的标题路径开头，并带上前一分段结尾的重叠内容，
+    使每个分段都能独立理解；遇到一、二级标题且当前分段已过半时提前换段。
+    """
+
+    def __init__(self, max_tokens: int, overlap_tokens: int = 0):
+        self.max_tokens = max(max_tokens, 16)
+        # 标题路径和重叠内容各最多占用四分之一预算
+        self.context_tokens = self.max_tokens // 4
+        self.overlap_tokens = min(max(overlap_tokens, 0), self.context_tokens)
+        self._headings: List[Tuple[int, str]] = []
+        self._units: List[Tuple[str, int, str]] = []  # (文本, token数, 块类型)
+        self._tokens = 0
+        self._has_content = False
+
+    def _breadcrumb(self) -> str:
+        text = "\n".join(title for _, title in self._headings)
+        return truncate_to_tokens(text, self.context_tokens)
+
+    def _overlap_units(self) -> List[Tuple[str, int, str]]:
+        """取上一分段结尾不超过overlap_tokens的内容，段落可按句子截取"""
+        selected: List[Tuple[str, int, str]] = []
+        remaining = self.overlap_tokens
+        for text, tokens, kind in reversed(self._units):
+            if remaining <= 0 or kind == BLOCK_HEADING:
+                break
+            if tokens <= remaining:
+                selected.insert(0, (text, tokens, kind))
+                remaining -= tokens
+                continue
+            if kind == BLOCK_PARAGRAPH:
+                tail: List[str] = []
+                for sentence in reversed(split_sentences(text)):
+                    sentence_tokens = count_tokens(sentence)
+                    if sentence_tokens > remaining:
+                        break
+                    tail.insert(0, sentence)
+                    remaining -= sentence_tokens
+                if tail:
+                    tail_text = "".join(tail)
+                    selected.insert(0, (tail_text, count_tokens(tail_text), kind))
+            break
+        return selected
+
+    def _emit(self) -> Optional[str]:
+        """输出当前分段，并以标题路径和重叠内容开启新分段"""
+        chunk = "\n\n".join(text for text, _, _ in self._units) if self._has_content else None
+        overlap = self._overlap_units() if self._has_content else []
+        self._units, self._tokens, self._has_content = [], 0, False
+
+        breadcrumb = self._breadcrumb()
+        if breadcrumb:
+            self._append(breadcrumb, count_tokens(breadcrumb), BLOCK_HEADING)
+        for unit in overlap:
+            self._append(*unit)
+        return chunk
+
+    def _append(self, text: str, tokens: int, kind: str):
+        self._units.append((text, tokens, kind))
+        self._tokens += tokens
+
+    def _add_unit(self, text: str, tokens: int, kind: str) -> Iterator[str]:
+        if self._has_content and self._tokens + tokens > self.max_tokens:
+            chunk = self._emit()
+            if chunk:
+                yield chunk
+        if self._tokens + tokens > self.max_tokens:
+            # 标题路径和重叠内容放不下时丢弃，保证分段不超预算
+            self._units, self._tokens = [], 0
+        self._append(text, tokens, kind)
+        self._has_content = True
+
+    def add(self, block: Block) -> Iterator[str]:
+        """加入一个结构块，产出已装满的分段"""
+        if block.kind == BLOCK_HEADING:
+            if self._has_content and block.level <= 2 and self._tokens >= self.max_tokens // 2:
+                chunk = self._emit()
+                if chunk:
+                    yield chunk
+            self._headings = [(level, title) for level, title in self._headings if level < block.level]
+            self._headings.append((block.level, block.text))
+            # 新分段开头的标题路径已包含该标题时不再重复加入
+            if not self._has_content:
+                self._units, self._tokens = [], 0
+                breadcrumb = self._breadcrumb()
+                self._append(breadcrumb, count_tokens(breadcrumb), BLOCK_HEADING)
+                return
+            yield from self._add_unit(block.text, count_tokens(block.text), BLOCK_HEADING)
+            return
+
+        # 超大的块切分后需为标题路径和重叠内容留出空间
+        piece_tokens = self.max_tokens - 2 * self.context_tokens
+        tokens = count_tokens(block.text)
+        if tokens <= piece_tokens:
+            yield from self._add_unit(block.text, tokens, block.kind)
+            return
+        for piece in split_block(block, piece_tokens):
+            yield from self._add_unit(piece, count_tokens(piece), block.kind)
+
+    def flush(self) -> Optional[str]:
+        """输出最后一个未装满的分段"""
+        if not self._has_content:
+            return None
+        chunk = "\n\n".join(text for text, _, _ in self._units)
+        self._units, self._tokens, self._has_content = [], 0, False
+        return chunk
+
+class TextSplitter:
+    """按token数切分文档，保留标题、代码块和表格结构，支持分段重叠
+
+    以生成器方式逐段产出，处理超大文本时不会整体复制。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        overlap_tokens: int = DEFAULT_OVERLAP_TOKENS
+    ):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def split_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """切分行流"""
+        packer = ChunkPacker(self.max_tokens, self.overlap_tokens)
+        for block in iter_blocks(lines):
+            yield from packer.add(block)
+        last = packer.flush()
+        if last:
+            yield last
+
+    async def split_pages(self, pages: AsyncIterable[str]) -> AsyncIterator[str]:
+        """切分逐页到达的文本，每页到达后即产出已装满的分段
+
+        跳过空页，各页按换行拼接，结果与切分拼接后的全文相同。
+        """
+        parser = BlockParser()
+        packer = ChunkPacker(self.max_tokens, self.overlap_tokens)
+        ends_with_newline = False
+        async for page in pages:
+            if not page:
+                continue
+            # 上一页以换行结尾时，拼接后两页之间是一个空行
+            lines = iter_lines(page)
+            if ends_with_newline:
+                lines = itertools.chain([""], lines)
+            ends_with_newline = page.endswith("\n")
+            for line in lines:
+                for block in parser.feed(line):
+                    for chunk in packer.add(block):
+                        yield chunk
+        for block in parser.close():
+            for chunk in packer.add(block):
+                yield chunk
+        last = packer.flush()
+        if last:
+            yield last
+
+    def split(self, text: str) -> Iterator[str]:
+        """切分文本"""
+        if not text or not text.strip():
+            return iter(())
+        return self.split_lines(iter_lines(text))
@@ -0,0 +1,54 @@
+from typing import Any, Dict, List, Optional
+import math
+import re
+
+# 经验校准值：通义千问分词器下，中文约1.5个字符/token，英文及符号约4个字符/token
+CJK_CHARS_PER_TOKEN = 1.5
+OTHER_CHARS_PER_TOKEN = 4.0
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_CJK_PATTERN = re.compile(
+    r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]'
+)
+
+def count_tokens(text: Optional[str]) -> int:
+    """估算文本的token数"""
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    other_chars = len(text) - cjk_chars
+    return math.ceil(cjk_chars / CJK_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN)
+
+def count_content_tokens(content: Any) -> int:
+    """估算消息内容的token数，兼容多模态内容列表"""
+    if isinstance(content, str):
+        return count_tokens(content)
+    if isinstance(content, list):
+        return sum(
+            count_tokens(part.get("text"))
+            for part in content
+            if isinstance(part, dict)
+        )
+    return 0
+
+def count_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """估算消息列表的token数"""
+    return sum(
+        count_content_tokens(msg.get("content")) + MESSAGE_TOKEN_OVERHEAD
+        for msg in messages
+    )
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本，保留开头部分使其不超过max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    total_tokens = count_tokens(text)
+    if total_tokens <= max_tokens:
+        return text
+
+    # 按比例估算截断位置，再逐步收缩修正
+    end = int(len(text) * max_tokens / total_tokens)
+    while end > 0 and count_tokens(text[:end]) > max_tokens:
+        end = int(end * 0.9)
+    return text[:end]
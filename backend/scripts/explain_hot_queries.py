@@ -0,0 +1,94 @@
+"""检查热点查询的执行计划
+
+对聊天和复习模块中的热点查询执行EXPLAIN，任何一个查询出现全表扫描（type=ALL）时以非0状态退出，
+可以在执行数据库迁移后或CI中运行。表中数据很少时MySQL可能认为全表扫描更快，请在有代表性数据的库上检查。
+
+用法（在backend目录下）：
+    python -m scripts.explain_hot_queries
+"""
+from typing import List, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import sys
+from sqlalchemy import select, desc, func, text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.sql import Select
+from app.db.database import engine
+from app.db.models import Conversation, Message, RevisionTask, RevisionHistory
+from app.utils.dates import day_bounds
+
+# 示例参数，只影响执行计划中的常量
+SAMPLE_ID = 1
+
+def hot_queries() -> List[Tuple[str, Select]]:
+    """热点查询：名称和与服务中相同条件的查询语句"""
+    now = datetime.utcnow()
+    day_start, day_end = day_bounds(now)
+    return [
+        ("get_last_user_message", (
+            select(Message.id)
+            .where(Message.conversation_id == SAMPLE_ID, Message.role == "user")
+            .order_by(desc(Message.created_at))
+            .limit(1)
+        )),
+        ("history_page", (
+            select(Message.id)
+            .where(Message.conversation_id == SAMPLE_ID, Message.created_at <= now)
+            .order_by(desc(Message.created_at), desc(Message.id))
+            .limit(50)
+        )),
+        ("list_conversations", (
+            select(Conversation.id)
+            .order_by(desc(Conversation.updated_at), desc(Conversation.id))
+            .limit(20)
+        )),
+        ("get_next_task", (
+            select(RevisionTask.id)
+            .where(
+                RevisionTask.plan_id == SAMPLE_ID,
+                RevisionTask.status == "pending",
+                RevisionTask.scheduled_date <= now
+            )
+            .order_by(desc(RevisionTask.priority), RevisionTask.scheduled_date)
+            .limit(1)
+        )),
+        ("get_daily_tasks", (
+            select(RevisionTask.id)
+            .where(RevisionTask.scheduled_date >= day_start, RevisionTask.scheduled_date < day_end)
+        )),
+        ("revision_count", (
+            select(func.count(RevisionHistory.id))
+            .where(RevisionHistory.task_id == SAMPLE_ID)
+        )),
+        ("weekly_revisions", (
+            select(func.count(RevisionHistory.id))
+            .where(RevisionHistory.revision_date >= now - timedelta(days=7))
+        )),
+    ]
+
+async def explain_all() -> int:
+    """逐个执行EXPLAIN，返回出现全表扫描的查询数量"""
+    failures = 0
+    async with engine.connect() as conn:
+        for name, stmt in hot_queries():
+            sql = str(stmt.compile(dialect=mysql.dialect(), compile_kwargs={"literal_binds": True}))
+            rows = (await conn.execute(text(f"EXPLAIN {sql}"))).mappings().all()
+            full_scans = [row["table"] for row in rows if row["type"] == "ALL"]
+            plan = ", ".join(f"{row['table']}:{row['type']}:{row['key']}" for row in rows)
+            if full_scans:
+                failures += 1
+                print(f"[FAIL] {name}: 全表扫描 {', '.join(full_scans)} ({plan})")
+            else:
+                print(f"[ OK ] {name}: {plan}")
+    await engine.dispose()
+    return failures
+
+def main():
+    failures = asyncio.run(explain_all())
+    if failures:
+        print(f"{failures}个热点查询出现全表扫描")
+        sys.exit(1)
+    print("所有热点查询都使用了索引")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.services.ai_client import ai_client
+from app.utils.cache import cache_manager
+from app.utils.exceptions import APIError
+
+def test_cache_key_keeps_indentation():
+    """缓存键忽略换行符和行尾空白的差异，但区分缩进不同的代码"""
+    def key(text):
+        return ai_client._generate_cache_key([{"role": "user", "content": text}], "qwen-plus")
+
+    nested = "if ok:\n    run()\n    done()"
+    flat = "if ok:\n    run()\ndone()"
+    assert key(nested) != key(flat)
+    assert key("a  b") != key("a b")
+    assert key(nested) == key(nested.replace("\n", "  \r\n") + "\n\n\n")
+
+def test_cache_key_keeps_full_width_characters():
+    """全角标点和数字与半角形式使用不同的缓存键，组合字符与预组合字符使用相同的缓存键"""
+    def key(text):
+        return ai_client._generate_cache_key([{"role": "user", "content": text}], "qwen-plus")
+
+    assert key("第１章，概述") != key("第1章,概述")
+    assert key("cafe\u0301") == key("caf\u00e9")
+
+def test_single_flight_waiter_survives_leader_cancel(monkeypatch):
+    """发起方被取消时，等待中的相同请求自行重新调用而不是被一起取消"""
+    monkeypatch.setattr(settings, "AI_SINGLE_FLIGHT_REDIS", False)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return "ok"
+
+    async def scenario():
+        leader = asyncio.create_task(ai_client._single_flight("k", call))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(ai_client._single_flight("k", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await waiter == "ok"
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert not ai_client._inflight
+
+def test_shared_stream_follower_fails_fast_when_leader_fails(monkeypatch):
+    """相同流式请求的发起方在发布前失败时，跟随方立即收到错误而不是等待超时"""
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(cache_manager, "_redis", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(settings, "QWEN_API_TIMEOUT", 30)
+    messages = [{"role": "user", "content": "相同的流式请求"}]
+
+    async def failing_call(**kwargs):
+        await asyncio.sleep(0.1)
+        raise APIError("上游不可用")
+
+    monkeypatch.setattr(ai_client, "_make_api_call", failing_call)
+
+    async def follow():
+        source = await ai_client._open_stream_source(messages, "qwen-plus")
+        return [chunk async for chunk in source]
+
+    async def scenario():
+        leader = asyncio.create_task(ai_client._open_stream_source(messages, "qwen-plus"))
+        await asyncio.sleep(0.02)
+        follower = asyncio.create_task(follow())
+        with pytest.raises(APIError):
+            await leader
+        with pytest.raises(APIError, match="上游不可用"):
+            await asyncio.wait_for(follower, timeout=2)
+
+    asyncio.run(scenario())
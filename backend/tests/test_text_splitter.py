@@ -0,0 +1,49 @@
+import asyncio
+from app.utils.text_splitter import TextSplitter, split_sentences
+from app.utils.tokens import count_tokens
+
+def test_split_respects_token_budget_and_structure():
+    """分段不超过token预算，超大表格和代码块切分后保留表头和围栏"""
+    table = "| 名称 | 数值 |\n|---|---|\n" + "\n".join(f"| 项目{i} | {i} |" for i in range(200))
+    code = "```python\n" + "\n".join(f"value_{i} = {i}" for i in range(300)) + "\n```"
+    text = "# 报告\n\n" + "这是一段说明文字。" * 300 + "\n\n## 数据\n\n" + table + "\n\n" + code
+
+    chunks = list(TextSplitter(max_tokens=200, overlap_tokens=20).split(text))
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 200 for chunk in chunks)
+    table_chunks = [c for c in chunks if "| 项目" in c]
+    assert all("| 名称 | 数值 |\n|---|---|" in c for c in table_chunks)
+    code_chunks = [c for c in chunks if "value_" in c]
+    assert all(c.count("```") % 2 == 0 for c in code_chunks)
+    assert all(c.startswith("# 报告") for c in chunks)
+
+def test_split_overlap_and_sentences():
+    """相邻分段按句子重叠，短文本不切分"""
+    sentences = [f"第{i}句话的内容。" for i in range(100)]
+    chunks = list(TextSplitter(max_tokens=100, overlap_tokens=20).split("".join(sentences)))
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert split_sentences(previous)[-1] in current
+    assert list(TextSplitter(max_tokens=100).split("简短文本")) == ["简短文本"]
+
+def test_split_pages_matches_split():
+    """逐页切分与切分拼接后的全文结果相同，跨页的代码块不会被拆散"""
+    pages = [
+        "# 第一章\n\n" + "第一页的内容。" * 80 + "\n",
+        "```python\n",
+        "",
+        "\n".join(f"x_{i} = {i}" for i in range(50)) + "\n```\n\n## 第二节\n\n" + "第二页的内容。" * 80,
+    ]
+
+    async def _pages():
+        for page in pages:
+            yield page
+
+    async def _collect():
+        return [chunk async for chunk in splitter.split_pages(_pages())]
+
+    splitter = TextSplitter(max_tokens=150, overlap_tokens=20)
+    expected = list(splitter.split("\n".join(page for page in pages if page)))
+    assert asyncio.run(_collect()) == expected